@@ -0,0 +1,340 @@
+# Benchmarks of the tracking pipeline, run on synthetic videos.
+#
+# Usage: python benchmarks/bench_tracking.py --help
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+import motmot.FlyMovieFormat.FlyMovieFormat as FMF
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from epm._frame_sources import open_video
+from epm._tracking_algorithms import (
+    calc_background_image,
+    find_mouse,
+    threshold_image,
+    track_video,
+    track_video_batch
+)
+from epm._tracking_parallel import track_video_parallel
+from epm._tracking_profile import get_peak_memory
+from synthetic import write_synthetic_video
+
+# columns of the benchmark report.
+REPORT_COLUMNS = ['video', 'benchmark', 'seconds', 'frames_per_second',
+    'speedup', 'peak_memory_mb', 'found', 'mean_error', 'max_error', 'status']
+
+# name of the benchmark that whole-video benchmarks are compared against.
+REFERENCE_BENCHMARK = 'per-frame reference'
+
+def _run_and_send(func, args, sender):
+    """Target of the process started by run_in_subprocess()."""
+    start_memory = get_peak_memory()
+    start_time = time.time()
+    result = func(*args)
+    seconds = time.time() - start_time
+    peak_memory = None
+    if start_memory is not None:
+        peak_memory = get_peak_memory() - start_memory
+    sender.send((result, seconds, peak_memory))
+
+def run_in_subprocess(func, *args):
+    """Runs a function in a new process, so that its peak memory use can be
+    measured independently of anything that ran before it.
+
+    Returns
+    -------
+    result : object
+        Return value of func(*args).
+
+    seconds : float
+        Time taken by func.
+
+    peak_memory : int or None
+        Increase in the peak resident memory of the new process (in bytes)
+        while running func, or None if this can't be measured on the
+        current platform (see get_peak_memory).
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_and_send,
+        args=(func, args, sender))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+def get_accuracy(centroids, true_centroids):
+    """Compares detected centroids with ground truth.
+
+    Parameters
+    ----------
+    centroids : np.array of shape [N, 2]
+        Detected (rr, cc) centroids. Rows for frames in which the mouse
+        wasn't found should be np.nan.
+
+    true_centroids : np.array of shape [N, 2]
+
+    Returns
+    -------
+    found : float
+        Fraction of frames in which the mouse was found.
+
+    mean_error, max_error : float
+        Mean and max distance (in pixels) between detected and true
+        centroids, over frames in which the mouse was found.
+    """
+    is_found = ~np.any(np.isnan(centroids), axis=1)
+    if not np.any(is_found):
+        return 0., np.nan, np.nan
+    errors = np.sqrt(np.sum(
+        (centroids[is_found] - true_centroids[is_found]) ** 2, axis=1))
+    return np.mean(is_found), np.mean(errors), np.max(errors)
+
+def _bench_threshold_image(video_filename, b_img, threshold, ixs):
+    video = open_video(video_filename)
+    for ix in ixs:
+        threshold_image(video.get_frame(ix)[0], b_img, threshold)
+
+def _bench_find_mouse(video_filename, b_img, threshold, ixs):
+    video = open_video(video_filename)
+    centroids = np.empty((len(ixs), 2))
+    centroids.fill(np.nan)
+    for i, ix in enumerate(ixs):
+        props = find_mouse(video.get_frame(ix)[0], b_img, threshold)
+        if props != -1:
+            centroids[i] = props.centroid
+    return centroids
+
+def _bench_per_frame_reference(video_filename, threshold):
+    # tracks the way the original pipeline did: each frame is read from a
+    # FlyMovie, and tracked with find_mouse(), one at a time.
+    video = FMF.FlyMovie(video_filename)
+    b_img = calc_background_image(video)
+    centroids = np.empty((video.get_n_frames(), 2))
+    centroids.fill(np.nan)
+    for ix in xrange(video.get_n_frames()):
+        props = find_mouse(video.get_frame(ix)[0], b_img, threshold)
+        if props != -1:
+            centroids[ix] = props.centroid
+    return centroids
+
+def _bench_track_video(video_filename, kwargs):
+    results = track_video(open_video(video_filename), **kwargs)
+    return np.column_stack([results['rr'], results['cc']])
+
+def _bench_track_video_batch(video_filename, threshold):
+    results = track_video_batch(open_video(video_filename),
+        threshold=threshold)
+    return np.column_stack([results['rr'], results['cc']])
+
+def _bench_track_video_parallel(video_filename, threshold, n_processes):
+    results = track_video_parallel(video_filename, threshold=threshold,
+        n_processes=n_processes)
+    return np.column_stack([results['rr'], results['cc']])
+
+def get_track_video_configurations(height, width, threshold):
+    """Gets the (name, keyword arguments) of each configuration of
+    track_video() to benchmark."""
+    return [
+        ('track_video', {'threshold': threshold}),
+        ('track_video (video otsu)', {'threshold_mode': 'video'}),
+        ('track_video (local search)', {'threshold': threshold,
+            'search_window_size': min(height, width) // 4}),
+        ('track_video (pyramid x2)', {'threshold': threshold,
+            'pyramid_factor': 2}),
+        ('track_video (pyramid x4)', {'threshold': threshold,
+            'pyramid_factor': 4}),
+    ]
+
+def benchmark_video(video_filename, true_centroids, threshold=0.2,
+    n_sample_frames=200, max_error=1., min_found=0.99, n_processes=None):
+    """Benchmarks each stage of the tracking pipeline on a single video.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to synthetic video.
+
+    true_centroids : np.array of shape [n_frames, 2]
+        Ground-truth centroid of the mouse in each frame.
+
+    threshold : float, optional (default=0.2)
+        Threshold used for tracking.
+
+    n_sample_frames : int, optional (default=200)
+        How many frames to time threshold_image() and find_mouse() over.
+
+    max_error : float, optional (default=1.)
+        Largest allowable distance (in pixels) between a detected and true
+        centroid.
+
+    min_found : float, optional (default=0.99)
+        Smallest allowable fraction of frames in which the mouse is found.
+
+    n_processes : int or None, optional (default=None)
+        How many processes to benchmark track_video_parallel() with. If
+        None, the number of CPUs is used.
+
+    Returns
+    -------
+    rows : list of dict
+        One row of the benchmark report (see REPORT_COLUMNS) for
+        each benchmark. The speedup of each benchmark that tracks the whole
+        video is relative to REFERENCE_BENCHMARK. Peak memory of
+        track_video_parallel() only includes the parent process.
+    """
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+
+    video = open_video(video_filename)
+    n_frames = video.get_n_frames()
+    height, width = video.get_height(), video.get_width()
+    name = '{}x{}x{}'.format(height, width, n_frames)
+    ixs = np.linspace(0, n_frames - 1, min(n_sample_frames, n_frames)).astype(
+        np.int)
+
+    rows = []
+    reference_seconds = []
+    def add_row(benchmark, n_benchmark_frames, seconds, peak_memory,
+        centroids=None, true=None):
+        row = dict((column, np.nan) for column in REPORT_COLUMNS)
+        row.update({
+            'video': name,
+            'benchmark': benchmark,
+            'seconds': seconds,
+            'frames_per_second': n_benchmark_frames / seconds,
+            'status': ''
+            })
+        if peak_memory is not None:
+            row['peak_memory_mb'] = peak_memory / 2.**20
+        if benchmark == REFERENCE_BENCHMARK:
+            reference_seconds.append(seconds)
+        if n_benchmark_frames == n_frames and len(reference_seconds) > 0:
+            row['speedup'] = reference_seconds[0] / seconds
+        if centroids is not None:
+            found, mean_error, worst_error = get_accuracy(centroids, true)
+            row.update({
+                'found': found,
+                'mean_error': mean_error,
+                'max_error': worst_error,
+                'status': 'ok' if (found >= min_found and
+                    worst_error <= max_error) else 'FAIL'
+                })
+        rows.append(row)
+
+    b_img, seconds, peak_memory = run_in_subprocess(
+        calc_background_image, video)
+    add_row('calc_background_image', min(200, n_frames), seconds,
+        peak_memory)
+
+    _, seconds, peak_memory = run_in_subprocess(_bench_threshold_image,
+        video_filename, b_img, threshold, ixs)
+    add_row('threshold_image', len(ixs), seconds, peak_memory)
+
+    centroids, seconds, peak_memory = run_in_subprocess(_bench_find_mouse,
+        video_filename, b_img, threshold, ixs)
+    add_row('find_mouse', len(ixs), seconds, peak_memory, centroids,
+        true_centroids[ixs])
+
+    centroids, seconds, peak_memory = run_in_subprocess(
+        _bench_per_frame_reference, video_filename, threshold)
+    add_row(REFERENCE_BENCHMARK, n_frames, seconds, peak_memory, centroids,
+        true_centroids)
+
+    for benchmark, kwargs in get_track_video_configurations(
+        height, width, threshold):
+        centroids, seconds, peak_memory = run_in_subprocess(
+            _bench_track_video, video_filename, kwargs)
+        add_row(benchmark, n_frames, seconds, peak_memory, centroids,
+            true_centroids)
+
+    centroids, seconds, peak_memory = run_in_subprocess(
+        _bench_track_video_batch, video_filename, threshold)
+    add_row('track_video_batch', n_frames, seconds, peak_memory, centroids,
+        true_centroids)
+
+    centroids, seconds, peak_memory = run_in_subprocess(
+        _bench_track_video_parallel, video_filename, threshold, n_processes)
+    add_row('track_video_parallel (x{})'.format(n_processes), n_frames,
+        seconds, peak_memory, centroids, true_centroids)
+
+    return rows
+
+def _parse_list(value, parse_item):
+    return [parse_item(item) for item in value.split(',') if item != '']
+
+@click.command()
+@click.option('--sizes', default='240x320,480x640,960x1280',
+    show_default=True, help='Comma-separated HEIGHTxWIDTH frame sizes.')
+@click.option('--n-frames', default='500', show_default=True,
+    help='Comma-separated video lengths (in frames).')
+@click.option('--threshold', default=0.2, show_default=True,
+    help='Threshold used for tracking.')
+@click.option('--max-error', default=1., show_default=True,
+    help='Largest allowable centroid error (in pixels).')
+@click.option('--processes', '-j', type=int, default=None,
+    help='How many processes to benchmark track_video_parallel with '
+    '(defaults to the number of CPUs).')
+@click.option('--workdir', type=click.Path(file_okay=False), default=None,
+    help='Where to write synthetic videos (defaults to a temporary '
+    'directory, which is removed afterwards).')
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+    help='Where to save the report (.csv).')
+def main(sizes, n_frames, threshold, max_error, processes, workdir, output):
+    """Benchmark the tracking pipeline on synthetic plus maze videos, and
+    check detected centroids against ground truth."""
+    sizes = _parse_list(sizes, lambda size: tuple(
+        int(dim) for dim in size.lower().split('x')))
+    lengths = _parse_list(n_frames, int)
+
+    remove_workdir = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='epm-bench-')
+    elif not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    rows = []
+    try:
+        for height, width in sizes:
+            for length in lengths:
+                video_filename = os.path.join(workdir,
+                    'synthetic-{}x{}x{}.fmf'.format(height, width, length))
+                click.echo('Writing {}...'.format(video_filename), err=True)
+                true_centroids = write_synthetic_video(video_filename,
+                    height, width, length)
+                video_rows = benchmark_video(video_filename, true_centroids,
+                    threshold=threshold, max_error=max_error,
+                    n_processes=processes)
+                for row in video_rows:
+                    click.echo('{video:>16} {benchmark:<30} '
+                        '{frames_per_second:>9.1f} fps '
+                        '{peak_memory_mb:>8.1f} MB {status}'.format(**row),
+                        err=True)
+                rows.extend(video_rows)
+    finally:
+        if remove_workdir:
+            shutil.rmtree(workdir)
+
+    report = pd.DataFrame(rows, columns=REPORT_COLUMNS)
+    with pd.option_context('display.width', 200,
+        'display.max_columns', len(REPORT_COLUMNS)):
+        click.echo(report.to_string(index=False, float_format='%.3f'))
+    if output is not None:
+        report.to_csv(output, index=False)
+
+    n_failed = np.sum(report['status'] == 'FAIL')
+    if n_failed > 0:
+        raise click.ClickException('{} benchmarks failed accuracy '
+            'checks.'.format(n_failed))
+
+if __name__ == '__main__':
+    main()
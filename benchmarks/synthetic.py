@@ -0,0 +1,157 @@
+# Generation of synthetic .fmf videos (with a known mouse trajectory) for
+# benchmarking goes here.
+
+import motmot.FlyMovieFormat.FlyMovieFormat as FMF
+import numpy as np
+
+
+def get_plus_maze_image(height, width, arm_width=None):
+    """Draws a bright plus maze on a dark background.
+
+    Parameters
+    ----------
+    height, width : int
+        Shape of the image.
+
+    arm_width : int or None, optional (default=None)
+        Width of each arm, in pixels. If None, this is a sixth of the
+        smallest image dimension.
+
+    Returns
+    -------
+    maze : np.array of shape [height, width], dtype=np.float
+        Pixel values within [0, 255].
+
+    arms : np.array of shape [height, width], dtype=np.bool
+        Which pixels lie within the arms of the maze.
+    """
+    if arm_width is None:
+        arm_width = min(height, width) // 6
+    center_rr, center_cc = height // 2, width // 2
+    rr, cc = np.mgrid[:height, :width]
+    arms = ((np.abs(rr - center_rr) < arm_width // 2) |
+        (np.abs(cc - center_cc) < arm_width // 2))
+
+    # give the maze (and the room around it) some texture, so that the
+    # background isn't trivially flat.
+    maze = np.where(arms, 200., 60.)
+    maze += 15 * np.sin(rr / 23.) * np.cos(cc / 31.)
+    return np.clip(maze, 0, 255), arms
+
+def get_trajectory(height, width, n_frames, speed=None):
+    """Gets a trajectory that visits the end of each arm of a plus maze
+    (see get_plus_maze_image) in turn, passing through its center.
+
+    Parameters
+    ----------
+    height, width : int
+        Shape of the maze image.
+
+    n_frames : int
+        Number of positions to get.
+
+    speed : float or None, optional (default=None)
+        Distance moved (in pixels) per frame. If None, the mouse moves a
+        two-hundredth of the smallest image dimension per frame.
+
+    Returns
+    -------
+    centroids : np.array of shape [n_frames, 2]
+        (rr, cc) position of the mouse in each frame.
+    """
+    if speed is None:
+        speed = min(height, width) / 200.
+    center = np.array([height // 2, width // 2], dtype=np.float)
+    margin = min(height, width) // 8
+    ends = [
+        np.array([center[0], width - margin]),
+        np.array([margin, center[1]]),
+        np.array([center[0], margin]),
+        np.array([height - margin, center[1]])
+        ]
+    waypoints = []
+    for end in ends:
+        waypoints.extend([center, end])
+    waypoints.append(center)
+    waypoints = np.array(waypoints)
+
+    # distance along the path of each waypoint.
+    segment_lengths = np.sqrt(np.sum(np.diff(waypoints, axis=0) ** 2, axis=1))
+    waypoint_distances = np.concatenate([[0], np.cumsum(segment_lengths)])
+
+    # loop around the path as many times as needed.
+    distances = (np.arange(n_frames) * speed) % waypoint_distances[-1]
+    return np.column_stack([
+        np.interp(distances, waypoint_distances, waypoints[:, 0]),
+        np.interp(distances, waypoint_distances, waypoints[:, 1])
+        ])
+
+def draw_mouse(img, centroid, major_radius, minor_radius, value=20.):
+    """Draws a dark ellipse (a mouse) into an image.
+
+    Parameters
+    ----------
+    img : np.array, dtype=np.float
+        Image to draw into (in-place).
+
+    centroid : np.array of shape [2]
+        (rr, cc) center of the ellipse.
+
+    major_radius, minor_radius : float
+        Radii of the ellipse, along the rows and columns respectively.
+
+    value : float, optional (default=20.)
+        Pixel value of the mouse.
+    """
+    r0 = max(int(centroid[0] - major_radius) - 1, 0)
+    c0 = max(int(centroid[1] - minor_radius) - 1, 0)
+    r1 = min(int(centroid[0] + major_radius) + 2, img.shape[0])
+    c1 = min(int(centroid[1] + minor_radius) + 2, img.shape[1])
+    rr, cc = np.mgrid[r0:r1, c0:c1]
+    is_mouse = (((rr - centroid[0]) / major_radius) ** 2 +
+        ((cc - centroid[1]) / minor_radius) ** 2) <= 1
+    img[r0:r1, c0:c1][is_mouse] = value
+
+def write_synthetic_video(filename, height=240, width=320, n_frames=300,
+    noise=4., random_state=0):
+    """Writes a synthetic video of a dark mouse moving around a plus maze.
+
+    Parameters
+    ----------
+    filename : string
+        Where to save the video (as a MONO8 .fmf).
+
+    height, width : int, optional (default=240, 320)
+        Shape of each frame.
+
+    n_frames : int, optional (default=300)
+        Number of frames in the video.
+
+    noise : float, optional (default=4.)
+        Standard deviation of gaussian noise added to each frame.
+
+    random_state : int, optional (default=0)
+        Seed for noise.
+
+    Returns
+    -------
+    centroids : np.array of shape [n_frames, 2]
+        Ground-truth (rr, cc) centroid of the mouse in each frame.
+    """
+    rs = np.random.RandomState(random_state)
+    maze, _ = get_plus_maze_image(height, width)
+    centroids = get_trajectory(height, width, n_frames)
+    major_radius = min(height, width) / 24.
+    minor_radius = major_radius / 2.
+
+    saver = FMF.FlyMovieSaver(filename, version=3, format='MONO8')
+    try:
+        for ix in xrange(n_frames):
+            img = maze.copy()
+            draw_mouse(img, centroids[ix], major_radius, minor_radius)
+            img += rs.normal(0, noise, size=img.shape)
+            saver.add_frame(
+                np.clip(np.round(img), 0, 255).astype(np.uint8), ix / 30.)
+    finally:
+        saver.close()
+    return centroids
@@ -15,13 +15,23 @@ from widgets import (
     MaskWidget,
     ThresholdWidget,
 )
+from _frame_geometry import load_frame_geometry
 from _tracking_settings import TrackingSettings
 from _tracking_qobjects import Tracker
+from _tracking_algorithms import save_tracking_data
+from _tracking_checkpoint import (
+    CheckpointMismatchError,
+    get_checkpoint_filename,
+    get_n_checkpointed_frames,
+    remove_checkpoint
+)
+from _tracking_profile import get_profile_filename
 
 
 class TrackingDialog(QDialog):
 
     tracking_complete = pyqtSignal(bool, str)
+    tracking_preview = pyqtSignal(object)
 
     def __init__(self, video, parent=None):
         super(TrackingDialog, self).__init__(parent)
@@ -29,8 +39,13 @@ class TrackingDialog(QDialog):
         self.total_video_frames = video.get_n_frames()
         self.tracking_settings = TrackingSettings()
 
+        # the tracker runs in its own thread, so it must not have a parent.
         self.video_tracker = Tracker(self.video, self.tracking_settings)
         self.video_tracker.progress.connect(self.update_progress_bar)
+        self.video_tracker.preview.connect(self.tracking_preview)
+        self.video_tracker.completed.connect(self.save_tracking_results)
+        self.video_tracker.cancelled.connect(self.tracking_cancelled)
+        self.video_tracker.failed.connect(self.tracking_failed)
 
         self.setup_status_bar_ui()
         self.setup_ui()
@@ -54,11 +69,24 @@ class TrackingDialog(QDialog):
         self.previous_button.clicked.connect(self.previous_stacked_widget)
         self.track_button = QPushButton('Begin Tracking')
         self.track_button.clicked.connect(self.track_video)
+        self.pause_button = QPushButton('Pause')
+        self.pause_button.setCheckable(True)
+        self.pause_button.setEnabled(False)
+        self.pause_button.toggled.connect(self.pause_tracking)
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_tracking)
+        self.profile_checkbox = QCheckBox('Save Profile')
+        self.profile_checkbox.setToolTip('Save a report of the time spent '
+            'in each stage of tracking alongside the results.')
 
         layout.addWidget(self.stacked_widget, 0, 0, 4, 6)
         layout.addWidget(self.previous_button, 4, 0, 1, 1)
         layout.addWidget(self.next_button, 4, 1, 1, 1)
         layout.addWidget(self.track_button, 4, 2, 1, 1)
+        layout.addWidget(self.pause_button, 4, 3, 1, 1)
+        layout.addWidget(self.cancel_button, 4, 4, 1, 1)
+        layout.addWidget(self.profile_checkbox, 4, 5, 1, 1)
         layout.addWidget(self.status_bar, 5, 0, 1, 6)
 
         self.setLayout(layout)
@@ -100,38 +128,98 @@ class TrackingDialog(QDialog):
     @pyqtSlot(int)
     def update_progress_bar(self, progress):
         self.progress_bar.setValue(progress)
-        QApplication.processEvents()
+
+    def _get_checkpoint_filename(self):
+        """Gets the checkpoint kept alongside the video (or None, if the
+        video wasn't opened from a file)."""
+        video_filename = getattr(self.video, 'filename', None)
+        if video_filename is None:
+            return None
+        return get_checkpoint_filename(video_filename)
+
+    def set_tracking_controls(self, is_tracking):
+        """Enables the pause and cancel buttons while tracking, and
+        everything else otherwise."""
+        for widget in [self.stacked_widget, self.previous_button,
+            self.next_button, self.track_button, self.profile_checkbox]:
+            widget.setEnabled(not is_tracking)
+        self.pause_button.setEnabled(is_tracking)
+        self.cancel_button.setEnabled(is_tracking)
+        if not is_tracking:
+            self.pause_button.setChecked(False)
 
     @pyqtSlot()
     def track_video(self):
-        self.props = self.video_tracker.track_video()
-
-        tracking_data = pd.DataFrame()
-        rr, cc = [], []
-        maj, minor, area = [], [], []
-
-        for prop in self.props:
-            if prop == -1:
-                rr.append(np.nan)
-                cc.append(np.nan)
-                maj.append(np.nan)
-                minor.append(np.nan)
-                area.append(np.nan)
-                continue
-
-            rr_, cc_ = prop.centroid
-            rr.append(rr_)
-            cc.append(cc_)
-            maj.append(prop.major_axis_length)
-            minor.append(prop.minor_axis_length)
-            area.append(prop.area)
-
-        tracking_data['rr'] = rr
-        tracking_data['cc'] = cc
-        tracking_data['area'] = area
-        tracking_data['maj'] = maj
-        tracking_data['min'] = minor
+        """Starts tracking in a worker thread, resuming from (and saving
+        to) a checkpoint alongside the video, if possible."""
+        self.set_tracking_controls(True)
+        self.status_bar.showMessage('Tracking...')
+        self.video_tracker.profile = self.profile_checkbox.isChecked()
+        self.video_tracker.start(self._get_checkpoint_filename())
+
+    @pyqtSlot(bool)
+    def pause_tracking(self, is_paused):
+        if is_paused:
+            self.video_tracker.pause()
+            self.pause_button.setText('Resume')
+            self.status_bar.showMessage('Paused.')
+        else:
+            self.video_tracker.resume()
+            self.pause_button.setText('Pause')
+            self.status_bar.showMessage('Tracking...')
+
+    @pyqtSlot()
+    def cancel_tracking(self):
+        self.cancel_button.setEnabled(False)
+        self.video_tracker.cancel()
 
+    @pyqtSlot()
+    def tracking_cancelled(self):
+        self.video_tracker.wait()
+        self.set_tracking_controls(False)
+        message = 'Tracking cancelled.'
+        # results are only checkpointed every so often (and, when tracking
+        # progressively, only once every pass is complete).
+        checkpoint_filename = self._get_checkpoint_filename()
+        if checkpoint_filename is not None and \
+            get_n_checkpointed_frames(checkpoint_filename) > 0:
+            message += ' Progress was saved, and will be resumed.'
+        self.status_bar.showMessage(message)
+
+    @pyqtSlot(object, str)
+    def tracking_failed(self, error, formatted_traceback):
+        self.video_tracker.wait()
+        self.set_tracking_controls(False)
+        self.status_bar.clearMessage()
+
+        checkpoint_filename = self._get_checkpoint_filename()
+        if isinstance(error, CheckpointMismatchError):
+            reply = QMessageBox.question(self, 'Discard Checkpoint?',
+                '{}\n\nDiscard it and track from the first frame?'.format(
+                    error),
+                QMessageBox.Yes | QMessageBox.No)
+            if reply == QMessageBox.Yes:
+                remove_checkpoint(checkpoint_filename)
+                self.track_video()
+            return
+
+        message_box = QMessageBox(QMessageBox.Critical, 'Tracking Failed',
+            str(error), QMessageBox.Ok, self)
+        message_box.setDetailedText(formatted_traceback)
+        message_box.exec_()
+
+    def reject(self):
+        # stop tracking before the dialog (and its tracker) goes away.
+        if self.video_tracker.is_running():
+            self.video_tracker.cancel()
+            self.video_tracker.wait()
+        super(TrackingDialog, self).reject()
+
+    @pyqtSlot(object)
+    def save_tracking_results(self, results):
+        self.video_tracker.wait()
+        self.set_tracking_controls(False)
+        self.results = results
         if self.tracking_settings.save_filename is not None:
             savename = self.tracking_settings.save_filename
             if savename.split('.')[-1] != 'xlsx':
@@ -143,11 +231,25 @@ class TrackingDialog(QDialog):
                 )
             savename += '.xlsx'
 
-        tracking_data.to_excel(
-            savename,
-            na_rep='NA',
-            index_label='frame',
-            sheet_name='RawData')
+        # results are saved in the coordinates of the video it was
+        # converted from, if it was cropped or scaled.
+        geometry = None
+        video_filename = getattr(self.video, 'filename', None)
+        if video_filename is not None:
+            geometry = load_frame_geometry(video_filename)
+        tracking_profile = self.video_tracker.tracking_profile
+        if tracking_profile is not None:
+            with tracking_profile.stage('save'):
+                save_tracking_data(self.results, savename, geometry)
+            tracking_profile.stop()
+            tracking_profile.save(get_profile_filename(savename))
+        else:
+            save_tracking_data(self.results, savename, geometry)
+
+        # results are safely on disk, so we no longer need the checkpoint.
+        checkpoint_filename = self._get_checkpoint_filename()
+        if checkpoint_filename is not None:
+            remove_checkpoint(checkpoint_filename)
 
         self.tracking_complete.emit(True, savename)
         self.close()
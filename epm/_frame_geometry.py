@@ -0,0 +1,213 @@
+# Mapping between the frames of converted (cropped and/or scaled) videos
+# and the frames of the videos they were converted from goes here.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+def get_geometry_filename(video_filename):
+    """Gets the name of the sidecar file that records how a converted video
+    was cropped and scaled.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to converted video.
+
+    Returns
+    -------
+    geometry_filename : string
+        The video's filename, with its extension replaced by
+        '-geometry.json'.
+    """
+    return os.path.splitext(video_filename)[0] + '-geometry.json'
+
+def get_arena_bounds(arena, shape):
+    """Gets the bounding box of an arena.
+
+    Parameters
+    ----------
+    arena : string, tuple, or np.array
+        Either (1) a mask saved with np.save (.npy), (2) an .xlsx file
+        containing the pixel coordinates ('rr' and 'cc' columns) of the
+        arena's points (the '-pixel-coords.xlsx' file saved by MaskWidget,
+        as read by EPMArena), (3) a boolean mask, or (4) a
+        (top, left, height, width) bounding box. Coordinates are in pixels
+        of the source video.
+
+    shape : tuple
+        (height, width) of the source video. The bounding box is clipped to
+        lie within frames of this shape.
+
+    Returns
+    -------
+    bounds : tuple of int
+        (top, left, height, width) of the bounding box.
+    """
+    if isinstance(arena, basestring):
+        if arena.endswith('.npy'):
+            arena = np.load(arena)
+        else:
+            points_df = pd.read_excel(arena)
+            points = points_df[['rr', 'cc']].values
+            top, left = np.floor(points.min(axis=0)).astype(int)
+            bottom, right = np.ceil(points.max(axis=0)).astype(int) + 1
+            arena = (top, left, bottom - top, right - left)
+
+    if isinstance(arena, np.ndarray):
+        rr, cc = np.nonzero(arena)
+        if rr.size == 0:
+            raise ValueError('Arena mask is empty.')
+        arena = (rr.min(), cc.min(),
+            rr.max() - rr.min() + 1, cc.max() - cc.min() + 1)
+
+    top, left, height, width = [int(value) for value in arena]
+    bottom = min(top + height, shape[0])
+    right = min(left + width, shape[1])
+    top, left = max(top, 0), max(left, 0)
+    if bottom <= top or right <= left:
+        raise ValueError('Arena {} lies outside of frames of shape '
+            '{}.'.format(arena, tuple(shape)))
+    return top, left, bottom - top, right - left
+
+def load_frame_geometry(video_filename):
+    """Loads the geometry of a converted video from its sidecar file.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to converted video.
+
+    Returns
+    -------
+    geometry : FrameGeometry or None
+        None if the video has no sidecar (ie. its frames have the same
+        geometry as the source video's).
+    """
+    geometry_filename = get_geometry_filename(video_filename)
+    if not os.path.isfile(geometry_filename):
+        return None
+    with open(geometry_filename, 'r') as f:
+        geometry = json.load(f)
+    return FrameGeometry(geometry['offset'], geometry['scale'],
+        geometry['source_shape'])
+
+
+class FrameGeometry:
+    """Maps coordinates between the frames of a converted video and the
+    frames of its source video.
+
+    A converted frame is the region of the source frame starting at
+    `offset`, resized by `scale`. Coordinates refer to pixel centers, so
+    pixel (r, c) of a converted frame covers source pixels
+    offset + [r, r + 1) * scale (and likewise for columns).
+
+    Parameters
+    ----------
+    offset : tuple of int
+        (row, column) of the source frame at which the crop starts.
+
+    scale : tuple of float
+        How many source pixels each converted pixel spans, as
+        (rows, columns).
+
+    source_shape : tuple of int
+        (height, width) of the source video.
+    """
+    def __init__(self, offset, scale, source_shape):
+        self.offset = np.array(offset, dtype=np.float)
+        self.scale = np.array(scale, dtype=np.float)
+        self.source_shape = tuple(int(value) for value in source_shape)
+
+    def is_identity(self):
+        """Checks whether converted and source frames have the same
+        geometry."""
+        return (np.all(self.offset == 0) and np.all(self.scale == 1))
+
+    def to_source(self, points):
+        """Maps (rr, cc) points from converted to source coordinates.
+
+        Parameters
+        ----------
+        points : np.array of shape [N, 2]
+
+        Returns
+        -------
+        source_points : np.array of shape [N, 2]
+        """
+        return (np.asarray(points) + 0.5) * self.scale + self.offset - 0.5
+
+    def from_source(self, points):
+        """Maps (rr, cc) points from source to converted coordinates.
+
+        Parameters
+        ----------
+        points : np.array of shape [N, 2]
+
+        Returns
+        -------
+        converted_points : np.array of shape [N, 2]
+        """
+        return (np.asarray(points) - self.offset + 0.5) / self.scale - 0.5
+
+    def resample_mask(self, mask, shape):
+        """Resamples a mask drawn on source frames onto converted frames.
+
+        Parameters
+        ----------
+        mask : np.array of shape source_shape
+
+        shape : tuple
+            (height, width) of the converted video.
+
+        Returns
+        -------
+        converted_mask : np.array of shape `shape`
+            Each pixel takes the value of the source pixel nearest its
+            center.
+        """
+        rr = self.to_source(np.column_stack([
+            np.arange(shape[0]), np.zeros(shape[0])]))[:, 0]
+        cc = self.to_source(np.column_stack([
+            np.zeros(shape[1]), np.arange(shape[1])]))[:, 1]
+        rr = np.clip(np.round(rr).astype(int), 0, mask.shape[0] - 1)
+        cc = np.clip(np.round(cc).astype(int), 0, mask.shape[1] - 1)
+        return mask[np.ix_(rr, cc)]
+
+    def results_to_source(self, results):
+        """Maps tracking results from converted to source coordinates.
+
+        Parameters
+        ----------
+        results : np.array, dtype=TRACKING_DTYPE
+
+        Returns
+        -------
+        source_results : np.array, dtype=TRACKING_DTYPE
+            A copy of results, with positions mapped to source coordinates,
+            areas scaled by the area of each converted pixel, and axis
+            lengths scaled by the geometric mean of `scale` (which is exact
+            if the aspect ratio was kept).
+        """
+        source_results = results.copy()
+        points = self.to_source(np.column_stack(
+            [results['rr'], results['cc']]))
+        source_results['rr'] = points[:, 0]
+        source_results['cc'] = points[:, 1]
+        source_results['area'] *= np.prod(self.scale)
+        axis_scale = np.sqrt(np.prod(self.scale))
+        source_results['maj'] *= axis_scale
+        source_results['min'] *= axis_scale
+        return source_results
+
+    def save(self, video_filename):
+        """Saves this geometry to the sidecar file of a converted video
+        (see get_geometry_filename)."""
+        with open(get_geometry_filename(video_filename), 'w') as f:
+            json.dump({
+                'offset': self.offset.tolist(),
+                'scale': self.scale.tolist(),
+                'source_shape': list(self.source_shape)
+            }, f, indent=2)
@@ -0,0 +1,663 @@
+# Frame sources (readers that feed frames to the tracker) go here.
+
+import json
+import os
+import Queue
+import subprocess
+import tempfile
+import threading
+import warnings
+
+import motmot.FlyMovieFormat.FlyMovieFormat as FMF
+import numpy as np
+
+from _frame_store import ChunkedFrameStore, FRAME_STORE_EXTENSION
+
+
+class MemmapFlyMovie:
+    """Memory-mapped, read-only .fmf (FlyMovieFormat) video.
+
+    The whole movie is exposed as a single (N, H, W) array view, so frames
+    (or blocks of frames) can be sliced without any copying or per-frame
+    file I/O. This implements the parts of the
+    motmot.FlyMovieFormat.FlyMovie interface used by this package, and,
+    unlike a FlyMovie, is safe to read from multiple threads at once.
+
+    Only MONO8 (and RAW8) videos are supported.
+
+    Parameters
+    ----------
+    filename : string
+        Path to .fmf video.
+
+    Attributes
+    ----------
+    frames : np.memmap of shape [N, H, W], dtype=np.uint8
+        Image data of every frame in the video.
+
+    timestamps : np.memmap of shape [N], dtype=np.float
+        Timestamp of every frame in the video.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+        fmf = FMF.FlyMovie(filename)
+        try:
+            if fmf.get_format() not in ['MONO8', 'RAW8']:
+                raise ValueError('Can only memory-map MONO8 videos, '
+                    'not {}.'.format(fmf.get_format()))
+            self.format = fmf.get_format()
+            self.framesize = fmf.framesize
+            self.bytes_per_chunk = fmf.bytes_per_chunk
+            self.chunk_start = fmf.chunk_start
+            # ignore any partially-written frame at the end of the file.
+            n_frames = min(fmf.get_n_frames(),
+                fmf.compute_n_frames_from_file_size(only_full_frames=True))
+        finally:
+            fmf.close()
+
+        chunk_dtype = np.dtype([
+            ('timestamp', '<f8'),
+            ('frame', np.uint8, tuple(self.framesize))
+            ])
+        assert chunk_dtype.itemsize == self.bytes_per_chunk
+
+        if n_frames > 0:
+            self._chunks = np.memmap(filename, dtype=chunk_dtype, mode='r',
+                offset=self.chunk_start, shape=(n_frames,))
+        else:
+            self._chunks = np.zeros(0, dtype=chunk_dtype)
+        self.frames = self._chunks['frame']
+        self.timestamps = self._chunks['timestamp']
+
+    def get_n_frames(self):
+        return self.frames.shape[0]
+
+    def get_height(self):
+        return self.framesize[0]
+
+    def get_width(self):
+        return self.framesize[1]
+
+    def get_format(self):
+        return self.format
+
+    def get_frame(self, frame_number):
+        """Gets a single frame (as a read-only view) and its timestamp."""
+        if frame_number >= self.get_n_frames():
+            raise FMF.NoMoreFramesException('EOF')
+        return self.frames[frame_number], self.timestamps[frame_number]
+
+    def get_frames(self, start, stop):
+        """Gets a block of frames [start, stop) as read-only views.
+
+        Returns
+        -------
+        frames : np.array of shape [stop - start, H, W], dtype=np.uint8
+
+        timestamps : np.array of shape [stop - start], dtype=np.float
+        """
+        return self.frames[start:stop], self.timestamps[start:stop]
+
+    def get_all_timestamps(self):
+        return self.timestamps
+
+    def close(self):
+        """Releases the memory map."""
+        self.frames = self.timestamps = self._chunks = None
+
+
+def _parse_frame_rate(rate):
+    """Parses a frame rate given by ffprobe as a fraction (eg. '30000/1001'),
+    returning None if it is unknown ('0/0')."""
+    numerator, _, denominator = rate.partition('/')
+    if float(denominator or 1) == 0 or float(numerator) == 0:
+        return None
+    return float(numerator) / float(denominator or 1)
+
+def probe_video(filename, count_frames=True):
+    """Gets the size, length, and frame rate of a video using ffprobe.
+
+    Parameters
+    ----------
+    filename : string
+        Path to video, in any format ffmpeg can read.
+
+    count_frames : bool, optional (default=True)
+        Whether to count frames from the video's packets. This doesn't
+        require decoding the video, so the count is exact for most files,
+        but still means reading the whole file. If False, the number of
+        frames is taken from the container's header or, failing that,
+        estimated from the video's duration and frame rate (which is only
+        approximate, and is 0 if neither is known).
+
+    Returns
+    -------
+    info : dict
+        Contains the 'width', 'height', 'n_frames', and 'fps' (frames per
+        second) of the first video stream.
+
+    Raises
+    ------
+    IOError
+        If ffprobe isn't installed, or the video can't be read.
+    """
+    if count_frames:
+        count_options = ['-count_packets']
+        entries = 'stream=width,height,nb_read_packets,avg_frame_rate,' \
+            'r_frame_rate'
+    else:
+        count_options = []
+        entries = 'stream=width,height,nb_frames,duration,avg_frame_rate,' \
+            'r_frame_rate:format=duration'
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0'] + \
+        count_options + ['-show_entries', entries, '-of', 'json', filename]
+    try:
+        output = subprocess.check_output(command, stderr=subprocess.STDOUT)
+    except OSError:
+        raise IOError('ffprobe must be installed to read {}.'.format(filename))
+    except subprocess.CalledProcessError as e:
+        raise IOError('Could not read {}: {}'.format(
+            filename, e.output.strip()))
+
+    output = json.loads(output)
+    streams = output.get('streams', [])
+    if len(streams) == 0:
+        raise IOError('No video stream found in {}.'.format(filename))
+    stream = streams[0]
+    fps = _parse_frame_rate(stream.get('avg_frame_rate', '0/0'))
+    if fps is None:
+        fps = _parse_frame_rate(stream.get('r_frame_rate', '0/0'))
+
+    if count_frames:
+        n_frames = int(stream.get('nb_read_packets', 0))
+    else:
+        n_frames = str(stream.get('nb_frames', ''))
+        n_frames = int(n_frames) if n_frames.isdigit() else 0
+        duration = stream.get('duration', 'N/A')
+        if duration == 'N/A':
+            duration = output.get('format', {}).get('duration', 'N/A')
+        if n_frames == 0 and duration != 'N/A' and fps is not None:
+            n_frames = int(round(float(duration) * fps))
+    return {
+        'width': int(stream['width']),
+        'height': int(stream['height']),
+        'n_frames': n_frames,
+        'fps': fps
+    }
+
+
+def get_decode_command(filename, width=None, height=None, fps=None,
+    crop=None):
+    """Gets the ffmpeg command that decodes a video to raw MONO8 frames,
+    written to stdout.
+
+    Parameters
+    ----------
+    filename : string
+        Path to video.
+
+    width, height : int or None, optional (default=None)
+        If given, frames are scaled to this size.
+
+    fps : float or None, optional (default=None)
+        If given, frames are duplicated or dropped to give this frame rate.
+        Otherwise, every decoded frame is passed through as-is.
+
+    crop : tuple of int or None, optional (default=None)
+        If given, frames are cropped to this (top, left, height, width)
+        region before being scaled.
+
+    Returns
+    -------
+    command : list of string
+    """
+    command = [
+        'ffmpeg',
+        '-v', 'error',
+        '-i', filename,
+        '-map', '0:v:0',
+        '-an',
+    ]
+    if fps is None:
+        command.extend(['-vsync', '0'])
+    else:
+        command.extend(['-r', str(fps)])
+    filters = []
+    if crop is not None:
+        top, left, crop_height, crop_width = crop
+        filters.append('crop={}:{}:{}:{}'.format(
+            crop_width, crop_height, left, top))
+    if width is not None and height is not None:
+        filters.append('scale={}:{}'.format(width, height))
+    if len(filters) > 0:
+        command.extend(['-vf', ','.join(filters)])
+    command.extend(['-f', 'rawvideo', '-pix_fmt', 'gray', '-'])
+    return command
+
+
+class FFmpegVideo:
+    """Read-only video of any format ffmpeg can read, decoded by an ffmpeg
+    process and streamed (as MONO8 frames) through a pipe.
+
+    This implements the parts of the motmot.FlyMovieFormat.FlyMovie
+    interface used by this package, so compressed videos can be tracked
+    without first being converted to .fmf. Frames are cheapest to read in
+    ascending order; skipping forward decodes (and discards) the frames in
+    between, and going backward restarts decoding from the first frame.
+
+    Reads are serialized by a lock, so an FFmpegVideo can be shared between
+    threads (see open_thread_handle). As the decoder keeps its position
+    between reads, a video tracked in chunks is only decoded once.
+
+    The number of frames is counted from the video's packets (see
+    probe_video), and a few of these may not decode to frames. If the
+    decoder reaches the end of the video early, n_frames is cut to the
+    number of frames that were decoded (with a warning), and reads are
+    truncated to match.
+
+    Parameters
+    ----------
+    filename : string
+        Path to video.
+
+    width, height : int or None, optional (default=None)
+        Size to scale each frame to. If None, frames keep the size of
+        the video.
+
+    info : dict or None, optional (default=None)
+        Output of probe_video() for this video. If None, the video
+        is probed.
+
+    Attributes
+    ----------
+    fps : float or None
+        Frame rate of the video. Timestamps of frames are their index
+        divided by this (or their index, if the frame rate is unknown).
+
+    n_frames : int
+        Number of frames in the video.
+    """
+    def __init__(self, filename, width=None, height=None, info=None):
+        self.filename = filename
+        if info is None:
+            info = probe_video(filename)
+        self.info = info
+        self.width = info['width'] if width is None else width
+        self.height = info['height'] if height is None else height
+        self.n_frames = info['n_frames']
+        self.fps = info['fps']
+        self.format = 'MONO8'
+        self.framesize = (self.height, self.width)
+        self.bytes_per_frame = self.width * self.height
+
+        self._process = None
+        self._stderr = None
+        # index of the next frame to come out of the pipe.
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def get_n_frames(self):
+        return self.n_frames
+
+    def get_height(self):
+        return self.height
+
+    def get_width(self):
+        return self.width
+
+    def get_format(self):
+        return self.format
+
+    def _start(self):
+        """(Re)starts decoding from the first frame."""
+        self._stop()
+        if (self.width, self.height) == (
+            self.info['width'], self.info['height']):
+            command = get_decode_command(self.filename)
+        else:
+            command = get_decode_command(
+                self.filename, self.width, self.height)
+
+        # errors are written to a file rather than a pipe, so that a
+        # chatty decoder can't fill the pipe and block.
+        self._stderr = tempfile.TemporaryFile()
+        try:
+            self._process = subprocess.Popen(command,
+                stdout=subprocess.PIPE, stderr=self._stderr,
+                bufsize=self.bytes_per_frame * 16)
+        except OSError:
+            self._stderr.close()
+            self._stderr = None
+            raise IOError('ffmpeg must be installed to read {}.'.format(
+                self.filename))
+        self._position = 0
+
+    def _stop(self):
+        """Stops the decoder (if it's running)."""
+        if self._process is not None:
+            self._process.stdout.close()
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.wait()
+            self._process = None
+        if self._stderr is not None:
+            self._stderr.close()
+            self._stderr = None
+
+    def _read(self, n_frames):
+        """Reads the next n_frames frames from the pipe.
+
+        Returns
+        -------
+        frames : np.array of shape [N, H, W], dtype=np.uint8
+            N is less than n_frames if the decoder reached the end of the
+            video first (in which case, n_frames is updated).
+        """
+        n_bytes = n_frames * self.bytes_per_frame
+        data = self._process.stdout.read(n_bytes)
+        if len(data) != n_bytes:
+            self._stderr.seek(0)
+            message = self._stderr.read().strip()
+            start = self._position
+            # stdout has been closed, so the decoder has finished.
+            returncode = self._process.wait()
+            self._stop()
+            if returncode != 0:
+                raise FMF.NoMoreFramesException(
+                    'could not read frames {}-{} of {}{}'.format(
+                        start, start + n_frames, self.filename,
+                        ': ' + message if message else ''))
+
+            n_frames = len(data) // self.bytes_per_frame
+            data = data[:n_frames * self.bytes_per_frame]
+            warnings.warn('{} ended after {} frames, rather than the {} '
+                'counted by ffprobe.'.format(
+                    self.filename, start + n_frames, self.n_frames))
+            self.n_frames = start + n_frames
+        self._position += n_frames
+        return np.frombuffer(data, dtype=np.uint8).reshape(
+            (n_frames, self.height, self.width))
+
+    def _seek(self, frame_number):
+        """Moves the decoder to the given frame."""
+        if self._process is None or frame_number < self._position:
+            self._start()
+        # discard frames in blocks, to bound memory use (stopping early if
+        # the video turns out to end before frame_number).
+        while self._position < min(frame_number, self.n_frames):
+            self._read(min(frame_number - self._position, 64))
+
+    def get_timestamps(self, start, stop):
+        """Gets the timestamps of frames [start, stop)."""
+        timestamps = np.arange(start, stop, dtype=np.float)
+        if self.fps is not None:
+            timestamps /= self.fps
+        return timestamps
+
+    def get_frame(self, frame_number):
+        """Gets a single frame and its timestamp."""
+        with self._lock:
+            if frame_number < self.n_frames:
+                self._seek(frame_number)
+            # seeking may have found that the video ends before frame_number.
+            imgs = self._read(1) if frame_number < self.n_frames else None
+        if imgs is None or imgs.shape[0] == 0:
+            raise FMF.NoMoreFramesException('EOF')
+        return imgs[0], self.get_timestamps(frame_number, frame_number + 1)[0]
+
+    def get_frames(self, start, stop):
+        """Gets a block of frames [start, stop), with a single read from
+        the pipe.
+
+        Returns
+        -------
+        frames : np.array of shape [N, H, W], dtype=np.uint8
+            N is stop - start, unless the video ends before stop (in which
+            case, the frames up to the end are returned).
+
+        timestamps : np.array of shape [N], dtype=np.float
+        """
+        with self._lock:
+            if start < self.n_frames:
+                self._seek(start)
+            stop = max(start, min(stop, self.n_frames))
+            frames = np.zeros((0,) + self.framesize, dtype=np.uint8)
+            if stop > start:
+                frames = self._read(stop - start)
+        return frames, self.get_timestamps(start, start + frames.shape[0])
+
+    def get_all_timestamps(self):
+        return self.get_timestamps(0, self.get_n_frames())
+
+    def close(self):
+        """Stops the decoder."""
+        with self._lock:
+            self._stop()
+
+
+def open_video(filename, memmap=True):
+    """Opens a video for reading.
+
+    Parameters
+    ----------
+    filename : string
+        Path to video. Chunked frame stores (.cfs) are opened as a
+        ChunkedFrameStore. Videos that aren't .fmf files are streamed
+        through ffmpeg (see FFmpegVideo), rather than converted to .fmf
+        first.
+
+    memmap : bool, optional (default=True)
+        Whether to open .fmf videos as a MemmapFlyMovie, if possible.
+
+    Returns
+    -------
+    video : MemmapFlyMovie, motmot.FlyMovieFormat.FlyMovie,
+        ChunkedFrameStore, or FFmpegVideo
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == FRAME_STORE_EXTENSION:
+        return ChunkedFrameStore(filename)
+    if extension != '.fmf':
+        return FFmpegVideo(filename)
+    if memmap:
+        try:
+            return MemmapFlyMovie(filename)
+        except ValueError:
+            pass
+    return FMF.FlyMovie(filename)
+
+
+def open_thread_handle(vid):
+    """Gets a handle to a video that can be read from the calling thread,
+    independently of any other threads.
+
+    FlyMovies opened from a file are re-opened, as they keep track of their
+    current position within the file. Any other video (including a
+    ChunkedFrameStore or an FFmpegVideo, which serialize their own reads)
+    is returned as-is.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie, MemmapFlyMovie,
+        ChunkedFrameStore, or FFmpegVideo
+
+    Returns
+    -------
+    handle : motmot.FlyMovieFormat.FlyMovie, MemmapFlyMovie,
+        ChunkedFrameStore, or FFmpegVideo
+        Video handle.
+
+    opened : bool
+        Whether a new handle was opened (which should then be closed
+        by the caller).
+    """
+    if isinstance(vid, FMF.FlyMovie) and vid.filename is not None:
+        return FMF.FlyMovie(vid.filename), True
+    return vid, False
+
+
+def read_frame_block(vid, start, stop):
+    """Reads a contiguous block of frames from a video.
+
+    For MemmapFlyMovies, the returned block is a view into the video. For
+    MONO8 FlyMovies, the whole block is read with a single sequential
+    read from disk, for ChunkedFrameStores by decompressing only the chunks
+    it spans, and for FFmpegVideos with a single read from the decoder's
+    pipe. Otherwise, frames are read one at a time.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie, MemmapFlyMovie,
+        ChunkedFrameStore, or FFmpegVideo
+        Video to read frames from.
+
+    start : int
+        Index of first frame to read.
+
+    stop : int
+        Index of frame to stop reading at (exclusive).
+
+    Returns
+    -------
+    frames : np.array of shape [stop - start, H, W], dtype=np.uint8
+        Image data of each frame. For FFmpegVideos, this has fewer frames
+        if the video turns out to end before stop (see FFmpegVideo).
+
+    timestamps : np.array of shape [stop - start], dtype=np.float
+        Timestamp of each frame.
+    """
+    n_frames = stop - start
+    if isinstance(vid, (MemmapFlyMovie, ChunkedFrameStore, FFmpegVideo)):
+        return vid.get_frames(start, stop)
+
+    if isinstance(vid, FMF.FlyMovie) and vid.format in ['MONO8', 'RAW8']:
+        chunk_dtype = np.dtype([
+            ('timestamp', '<f8'),
+            ('frame', np.uint8, tuple(vid.framesize))
+            ])
+        vid.seek(start)
+        data = vid.file.read(vid.bytes_per_chunk * n_frames)
+        if len(data) != vid.bytes_per_chunk * n_frames:
+            raise FMF.NoMoreFramesException(
+                'could not read frames {}-{}'.format(start, stop))
+        chunks = np.frombuffer(data, dtype=chunk_dtype)
+        return chunks['frame'], chunks['timestamp']
+
+    frames = np.empty(shape=(n_frames, vid.get_height(), vid.get_width()),
+        dtype=np.uint8)
+    timestamps = np.empty(n_frames, dtype=np.float)
+    for i, ix in enumerate(xrange(start, stop)):
+        frames[i], timestamps[i] = vid.get_frame(ix)
+    return frames, timestamps
+
+
+class FramePrefetcher:
+    """Reads frames from a video in a background thread, so that reading
+    from disk overlaps with processing of previously-read frames.
+
+    Frames are read sequentially, in blocks, and placed into a bounded
+    queue. Iterating over a FramePrefetcher yields frames in order.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie, MemmapFlyMovie,
+        ChunkedFrameStore, or FFmpegVideo
+        Video to read frames from. The reader thread uses its own handle to
+        the video (see open_thread_handle), so that `vid` can still be
+        safely used from other threads.
+
+    start : int, optional (default=0)
+        Index of first frame to read.
+
+    stop : int or None, optional (default=None)
+        Index of frame to stop reading at (exclusive). If None, frames are
+        read until the end of the video.
+
+    block_size : int, optional (default=64)
+        How many frames to read from disk at a time.
+
+    max_blocks : int, optional (default=4)
+        Maximum number of blocks held in the queue at once.
+
+    Examples
+    --------
+    >>> for ix, img, timestamp in FramePrefetcher(vid):
+    ...     props = detector.detect(img)
+    """
+    def __init__(self, vid, start=0, stop=None, block_size=64, max_blocks=4):
+        self.vid = vid
+        self.start = start
+        self.stop = vid.get_n_frames() if stop is None else stop
+        self.block_size = block_size
+
+        self._queue = Queue.Queue(maxsize=max_blocks)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._read_blocks)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        """Puts an item on the queue, giving up if we've been closed."""
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def _read_blocks(self):
+        """Target of the reader thread."""
+        vid, opened = open_thread_handle(self.vid)
+        try:
+            for start in xrange(self.start, self.stop, self.block_size):
+                stop = min(start + self.block_size, self.stop)
+                frames, timestamps = read_frame_block(vid, start, stop)
+                if frames.shape[0] > 0 and \
+                    not self._put((start, frames, timestamps)):
+                    return
+                if frames.shape[0] < stop - start:
+                    # the video ended early.
+                    break
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+        finally:
+            if opened:
+                vid.close()
+
+    def iter_blocks(self):
+        """Yields blocks of frames, in order.
+
+        Yields
+        ------
+        start : int
+            Index of the first frame in the block.
+
+        frames : np.array of shape [N, H, W], dtype=np.uint8
+
+        timestamps : np.array of shape [N], dtype=np.float
+        """
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def __iter__(self):
+        """Yields (frame index, image, timestamp) for each frame, in
+        order."""
+        for start, frames, timestamps in self.iter_blocks():
+            for i in xrange(frames.shape[0]):
+                yield start + i, frames[i], timestamps[i]
+
+    def close(self):
+        """Stops the reader thread."""
+        self._stop_event.set()
+        self._thread.join()
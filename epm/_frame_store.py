@@ -0,0 +1,261 @@
+# Compressed, randomly accessible storage of video frames goes here.
+
+import struct
+import threading
+import zlib
+
+import motmot.FlyMovieFormat.FlyMovieFormat as FMF
+import numpy as np
+
+# extension of chunked frame store files (see open_video).
+FRAME_STORE_EXTENSION = '.cfs'
+
+_MAGIC = 'EPMCFS\x00\x00'
+_VERSION = 1
+# magic, version, height, width, chunk_size, flags, n_frames,
+# background_size, index_offset.
+_HEADER = struct.Struct('<8sIIIIIQQQ')
+_FLAG_DELTA = 1
+
+
+class ChunkedFrameStoreSaver:
+    """Writes MONO8 frames to a chunked frame store (see ChunkedFrameStore).
+
+    Frames are buffered, and each block of `chunk_size` frames is compressed
+    with zlib and written as a single chunk. The chunk index, and every
+    frame's timestamp, are written when the saver is closed.
+
+    Parameters
+    ----------
+    filename : string
+        Where to save the store.
+
+    height, width : int
+        Size of each frame, in pixels.
+
+    chunk_size : int, optional (default=16)
+        How many frames to compress together. zlib only looks back 32 KB,
+        so larger chunks barely compress better, but make seeking to a
+        single frame decompress more.
+
+    level : int, optional (default=1)
+        zlib compression level (1 is fastest, 9 is smallest).
+
+    background : np.array of shape [height, width], dtype=np.uint8 or None
+        (optional, default=None)
+        If given, each frame is stored as its (wrapped) difference from this
+        image. For a fixed camera, most of this difference is close to zero,
+        so it compresses far better than the frame itself.
+    """
+    def __init__(self, filename, height, width, chunk_size=16, level=1,
+        background=None):
+        self.filename = filename
+        self.framesize = (height, width)
+        self.chunk_size = chunk_size
+        self.level = level
+        self.background = background
+        if background is not None:
+            self.background = np.ascontiguousarray(background, dtype=np.uint8)
+            if self.background.shape != self.framesize:
+                raise ValueError('Background has shape {}, but frames have '
+                    'shape {}.'.format(self.background.shape, self.framesize))
+
+        self.n_frames = 0
+        self._buffer = np.empty((chunk_size,) + self.framesize,
+            dtype=np.uint8)
+        self._n_buffered = 0
+        self._offsets = []
+        self._timestamps = []
+
+        self.file = open(filename, 'wb')
+        self.file.write(_HEADER.pack(_MAGIC, _VERSION, 0, 0, 0, 0, 0, 0, 0))
+        self._background_size = 0
+        if self.background is not None:
+            data = zlib.compress(buffer(self.background), self.level)
+            self.file.write(data)
+            self._background_size = len(data)
+
+    def add_frame(self, frame, timestamp):
+        """Adds a single frame."""
+        self._buffer[self._n_buffered] = frame
+        self._timestamps.append(timestamp)
+        self._n_buffered += 1
+        self.n_frames += 1
+        if self._n_buffered == self.chunk_size:
+            self._flush()
+
+    def add_frames(self, frames, timestamps):
+        """Adds a block of frames.
+
+        Parameters
+        ----------
+        frames : np.array of shape [N, height, width], dtype=np.uint8
+
+        timestamps : np.array of shape [N]
+        """
+        for frame, timestamp in zip(frames, timestamps):
+            self.add_frame(frame, timestamp)
+
+    def _flush(self):
+        """Compresses and writes buffered frames as a chunk."""
+        if self._n_buffered == 0:
+            return
+        frames = self._buffer[:self._n_buffered]
+        if self.background is not None:
+            # uint8 arithmetic wraps, so this is undone exactly by addition.
+            frames = np.subtract(frames, self.background, out=frames)
+        self._offsets.append(self.file.tell())
+        self.file.write(zlib.compress(buffer(frames), self.level))
+        self._n_buffered = 0
+
+    def close(self):
+        """Writes any remaining frames and the chunk index."""
+        if self.file is None:
+            return
+        self._flush()
+        index_offset = self.file.tell()
+        self._offsets.append(index_offset)
+        np.array(self._offsets, dtype='<u8').tofile(self.file)
+        np.array(self._timestamps, dtype='<f8').tofile(self.file)
+
+        self.file.seek(0)
+        self.file.write(_HEADER.pack(_MAGIC, _VERSION, self.framesize[0],
+            self.framesize[1], self.chunk_size,
+            _FLAG_DELTA if self.background is not None else 0,
+            self.n_frames, self._background_size, index_offset))
+        self.file.close()
+        self.file = None
+
+
+class ChunkedFrameStore:
+    """Read-only, compressed video, stored as chunks of zlib-compressed
+    MONO8 frames (see ChunkedFrameStoreSaver).
+
+    An index of where each chunk starts is loaded when the store is opened,
+    so any frame can be found with a single seek, and only the chunk holding
+    it is decompressed. This implements the parts of the
+    motmot.FlyMovieFormat.FlyMovie interface used by this package, and is
+    safe to read from multiple threads at once. As zlib releases the GIL,
+    chunks read by a FramePrefetcher are decompressed while the tracker
+    works on earlier frames.
+
+    Parameters
+    ----------
+    filename : string
+        Path to store.
+
+    Attributes
+    ----------
+    timestamps : np.array of shape [N], dtype=np.float
+        Timestamp of every frame in the video.
+
+    background : np.array of shape [H, W], dtype=np.uint8 or None
+        Image that frames were stored as differences from, if any.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.format = 'MONO8'
+        self._lock = threading.Lock()
+        self._cache = (None, None)
+
+        self.file = open(filename, 'rb')
+        header = self.file.read(_HEADER.size)
+        if len(header) != _HEADER.size or header[:len(_MAGIC)] != _MAGIC:
+            self.file.close()
+            raise IOError('{} is not a chunked frame store.'.format(filename))
+        (_, version, height, width, self.chunk_size, flags, n_frames,
+            background_size, index_offset) = _HEADER.unpack(header)
+        if version != _VERSION or index_offset == 0:
+            self.file.close()
+            raise IOError('{} is incomplete, or was written by an '
+                'unsupported version.'.format(filename))
+        self.framesize = (height, width)
+
+        self.background = None
+        if flags & _FLAG_DELTA:
+            self.background = np.frombuffer(
+                zlib.decompress(self.file.read(background_size)),
+                dtype=np.uint8).reshape(self.framesize)
+
+        n_chunks = (n_frames + self.chunk_size - 1) // self.chunk_size
+        self.file.seek(index_offset)
+        self._offsets = np.fromfile(self.file, dtype='<u8',
+            count=n_chunks + 1).astype(np.int64)
+        self.timestamps = np.fromfile(self.file, dtype='<f8', count=n_frames)
+
+    def get_n_frames(self):
+        return self.timestamps.shape[0]
+
+    def get_height(self):
+        return self.framesize[0]
+
+    def get_width(self):
+        return self.framesize[1]
+
+    def get_format(self):
+        return self.format
+
+    def _get_chunk(self, chunk_ix):
+        """Gets the (read-only) frames of a chunk, decompressing them if
+        they aren't the most recently read chunk."""
+        cached_ix, frames = self._cache
+        if cached_ix == chunk_ix:
+            return frames
+
+        start, stop = self._offsets[chunk_ix], self._offsets[chunk_ix + 1]
+        with self._lock:
+            self.file.seek(start)
+            data = self.file.read(stop - start)
+        frames = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+        frames = frames.reshape((-1,) + self.framesize)
+        if self.background is not None:
+            frames = np.add(frames, self.background)
+            frames.flags.writeable = False
+        self._cache = (chunk_ix, frames)
+        return frames
+
+    def get_frame(self, frame_number):
+        """Gets a single frame (read-only) and its timestamp."""
+        if frame_number >= self.get_n_frames():
+            raise FMF.NoMoreFramesException('EOF')
+        chunk_ix, offset = divmod(frame_number, self.chunk_size)
+        return (self._get_chunk(chunk_ix)[offset],
+            self.timestamps[frame_number])
+
+    def get_frames(self, start, stop):
+        """Gets a block of frames [start, stop).
+
+        Returns
+        -------
+        frames : np.array of shape [stop - start, H, W], dtype=np.uint8
+
+        timestamps : np.array of shape [stop - start], dtype=np.float
+        """
+        stop = min(stop, self.get_n_frames())
+        first_chunk = start // self.chunk_size
+        last_chunk = (stop - 1) // self.chunk_size
+        if first_chunk == last_chunk:
+            offset = first_chunk * self.chunk_size
+            frames = self._get_chunk(first_chunk)[
+                start - offset:stop - offset]
+            return frames, self.timestamps[start:stop]
+
+        frames = np.empty((stop - start,) + self.framesize, dtype=np.uint8)
+        for chunk_ix in xrange(first_chunk, last_chunk + 1):
+            offset = chunk_ix * self.chunk_size
+            chunk_start = max(start, offset)
+            chunk_stop = min(stop, offset + self.chunk_size)
+            frames[chunk_start - start:chunk_stop - start] = self._get_chunk(
+                chunk_ix)[chunk_start - offset:chunk_stop - offset]
+        return frames, self.timestamps[start:stop]
+
+    def get_all_timestamps(self):
+        return self.timestamps
+
+    def close(self):
+        """Closes the underlying file."""
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        self._cache = (None, None)
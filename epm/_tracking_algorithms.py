@@ -1,12 +1,20 @@
 # Tracking functions, independent of GUI go here
 
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import motmot.FlyMovieFormat.FlyMovieFormat as FMF
+from scipy import ndimage as ndi
+from skimage.draw import polygon
 from skimage.filters import threshold_otsu
-from skimage.measure import label, regionprops
 from skimage.morphology import binary_erosion
 
+from _frame_sources import FFmpegVideo, FramePrefetcher, open_thread_handle
+from _tracking_profile import NULL_PROFILE
+
 def convert_img_to_float(img):
     """Converts all pixels in an image to between 0. and 1. (inclusive).
 
@@ -42,30 +50,292 @@ def convert_img_to_uint8(img):
     img *= 255
     return img.astype(np.uint8)
 
-def calc_background_image(vid, n_frames=200):
+def get_background_frame_indices(n_video_frames, n_frames=200,
+    random_state=0):
+    """Gets a sorted, reproducible sample of frame indices to use for
+    calculating a background image.
+
+    Parameters
+    ----------
+    n_video_frames : int
+        Total number of frames in the video.
+
+    n_frames : int, optional (default=200)
+        How many frame indices to sample. This is clipped to the number of
+        frames in the video.
+
+    random_state : int or None, optional (default=0)
+        Seed for sampling. If None, a different sample will be taken
+        every call.
+
+    Returns
+    -------
+    ixs : np.array of shape [min(n_frames, n_video_frames)], dtype=np.int
+        Unique frame indices, in ascending order (so that frames can be read
+        sequentially from disk).
+    """
+    n_frames = int(np.clip(n_frames, 1, n_video_frames))
+    rs = np.random.RandomState(random_state)
+    ixs = rs.choice(n_video_frames, size=n_frames, replace=False)
+    return np.sort(ixs)
+
+def _iter_frames(vid, ixs):
+    """Reads frames at the specified (sorted) indices from a video,
+    stopping early if the video turns out to end before the last of them
+    (see FFmpegVideo).
+
+    Yields
+    ------
+    ix : int
+        Index of frame.
+
+    img : np.array of shape [H, W]
+        Image data of frame.
+    """
+    for ix in ixs:
+        try:
+            img = vid.get_frame(ix)[0]
+        except FMF.NoMoreFramesException:
+            if ix < vid.get_n_frames():
+                raise
+            return
+        yield ix, img
+
+def _read_background_frames(vid, ixs, rows=None):
+    """Reads frames at the specified (sorted) indices from a video.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
+        Video to read frames from.
+
+    ixs : np.array
+        Sorted frame indices to read.
+
+    rows : slice or None (default=None)
+        Which rows of each frame to keep. If None, all rows are kept.
+
+    Returns
+    -------
+    frames : np.array of shape [N, n_rows, W], dtype=np.uint8
+        N is len(ixs), unless the video ends before the last index.
+    """
+    if rows is None:
+        rows = slice(None)
+
+    n_rows = len(xrange(*rows.indices(vid.get_height())))
+    frames = np.empty(shape=(len(ixs), n_rows, vid.get_width()),
+        dtype=np.uint8)
+    n_read = 0
+    for _, img in _iter_frames(vid, ixs):
+        frames[n_read] = img[rows]
+        n_read += 1
+
+    return frames[:n_read]
+
+def _sum_background_frames(vid, ixs):
+    """Sums frames at the specified (sorted) indices from a video.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
+        Video to read frames from.
+
+    ixs : np.array
+        Sorted frame indices to read.
+
+    Returns
+    -------
+    frame_sum : np.array of shape [H, W], dtype=np.float
+
+    n_summed : int
+        Number of frames summed. This is len(ixs), unless the video ends
+        before the last index.
+    """
+    frame_sum = np.zeros(
+        shape=(vid.get_height(), vid.get_width())).astype(np.float)
+    n_summed = 0
+    for _, img in _iter_frames(vid, ixs):
+        frame_sum += img
+        n_summed += 1
+
+    return frame_sum, n_summed
+
+def calc_background_image(vid, n_frames=200, mode='mean', percentile=50.,
+    random_state=0, n_threads=1, max_memory=256 * 2**20):
     """Caclculates a background image from a given video.
 
+    Frames are sampled reproducibly (see get_background_frame_indices) and
+    read in ascending order, so that reads move sequentially through the
+    video file.
+
     Parameters
     ----------
-    vid : motmot.FlyMovieFormat.FlyMovie
+    vid : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
         Video to calculate background from.
 
     n_frames : int, optional (default=200)
         How many frames to use to calculate background.
 
+    mode : string, optional (default='mean')
+        How to combine sampled frames into a background image. One of
+        'mean', 'median', or 'percentile'.
+
+    percentile : float, optional (default=50.)
+        Percentile (within [0, 100]) to take across sampled frames at each
+        pixel. Only used if mode is 'percentile'.
+
+    random_state : int or None, optional (default=0)
+        Seed used to sample frames.
+
+    n_threads : int, optional (default=1)
+        How many threads to spread frame reads over. Each thread reads a
+        contiguous run of the sampled frames from its own handle to the
+        video (see open_thread_handle). FlyMovies that were not opened from
+        a file name, and FFmpegVideos (which can only decode one stream at a
+        time), are always read from a single thread.
+
+    max_memory : int, optional (default=256 MB)
+        Approximate upper bound (in bytes) on the memory used to hold sampled
+        frames when mode is 'median' or 'percentile'. If all sampled frames
+        will not fit, the background is calculated over bands of rows, with
+        the sampled frames re-read for each band.
+
     Returns
     -------
     background_image : np.array, dtype=np.uint8
         Background image
     """
-    background_image = np.zeros(shape=(vid.get_height(), vid.get_width())).astype(np.float)
-    random_ixs = np.random.randint(0, vid.get_n_frames() - 1, n_frames)
+    if mode == 'median':
+        percentile = 50.
+    elif mode not in ['mean', 'percentile']:
+        raise ValueError(
+            'mode must be one of mean, median, or percentile.')
+
+    height, width = vid.get_height(), vid.get_width()
+    ixs = get_background_frame_indices(
+        vid.get_n_frames(), n_frames, random_state=random_state)
+
+    if (isinstance(vid, FMF.FlyMovie) and vid.filename is None) or \
+        isinstance(vid, FFmpegVideo):
+        n_threads = 1
+    n_threads = max(1, min(n_threads, len(ixs)))
+
+    def run_in_thread(func, run_ixs, *args):
+        handle, opened = open_thread_handle(vid)
+        try:
+            return func(handle, run_ixs, *args)
+        finally:
+            if opened:
+                handle.close()
+
+    def map_runs(func, *args):
+        """Applies func to contiguous runs of the sampled indices."""
+        if n_threads == 1:
+            return [func(vid, ixs, *args)]
+        pool = ThreadPool(n_threads)
+        try:
+            return pool.map(
+                lambda run_ixs: run_in_thread(func, run_ixs, *args),
+                np.array_split(ixs, n_threads))
+        finally:
+            pool.close()
 
-    for ix in random_ixs:
-        background_image += vid.get_frame(ix)[0]
+    if mode == 'mean':
+        frame_sums, n_summed = zip(*map_runs(_sum_background_frames))
+        background_image = np.sum(frame_sums, axis=0)
+        background_image /= (sum(n_summed) * 1.)
+        return background_image.astype(np.uint8)
+
+    # each band needs its uint8 frames, plus a float copy made by
+    # np.percentile.
+    bytes_per_row = len(ixs) * width * (1 + 8)
+    rows_per_band = int(np.clip(max_memory // bytes_per_row, 1, height))
+
+    background_image = np.zeros(shape=(height, width), dtype=np.uint8)
+    for row in xrange(0, height, rows_per_band):
+        rows = slice(row, min(row + rows_per_band, height))
+        frames = np.concatenate(
+            map_runs(_read_background_frames, rows), axis=0)
+        background_image[rows] = np.round(
+            np.percentile(frames, percentile, axis=0))
+
+    return background_image
+
+def get_polygon_mask(points, shape):
+    """Gets a mask of the polygon defined by a set of (unordered) points.
+
+    Parameters
+    ----------
+    points : np.array of shape [N, 2]
+        (rr, cc) positions of the polygon's vertices, in pixel coordinates.
+        These are sorted by the angle they make with their center of mass.
 
-    background_image /= (n_frames * 1.)
-    return background_image.astype(np.uint8)
+    shape : tuple
+        (height, width) of the mask.
+
+    Returns
+    -------
+    mask : np.array of shape `shape`, dtype=np.uint8
+        Pixels within the polygon are 1, all others are 0.
+    """
+    central_point = np.mean(points, axis=0)
+
+    # get coordinates such that they are all relative to the central point
+    relative_point_pos = points - central_point
+    # sort the points based on angle made with center of image.
+    angles = np.arctan2(relative_point_pos[:, 0], relative_point_pos[:, 1])
+    sorted_polygon_points = relative_point_pos[np.argsort(angles)]
+
+    # place coordinates back into global positions for mask drawing.
+    sorted_polygon_points += central_point
+    # add first point onto end of points list to form closed polygon
+    sorted_polygon_points = np.vstack((sorted_polygon_points,
+        sorted_polygon_points[-1, :]))
+    mask = np.zeros(shape, dtype=np.uint8)
+    rr, cc = polygon(sorted_polygon_points[:, 0],
+        sorted_polygon_points[:, 1], shape=shape)
+    mask[rr, cc] = 1
+    return mask
+
+def load_inclusion_mask(filename, shape, geometry=None):
+    """Loads an inclusion mask from a file.
+
+    Parameters
+    ----------
+    filename : string
+        Either a mask saved with np.save (.npy), or an .xlsx file containing
+        the pixel coordinates ('rr' and 'cc' columns) of the mask points
+        (the '-pixel-coords.xlsx' file saved by MaskWidget).
+
+    shape : tuple
+        (height, width) of the video the mask will be used with.
+
+    geometry : FrameGeometry or None, optional (default=None)
+        If the video was cropped or scaled when it was converted, its
+        geometry (see load_frame_geometry). The mask is then taken to be in
+        the coordinates of the source video, and is mapped onto the
+        converted video's frames.
+
+    Returns
+    -------
+    mask : np.array of shape `shape`
+    """
+    if filename.endswith('.npy'):
+        mask = np.load(filename)
+        if (geometry is not None and mask.shape != tuple(shape) and
+            mask.shape == geometry.source_shape):
+            mask = geometry.resample_mask(mask, shape)
+        if mask.shape != tuple(shape):
+            raise ValueError('Mask {} has shape {}, but expected {}.'.format(
+                filename, mask.shape, tuple(shape)))
+        return mask
+
+    points_df = pd.read_excel(filename)
+    points = points_df[['rr', 'cc']].values
+    if geometry is not None:
+        points = geometry.from_source(points)
+    return get_polygon_mask(points, shape)
 
 def get_otsu_threshold(img, b_img):
     """Gets the calculated otsu threshold from the passed background-subtracted
@@ -91,6 +361,121 @@ def get_otsu_threshold(img, b_img):
 
     return threshold_otsu(sub_image)
 
+def otsu_threshold_from_histogram(hist, bin_centers):
+    """Gets the otsu threshold of a histogram, as calculated by
+    skimage.filters.threshold_otsu.
+
+    Parameters
+    ----------
+    hist : np.array
+        Number of values in each bin.
+
+    bin_centers : np.array
+        Value at the center of each bin.
+
+    Returns
+    -------
+    threshold : float
+    """
+    hist = hist.astype(np.float)
+
+    # class probabilities and means for all possible thresholds.
+    weight1 = np.cumsum(hist)
+    weight2 = np.cumsum(hist[::-1])[::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean1 = np.cumsum(hist * bin_centers) / weight1
+        mean2 = (np.cumsum((hist * bin_centers)[::-1]) /
+            weight2[::-1])[::-1]
+
+    # the last value of weight1/mean1 should pair with zero values in
+    # weight2/mean2, which do not exist.
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    return bin_centers[:-1][np.argmax(variance12)]
+
+def calc_otsu_threshold(vid, b_img, n_frames=200, inclusion_mask=None,
+    random_state=0, nbins=256):
+    """Calculates a single otsu threshold for a whole video.
+
+    The threshold is calculated from a combined histogram of the
+    background-subtracted images (see get_otsu_threshold) of a sample of
+    frames. This is the same sample of frames used to calculate the
+    background image (see get_background_frame_indices), and the result is
+    identical to calling get_otsu_threshold on all of the sampled frames
+    at once.
+
+    As both the background and frames are uint8, each subtracted pixel only
+    depends on the pair of (background, frame) pixel values, and the max of
+    its frame. So, rather than holding every subtracted image in memory, we
+    count (background, frame) pixel pairs for each frame max.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
+        Video to calculate threshold from.
+
+    b_img : np.array, dtype=np.uint8
+        Background image of the video.
+
+    n_frames : int, optional (default=200)
+        How many frames to sample.
+
+    inclusion_mask : np.array, optional (default=None)
+        If given, only pixels within the bounding box of this mask are
+        used (as in MouseDetector).
+
+    random_state : int or None, optional (default=0)
+        Seed used to sample frames.
+
+    nbins : int, optional (default=256)
+        Number of histogram bins.
+
+    Returns
+    -------
+    threshold : float
+    """
+    if inclusion_mask is not None:
+        crop = get_mask_bounding_box(inclusion_mask)
+    else:
+        crop = get_mask_bounding_box(np.ones_like(b_img))
+
+    ixs = get_background_frame_indices(
+        vid.get_n_frames(), n_frames, random_state=random_state)
+
+    # counts of (background, frame) pixel value pairs, keyed by frame max.
+    pair_counts = {}
+    b_offsets = b_img[crop].astype(np.intp) * 256
+    for _, img in _iter_frames(vid, ixs):
+        img_max = np.max(img)
+        counts = np.bincount((b_offsets + img[crop]).ravel(),
+            minlength=256 * 256)
+        if img_max in pair_counts:
+            pair_counts[img_max] += counts
+        else:
+            pair_counts[img_max] = counts
+
+    # subtracted value of every (background, frame) pixel pair, calculated
+    # with the same floating point operations as get_otsu_threshold.
+    values = np.arange(256, dtype=np.float)
+    b_as_float = values / (np.max(b_img) * 1.)
+    sub_values, weights = [], []
+    for img_max, counts in pair_counts.iteritems():
+        present = np.flatnonzero(counts)
+        b_values, img_values = np.divmod(present, 256)
+        sub_values.append(b_as_float[b_values] -
+            values[img_values] / (img_max * 1.))
+        weights.append(counts[present])
+    sub_values = np.concatenate(sub_values)
+    weights = np.concatenate(weights)
+
+    value_range = (np.min(sub_values), np.max(sub_values))
+    if value_range[0] == value_range[1]:
+        raise ValueError('Cannot calculate an otsu threshold, as the '
+            'background-subtracted frames only contain a single value.')
+    hist, bin_edges = np.histogram(sub_values, bins=nbins,
+        range=value_range, weights=weights)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2.
+    return otsu_threshold_from_histogram(hist, bin_centers)
+
 def threshold_image(img, b_img, threshold=None):
     """Subtracts off background and thresholds current image.
 
@@ -109,11 +494,9 @@ def threshold_image(img, b_img, threshold=None):
     binary_image : np.array, np.float
         Pixels will be either 0 or 1.
     """
-    # subtract off the background from the current image.
-    sub_image = convert_img_to_float(img) - convert_img_to_float(b_img)
-    # invert the image so that the region we are interested in has a
-    # positive value.
-    sub_image = -sub_image
+    # one-off calls (eg. from ThresholdWidget) are cheaper without the
+    # per-video preparation done by a MouseDetector.
+    sub_image = convert_img_to_float(b_img) - convert_img_to_float(img)
 
     # only look at pixels with a value greater than the threshold (if specified)
     if threshold is None:
@@ -124,7 +507,8 @@ def threshold_image(img, b_img, threshold=None):
 
     return binary_image
 
-def find_mouse(img, b_img, threshold=None, inclusion_mask=None):
+def find_mouse(img, b_img, threshold=None, inclusion_mask=None,
+    pyramid_factor=None):
     """Finds a blob (a mouse) in the given image.
 
     Parameters
@@ -137,36 +521,1352 @@ def find_mouse(img, b_img, threshold=None, inclusion_mask=None):
 
     threshold : float, optional (default=None)
 
+    inclusion_mask : np.array, optional (default=None)
+        Which region of the image should be included in tracking.
+
+    pyramid_factor : int or None, optional (default=None)
+        If given (and greater than 1), the mouse is first found in copies of
+        img and b_img that have been downsampled by this factor, then
+        refined at full resolution (see PyramidDetector).
+
     Returns
     -------
-    props : skimage.regionprops, or -1
+    props : Blob, or -1
         Properties of the detected mouse or -1 if we couldn't
         find a mouse.
     """
+    if pyramid_factor is not None and pyramid_factor > 1:
+        detector = get_detector(b_img, threshold=threshold,
+            inclusion_mask=inclusion_mask, pyramid_factor=pyramid_factor)
+        return detector.detect(img)
+
+    # a MouseDetector only pays off over many frames, so single frames are
+    # thresholded directly.
     mask = threshold_image(img, b_img, threshold)
+    offset = (0, 0)
     if inclusion_mask is not None:
         mask[~inclusion_mask.astype(np.bool)] = 0
+        # nothing outside of the (padded) mask can be part of a blob.
+        rows, cols = get_mask_bounding_box(inclusion_mask)
+        mask = mask[rows, cols]
+        offset = (rows.start, cols.start)
 
     # Erode image to try and split up unrelated - possibly disconnected areas.
     eroded_img = binary_erosion(mask)
+    return get_largest_blob(eroded_img, offset=offset)
+
+def _erode_batch(masks, out):
+    """Erodes each frame of a block of binary images, writing the result
+    into out.
+
+    This gives the same result as calling binary_erosion() on each frame (a
+    cross-shaped element, with pixels beyond the edges of a frame treated
+    as foreground), but with a handful of whole-block logical operations.
+
+    Parameters
+    ----------
+    masks : np.array of shape [N, H, W], dtype=np.bool
+        Block of binary images.
+
+    out : np.array of shape [N, H, W], dtype=np.bool
+        Where to store the eroded images. Must not share memory with masks.
+
+    Returns
+    -------
+    out : np.array of shape [N, H, W], dtype=np.bool
+    """
+    np.copyto(out, masks)
+    out[:, 1:] &= masks[:, :-1]
+    out[:, :-1] &= masks[:, 1:]
+    out[:, :, 1:] &= masks[:, :, :-1]
+    out[:, :, :-1] &= masks[:, :, 1:]
+    return out
+
+def find_mouse_batch(imgs, b_img, threshold=None, inclusion_mask=None):
+    """Finds a blob (a mouse) in each frame of a block of images.
+
+    This is a vectorized version of find_mouse(): each block of frames is
+    thresholded and eroded in a single pass, and only the bounding box of
+    the foreground of each frame is labeled.
+
+    Parameters
+    ----------
+    imgs : np.array of shape [N, H, W]
+        Block of frames to find mouse within.
+
+    b_img : np.array of shape [H, W]
+        Background image to subtract from each frame.
+
+    threshold : float, optional (default=None)
+        This should be within the range [0, 1]. If None, an otsu threshold
+        will be calculated for each frame.
+
+    inclusion_mask : np.array of shape [H, W], optional (default=None)
+        Which region of the image should be included in tracking.
+
+    Returns
+    -------
+    props : np.array of shape [N, 5], dtype=np.float
+        Columns are rr, cc, area, maj, min (the centroid, area, and major and
+        minor axis lengths of the largest blob in each frame). Rows for frames
+        in which we couldn't find a mouse are filled with np.nan.
+    """
+    detector = MouseDetector(b_img, threshold=threshold,
+        inclusion_mask=inclusion_mask)
+    return detector.detect_batch(imgs)
+
+class Blob(namedtuple('Blob', ['rr', 'cc', 'area', 'maj', 'min', 'bbox'])):
+    """Properties of a single blob (a mouse) detected in an image.
+
+    All values are plain numbers, in full-frame pixel coordinates. The
+    centroid, area, and axis lengths are defined as in
+    skimage.measure.regionprops, and the regionprops names (centroid,
+    major_axis_length, minor_axis_length) are available as aliases.
+
+    Attributes
+    ----------
+    rr, cc : float
+        Centroid of the blob.
+
+    area : int
+        Number of pixels in the blob.
+
+    maj, min : float
+        Major and minor axis lengths of the blob.
+
+    bbox : tuple of int
+        (min_rr, min_cc, max_rr, max_cc) of the blob. Max values are
+        exclusive.
+    """
+    __slots__ = ()
+
+    @property
+    def centroid(self):
+        return (self.rr, self.cc)
+
+    @property
+    def major_axis_length(self):
+        return self.maj
+
+    @property
+    def minor_axis_length(self):
+        return self.min
+
+def get_largest_blob(binary_image, offset=(0, 0), profile=None):
+    """Finds the largest connected component (blob) in a binary image.
+
+    This is a lightweight replacement for labeling an image and selecting
+    the largest of its skimage.measure.regionprops; only the properties of
+    the largest blob are calculated.
+
+    Parameters
+    ----------
+    binary_image : np.array of shape [H, W]
+        Image containing blobs. Nonzero pixels are foreground.
+
+    offset : tuple of int, optional (default=(0, 0))
+        (rr, cc) position of binary_image within the full frame. This is
+        added to all returned coordinates.
+
+    profile : TrackingProfile or None, optional (default=None)
+        If given, time spent finding ('labeling') and measuring
+        ('properties') the largest blob is added to this profile.
+
+    Returns
+    -------
+    props : Blob, or -1
+        Properties of the largest blob, or -1 if there are no blobs.
+    """
+    if profile is None:
+        profile = NULL_PROFILE
+
+    with profile.stage('labeling'):
+        labeled_image, n_labels = ndi.label(
+            binary_image, structure=ndi.generate_binary_structure(2, 2))
+        if n_labels == 0:
+            return -1
+
+        if n_labels == 1:
+            largest_label = 1
+        else:
+            # pick the largest blob with np.argsort (rather than np.argmax)
+            # so that tie-breaking is identical to selecting from a list of
+            # regionprops.
+            areas = np.bincount(labeled_image.ravel(),
+                minlength=n_labels + 1)
+            largest_label = 1 + np.argsort(areas[1:])[-1]
+
+    with profile.stage('properties'):
+        rows, cols = ndi.find_objects(
+            labeled_image, max_label=largest_label)[-1]
+        rr, cc = np.nonzero(labeled_image[rows, cols] == largest_label)
+        rr += rows.start + offset[0]
+        cc += cols.start + offset[1]
+
+        area = rr.size
+        mean_rr, mean_cc = rr.mean(), cc.mean()
+        d_rr, d_cc = rr - mean_rr, cc - mean_cc
+        maj, minor = _get_axis_lengths(
+            np.dot(d_rr, d_rr) / area,
+            np.dot(d_cc, d_cc) / area,
+            np.dot(d_rr, d_cc) / area)
+
+    return Blob(mean_rr, mean_cc, area, maj, minor, (
+        rows.start + offset[0], cols.start + offset[1],
+        rows.stop + offset[0], cols.stop + offset[1]))
+
+def _get_axis_lengths(var_rr, var_cc, cov_rc):
+    """Calculates major and minor axis lengths from normalized central
+    moments, using the same definition as skimage.measure.regionprops.
+
+    Parameters
+    ----------
+    var_rr, var_cc, cov_rc : float or np.array
+        Central moments (mu20, mu02, mu11) divided by area (mu00).
+
+    Returns
+    -------
+    major_axis_length, minor_axis_length : float or np.array
+    """
+    half_trace = (var_rr + var_cc) / 2.
+    radius = np.sqrt(((var_rr - var_cc) / 2.) ** 2 + cov_rc ** 2)
+    l1 = half_trace + radius
+    l2 = np.maximum(half_trace - radius, 0)
+    return 4 * np.sqrt(l1), 4 * np.sqrt(l2)
+
+def get_mask_bounding_box(mask, pad=1):
+    """Gets the bounding box of all nonzero pixels in a mask.
+
+    Parameters
+    ----------
+    mask : np.array of shape [H, W]
+        Mask to find bounding box of.
+
+    pad : int, optional (default=1)
+        How many pixels to pad the bounding box by (on each side). The box
+        is clipped to the image boundary.
+
+    Returns
+    -------
+    rows, cols : slice
+        Slices defining the (padded) bounding box. If the mask is empty,
+        these will span the whole image.
+    """
+    height, width = mask.shape
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    cols = np.flatnonzero(np.any(mask, axis=0))
+    if rows.size == 0:
+        return slice(0, height), slice(0, width)
+
+    return (
+        slice(max(rows[0] - pad, 0), min(rows[-1] + 1 + pad, height)),
+        slice(max(cols[0] - pad, 0), min(cols[-1] + 1 + pad, width))
+        )
+
+def _touches_window_edge(props, window, bounds):
+    """Checks whether a blob found within a window touches an edge of the
+    window that isn't also an edge of bounds (in which case, the blob may
+    extend past the window)."""
+    min_rr, min_cc, max_rr, max_cc = props.bbox
+    for lo, hi, win, bound in zip(
+        (min_rr, min_cc), (max_rr, max_cc), window, bounds):
+        if (lo == win.start and win.start != bound.start) or \
+            (hi == win.stop and win.stop != bound.stop):
+            return True
+    return False
+
+def downsample_image(img, factor):
+    """Block-averages an image.
+
+    Parameters
+    ----------
+    img : np.array of shape [H, W]
+        Image to downsample. Any rows or columns past the last full block
+        are dropped.
+
+    factor : int
+        Height and width of each block.
+
+    Returns
+    -------
+    downsampled : np.array of shape [H // factor, W // factor]
+        Mean of each block. If img is np.uint8, this is rounded to the
+        nearest integer, and is also np.uint8.
+    """
+    height, width = img.shape[0] // factor, img.shape[1] // factor
+    img = img[:height * factor, :width * factor]
+    n_pixels = factor * factor
+
+    # summing strided views is much faster than reducing over the axes of
+    # a (height, factor, width, factor) view.
+    if img.dtype == np.uint8:
+        sum_dtype = np.uint16 if n_pixels * 255 < 2**16 else np.uint32
+    else:
+        sum_dtype = np.float
+    block_sums = np.zeros((height, width), dtype=sum_dtype)
+    for i in xrange(factor):
+        for j in xrange(factor):
+            block_sums += img[i::factor, j::factor]
+
+    if img.dtype == np.uint8:
+        block_sums += n_pixels // 2
+        block_sums //= n_pixels
+        return block_sums.astype(np.uint8)
+    return block_sums / n_pixels
+
+def get_threshold_cutoffs(b_img_max, img_max, threshold):
+    """Gets a lookup table that turns thresholding of a background-subtracted
+    image into a single integer comparison per pixel.
+
+    A pixel with value p, over a background pixel with value b, passes the
+    threshold if b / b_img_max - p / img_max > threshold (see
+    threshold_image). For a fixed img_max, this holds for exactly those
+    values of p that are less than cutoffs[b]. Cutoffs are calculated with
+    the same floating point operations as threshold_image, so results
+    are identical.
+
+    Parameters
+    ----------
+    b_img_max : float
+        Max pixel value of the background image.
+
+    img_max : float
+        Max pixel value of the current image.
+
+    threshold : float
+        This should be within the range [0, 1].
+
+    Returns
+    -------
+    cutoffs : np.array of shape [256], dtype=np.uint8
+    """
+    values = np.arange(256, dtype=np.float)
+    b_as_float = values / (b_img_max * 1.)
+    img_as_float = values / (img_max * 1.)
+    passes = (b_as_float[:, np.newaxis] - img_as_float) > threshold
+    # a pixel equal to 255 can only pass a threshold below zero, so for
+    # valid thresholds every cutoff fits in a uint8.
+    return np.minimum(np.sum(passes, axis=1), 255).astype(np.uint8)
+
+class MouseDetector:
+    """Finds a blob (a mouse) in frames taken from a single video.
+
+    All of the work that only depends on the background image and tracking
+    settings (normalizing the background, and inverting the inclusion mask)
+    is done once, upon construction, rather than for every frame.
+
+    If an inclusion mask is given, detection only looks at pixels within
+    the mask's bounding box (padded by one pixel, so that erosion at the
+    edges of the mask is unchanged). Returned coordinates are always
+    relative to the full frame. If threshold is None, the otsu threshold is
+    still calculated from the whole (background-subtracted) frame, as in
+    threshold_image, unless otsu_within_crop is True.
+
+    If a threshold is given, and both the background and frames are uint8,
+    thresholding is done entirely with integers (see get_threshold_cutoffs),
+    and masks are written into buffers that are reused from frame to frame.
+    Masks returned by (or passed on from) one call are therefore overwritten
+    by the next, and a detector should only be used from a single thread.
+
+    Parameters
+    ----------
+    b_img : np.array
+        Background image to subtract from each frame.
+
+    threshold : float, optional (default=None)
+        This should be within the range [0, 1]. If None, an otsu threshold
+        will be calculated for each frame.
+
+    inclusion_mask : np.array, optional (default=None)
+        Which region of the image should be included in tracking.
+
+    profile : TrackingProfile or None, optional (default=None)
+        If given, the time spent in each stage of detection is added to
+        this profile.
+
+    otsu_within_crop : bool, optional (default=False)
+        If True (and threshold is None), the otsu threshold is calculated
+        only from pixels within the searched region. This is faster, but
+        gives different results from find_mouse() without a detector.
+
+    Attributes
+    ----------
+    b_img_as_float : np.array, dtype=np.float
+        Background image, normalized by its max (see convert_img_to_float).
+
+    b_img_max : float
+        Max pixel value of the background image.
+
+    exclusion_mask : np.array, dtype=np.bool, or None
+        Pixels to exclude from tracking (the inverse of inclusion_mask).
+
+    crop : tuple of slice
+        (rows, cols) of the region of each frame used for detection.
+
+    use_cutoffs : bool
+        Whether uint8 frames are thresholded in the integer domain.
+
+    profile : TrackingProfile or NullProfile
+        Profile that detection is timed in (a NullProfile if none was
+        given).
+    """
+    def __init__(self, b_img, threshold=None, inclusion_mask=None,
+        profile=None, otsu_within_crop=False):
+        self.b_img = b_img
+        self.threshold = threshold
+        self.inclusion_mask = inclusion_mask
+        self.otsu_within_crop = otsu_within_crop
+        self.profile = NULL_PROFILE if profile is None else profile
 
-    labeled_image = label(eroded_img)
-    props = regionprops(labeled_image)
+        self.b_img_max = float(np.max(b_img))
+        self.b_img_as_float = convert_img_to_float(b_img)
 
-    if len(props) == 0:
-        return -1
+        if inclusion_mask is not None:
+            self._inclusion_mask = inclusion_mask.astype(np.bool)
+            self.exclusion_mask = ~self._inclusion_mask
+            self.crop = get_mask_bounding_box(inclusion_mask)
+            self._exclusion_mask_crop = self.exclusion_mask[self.crop]
+        else:
+            self._inclusion_mask = None
+            self.exclusion_mask = None
+            self.crop = get_mask_bounding_box(np.ones_like(b_img))
+            self._exclusion_mask_crop = None
 
-    areas = []
-    for prop in props:
-        areas.append(prop.area)
+        self._b_img_crop = self.b_img_as_float[self.crop]
 
-    # return the region property with the largest area,
-    # which we will assume to contain the mouse.
-    largest_area_ix = np.argsort(areas)[-1]
+        self.use_cutoffs = (threshold is not None and threshold >= 0 and
+            b_img.dtype == np.uint8)
+        # per-pixel cutoff images, keyed by the max of the current frame
+        # (which rarely changes from one frame to the next).
+        self._cutoff_images = {}
+        self._mask_buffer = np.empty(b_img.shape, dtype=np.bool)
+        self._eroded_buffer = np.empty(b_img.shape, dtype=np.bool)
+        self._batch_buffers = np.empty(
+            (2, 0) + self._b_img_crop.shape, dtype=np.bool)
 
-    return props[largest_area_ix]
+    def subtract_background(self, img):
+        """Subtracts the background from an image, and inverts the result
+        so that the region we are interested in has a positive value.
 
-def track_video(vid, threshold=None, background_n_frames=200):
+        Parameters
+        ----------
+        img : np.array
+            Current image.
+
+        Returns
+        -------
+        sub_image : np.array, dtype=np.float
+        """
+        return self.b_img_as_float - convert_img_to_float(img)
+
+    def _get_cutoff_image(self, img_max):
+        """Gets the per-pixel cutoffs for frames with the given max (see
+        get_threshold_cutoffs).
+
+        Returns
+        -------
+        cutoff_image : np.array of shape b_img.shape, dtype=np.uint8
+            A pixel passes the threshold if it is less than the cutoff.
+        """
+        cutoff_image = self._cutoff_images.get(img_max)
+        if cutoff_image is None:
+            if len(self._cutoff_images) >= 16:
+                self._cutoff_images.clear()
+            cutoffs = get_threshold_cutoffs(
+                self.b_img_max, img_max, self.threshold)
+            cutoff_image = cutoffs[self.b_img]
+            self._cutoff_images[img_max] = cutoff_image
+        return cutoff_image
+
+    def _threshold_into(self, img, crop, out):
+        """Thresholds the cropped region of a uint8 image in the integer
+        domain, writing the result into out."""
+        cutoff_image = self._get_cutoff_image(np.max(img))
+        np.less(img[crop], cutoff_image[crop], out=out)
+        if self._inclusion_mask is not None:
+            np.logical_and(out, self._inclusion_mask[crop], out=out)
+        return out
+
+    def threshold_image(self, img):
+        """Subtracts off background and thresholds current image.
+
+        Parameters
+        ----------
+        img : np.array, np.uint8
+            Image to be thresholded.
+
+        Returns
+        -------
+        binary_image : np.array, np.float
+            Pixels will be either 0 or 1.
+        """
+        if self.use_cutoffs and img.dtype == np.uint8:
+            cutoff_image = self._get_cutoff_image(np.max(img))
+            return (img < cutoff_image).astype(np.float)
+
+        sub_image = self.subtract_background(img)
+
+        # only look at pixels with a value greater than the threshold
+        # (if specified)
+        threshold = self.threshold
+        if threshold is None:
+            threshold = threshold_otsu(sub_image)
+
+        binary_image = np.zeros_like(sub_image)
+        binary_image[np.where(sub_image > threshold)] = 1
+
+        return binary_image
+
+    def _threshold_crop(self, img, crop=None):
+        """Subtracts off background and thresholds the cropped region of
+        the current image, excluding any pixels outside of the inclusion
+        mask.
+
+        Parameters
+        ----------
+        img : np.array, np.uint8
+            Full-frame image to be thresholded.
+
+        crop : tuple of slice or None (default=None)
+            (rows, cols) of the region to threshold. If None, self.crop
+            is used.
+
+        Returns
+        -------
+        mask : np.array of shape crop, dtype=np.bool
+            If thresholding was done in the integer domain, this is a view
+            into a buffer that is overwritten by the next call.
+        """
+        if crop is None:
+            crop = self.crop
+
+        if self.use_cutoffs and img.dtype == np.uint8:
+            with self.profile.stage('threshold'):
+                return self._threshold_into(
+                    img, crop, self._mask_buffer[crop])
+
+        if crop is self.crop:
+            b_img_crop = self._b_img_crop
+            exclusion_mask_crop = self._exclusion_mask_crop
+        else:
+            b_img_crop = self.b_img_as_float[crop]
+            exclusion_mask_crop = None
+            if self.exclusion_mask is not None:
+                exclusion_mask_crop = self.exclusion_mask[crop]
+
+        with self.profile.stage('subtract_background'):
+            # normalize by the max of the full frame, as in
+            # convert_img_to_float.
+            img_max = np.max(img) * 1.
+            if self.threshold is None and not self.otsu_within_crop:
+                # the otsu threshold depends on every pixel of the frame.
+                full_sub_image = self.b_img_as_float - \
+                    img.astype(np.float) / img_max
+                sub_image = full_sub_image[crop]
+            else:
+                sub_image = b_img_crop - img[crop].astype(np.float) / img_max
+
+        with self.profile.stage('threshold'):
+            threshold = self.threshold
+            if threshold is None and self.otsu_within_crop:
+                threshold = threshold_otsu(sub_image)
+            elif threshold is None:
+                threshold = threshold_otsu(full_sub_image)
+
+            mask = sub_image > threshold
+            if exclusion_mask_crop is not None:
+                mask[exclusion_mask_crop] = False
+        return mask
+
+    def detect(self, img, crop=None):
+        """Finds a blob (a mouse) in the given image.
+
+        Parameters
+        ----------
+        img : np.array
+            Current image to find mouse within.
+
+        crop : tuple of slice or None (default=None)
+            (rows, cols) of the region of img to search within. This should
+            lie within self.crop. If None, self.crop is searched.
+
+        Returns
+        -------
+        props : Blob, or -1
+            Properties of the detected mouse or -1 if we couldn't
+            find a mouse.
+        """
+        if crop is None:
+            crop = self.crop
+        mask = self._threshold_crop(img, crop)
+
+        # Erode image to try and split up unrelated - possibly disconnected
+        # areas.
+        with self.profile.stage('erosion'):
+            eroded_img = binary_erosion(mask, out=self._eroded_buffer[crop])
+
+        rows, cols = crop
+        return get_largest_blob(eroded_img, offset=(rows.start, cols.start),
+            profile=self.profile)
+
+    def _get_batch_buffers(self, n_frames):
+        """Gets (reused) buffers to hold the thresholded and eroded masks of
+        n_frames frames."""
+        if self._batch_buffers.shape[1] < n_frames:
+            self._batch_buffers = np.empty(
+                (2, n_frames) + self._b_img_crop.shape, dtype=np.bool)
+        return self._batch_buffers[0, :n_frames], \
+            self._batch_buffers[1, :n_frames]
+
+    def _threshold_batch_into(self, imgs, out):
+        """Thresholds the cropped region of a block of uint8 frames in the
+        integer domain, writing the result into out."""
+        rows, cols = self.crop
+        imgs_max, frame_cutoffs = np.unique(
+            imgs.reshape(imgs.shape[0], -1).max(axis=1), return_inverse=True)
+        cutoff_images = [self._get_cutoff_image(img_max)[rows, cols]
+            for img_max in imgs_max]
+        if len(cutoff_images) == 1:
+            # the max rarely changes, so this is usually just broadcast.
+            cutoffs = cutoff_images[0]
+        else:
+            cutoffs = np.array(cutoff_images)[frame_cutoffs]
+        np.less(imgs[:, rows, cols], cutoffs, out=out)
+        if self._inclusion_mask is not None:
+            np.logical_and(out, self._inclusion_mask[rows, cols], out=out)
+        return out
+
+    def _threshold_batch_as_float(self, imgs, out):
+        """Thresholds the cropped region of a block of frames, using
+        floating point arithmetic, writing the result into out.
+
+        Parameters
+        ----------
+        imgs : np.array of shape [N, H, W]
+
+        out : np.array of shape [N, crop], dtype=np.bool
+
+        Returns
+        -------
+        out : np.array of shape [N, crop], dtype=np.bool
+        """
+        n_frames = imgs.shape[0]
+        rows, cols = self.crop
+        with self.profile.stage('subtract_background'):
+            # normalize each frame by its own (full-frame) max, as in
+            # convert_img_to_float().
+            imgs_max = imgs.reshape(n_frames, -1).max(axis=1) * 1.
+            sub_images = imgs[:, rows, cols].astype(np.float)
+            sub_images /= imgs_max[:, np.newaxis, np.newaxis]
+            # subtract, then invert so that the region we are interested in
+            # has a positive value.
+            np.subtract(self._b_img_crop, sub_images, out=sub_images)
+
+        with self.profile.stage('threshold'):
+            if self.threshold is None:
+                if self.otsu_within_crop:
+                    thresholds = np.array(
+                        [threshold_otsu(sub) for sub in sub_images])
+                else:
+                    # the otsu threshold depends on every pixel of the frame.
+                    thresholds = np.array([threshold_otsu(
+                        self.b_img_as_float - img.astype(np.float) / img_max)
+                        for img, img_max in zip(imgs, imgs_max)])
+                np.greater(sub_images, thresholds[:, np.newaxis, np.newaxis],
+                    out=out)
+            else:
+                np.greater(sub_images, self.threshold, out=out)
+            del sub_images
+
+            if self._exclusion_mask_crop is not None:
+                out[:, self._exclusion_mask_crop] = False
+        return out
+
+    def detect_batch(self, imgs):
+        """Finds a blob (a mouse) in each frame of a block of images.
+
+        Parameters
+        ----------
+        imgs : np.array of shape [N, H, W]
+            Block of frames to find mouse within.
+
+        Returns
+        -------
+        props : np.array of shape [N, 5], dtype=np.float
+            See find_mouse_batch().
+        """
+        imgs = np.asarray(imgs)
+        n_frames = imgs.shape[0]
+        props = np.empty(shape=(n_frames, 5), dtype=np.float)
+        props.fill(np.nan)
+        if n_frames == 0:
+            return props
+
+        masks, eroded = self._get_batch_buffers(n_frames)
+        if self.use_cutoffs and imgs.dtype == np.uint8:
+            with self.profile.stage('threshold'):
+                self._threshold_batch_into(imgs, masks)
+        else:
+            self._threshold_batch_as_float(imgs, masks)
+
+        with self.profile.stage('erosion'):
+            _erode_batch(masks, eroded)
+
+        # only label the bounding box of the foreground of each frame; this
+        # keeps labels in the same (raster) order as labeling whole frames.
+        with self.profile.stage('labeling'):
+            has_rows = eroded.any(axis=2)
+            has_cols = eroded.any(axis=1)
+        rows, cols = self.crop
+        for i in np.flatnonzero(has_rows.any(axis=1)):
+            rr = np.flatnonzero(has_rows[i])
+            cc = np.flatnonzero(has_cols[i])
+            blob = get_largest_blob(
+                eroded[i, rr[0]:rr[-1] + 1, cc[0]:cc[-1] + 1],
+                offset=(rows.start + rr[0], cols.start + cc[0]),
+                profile=self.profile)
+            props[i] = blob[:5]
+        return props
+
+class LocalSearchDetector:
+    """Finds a mouse by only searching a small window around its predicted
+    position in each frame.
+
+    The position of the mouse is predicted from its centroid in the two
+    previous frames, assuming a constant velocity. If the mouse cannot be
+    predicted (ie. it was lost in the previous frame), or the blob found
+    within the window looks suspicious (it touches the edge of the window,
+    or its area changed sharply from the previous frame), the whole frame is
+    searched instead, as in MouseDetector.detect().
+
+    Frames must be passed to detect() in order.
+
+    Parameters
+    ----------
+    detector : MouseDetector or PyramidDetector
+        Detector used to search each window (and whole frames).
+
+    window_size : int, optional (default=64)
+        Height and width (in pixels) of the search window.
+
+    max_area_change : float, optional (default=0.5)
+        Largest allowable fractional change in blob area between successive
+        frames before falling back to a full-frame search.
+
+    Attributes
+    ----------
+    n_fallbacks : int
+        How many frames required a full-frame search.
+
+    profile : TrackingProfile or NullProfile
+        Profile of the wrapped detector.
+    """
+    def __init__(self, detector, window_size=64, max_area_change=0.5):
+        self.detector = detector
+        self.profile = detector.profile
+        self.window_size = window_size
+        self.max_area_change = max_area_change
+        self.reset()
+
+    def reset(self):
+        """Clears the motion history, so that the next frame passed to
+        detect() is searched in full."""
+        self.centroids = []
+        self.area = None
+        self.n_fallbacks = 0
+
+    def predict(self):
+        """Predicts the centroid of the mouse in the next frame.
+
+        Returns
+        -------
+        centroid : np.array of shape [2] or None
+            Predicted (rr, cc) centroid, or None if it could not
+            be predicted.
+        """
+        if len(self.centroids) == 0:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[-1]
+        return 2 * self.centroids[-1] - self.centroids[-2]
+
+    def _get_window(self, centroid):
+        """Gets a search window centered on the given centroid, clipped to
+        the detector's crop."""
+        window = []
+        for center, bounds in zip(centroid, self.detector.crop):
+            start = int(round(center)) - self.window_size // 2
+            start = min(start, bounds.stop - self.window_size)
+            start = max(start, bounds.start)
+            stop = min(start + self.window_size, bounds.stop)
+            window.append(slice(start, stop))
+        return tuple(window)
+
+    def _is_valid(self, props, window):
+        """Checks whether a blob found within a window should be trusted."""
+        if props == -1:
+            return False
+
+        area_ratio = props.area * 1. / self.area
+        if (area_ratio > 1 + self.max_area_change or
+            area_ratio < 1. / (1 + self.max_area_change)):
+            return False
+
+        # a blob touching an edge of the window (that isn't also an edge of
+        # the detector's crop) may extend past the window.
+        return not _touches_window_edge(props, window, self.detector.crop)
+
+    def detect(self, img):
+        """Finds a blob (a mouse) in the next image of a video.
+
+        Parameters
+        ----------
+        img : np.array
+            Current image to find mouse within.
+
+        Returns
+        -------
+        props : Blob, or -1
+            Properties of the detected mouse or -1 if we couldn't
+            find a mouse.
+        """
+        props = -1
+        predicted_centroid = self.predict()
+        if predicted_centroid is not None:
+            window = self._get_window(predicted_centroid)
+            props = self.detector.detect(img, crop=window)
+            if not self._is_valid(props, window):
+                props = -1
+
+        if props == -1:
+            self.n_fallbacks += 1
+            props = self.detector.detect(img)
+
+        if props == -1:
+            self.centroids = []
+            self.area = None
+        else:
+            self.centroids = self.centroids[-1:] + [np.array(props.centroid)]
+            self.area = props.area
+
+        return props
+
+class PyramidDetector:
+    """Finds a mouse by first searching a downsampled copy of each frame,
+    then refining the blob's properties at full resolution.
+
+    Each frame (and the background) is block-averaged by `factor` (see
+    downsample_image), and the largest blob is found in the downsampled
+    frame. The full-resolution frame is then only searched within that
+    blob's (padded) bounding box. If no blob is found in the downsampled
+    frame, or the refined blob touches the edge of its bounding box, the
+    whole full-resolution frame is searched instead.
+
+    Returned properties are always calculated at full resolution, in
+    full-frame coordinates. Note that if the detector's threshold is None,
+    the otsu threshold used for refinement is calculated from pixels within
+    the bounding box, rather than the whole frame.
+
+    Parameters
+    ----------
+    detector : MouseDetector
+        Detector used to search at full resolution.
+
+    factor : int, optional (default=2)
+        How much to downsample each frame by.
+
+    Attributes
+    ----------
+    coarse_detector : MouseDetector
+        Detector used to search downsampled frames.
+
+    crop : tuple of slice
+        (rows, cols) of the region of each (full-resolution) frame used
+        for detection.
+
+    n_fallbacks : int
+        How many frames required a full-resolution, full-frame search.
+
+    profile : TrackingProfile or NullProfile
+        Profile of the wrapped detector, which the coarse detector
+        also uses.
+    """
+    def __init__(self, detector, factor=2):
+        self.detector = detector
+        self.factor = factor
+        self.crop = detector.crop
+        self.profile = detector.profile
+        self.n_fallbacks = 0
+
+        inclusion_mask = detector.inclusion_mask
+        if inclusion_mask is not None:
+            # a block is included if any of its pixels are.
+            inclusion_mask = downsample_image(
+                inclusion_mask.astype(np.float), factor) > 0
+        self.coarse_detector = MouseDetector(
+            downsample_image(detector.b_img, factor),
+            threshold=detector.threshold,
+            inclusion_mask=inclusion_mask,
+            profile=detector.profile)
+
+    def _get_window(self, coarse_props):
+        """Gets the full-resolution window containing a blob found in a
+        downsampled frame."""
+        # pad by two blocks (as erosion removes a block from each edge of
+        # the coarse blob, and blocks along the edge of the mouse may be
+        # averaged out), and one pixel (for erosion at full resolution).
+        pad = 2 * self.factor + 1
+        min_rr, min_cc, max_rr, max_cc = coarse_props.bbox
+        window = []
+        for lo, hi, bounds in zip(
+            (min_rr, min_cc), (max_rr, max_cc), self.crop):
+            window.append(slice(
+                max(lo * self.factor - pad, bounds.start),
+                min(hi * self.factor + pad, bounds.stop)))
+        return tuple(window)
+
+    def detect(self, img, crop=None):
+        """Finds a blob (a mouse) in the given image.
+
+        Parameters
+        ----------
+        img : np.array
+            Current (full-resolution) image to find mouse within.
+
+        crop : tuple of slice or None (default=None)
+            (rows, cols) of the region of img to search within. If given,
+            this region is searched directly at full resolution (as in
+            MouseDetector.detect()).
+
+        Returns
+        -------
+        props : Blob, or -1
+            Properties of the detected mouse or -1 if we couldn't
+            find a mouse.
+        """
+        if crop is not None:
+            return self.detector.detect(img, crop=crop)
+
+        props = -1
+        with self.profile.stage('downsample'):
+            coarse_img = downsample_image(img, self.factor)
+        coarse_props = self.coarse_detector.detect(coarse_img)
+        if coarse_props != -1:
+            window = self._get_window(coarse_props)
+            props = self.detector.detect(img, crop=window)
+            if props != -1 and _touches_window_edge(props, window, self.crop):
+                props = -1
+
+        if props == -1:
+            self.n_fallbacks += 1
+            props = self.detector.detect(img)
+        return props
+
+def get_detector(b_img, threshold=None, inclusion_mask=None,
+    search_window_size=None, pyramid_factor=None, profile=None):
+    """Builds the detector used to find a mouse in each frame of a video.
+
+    Parameters
+    ----------
+    b_img : np.array
+        Background image to subtract from each frame.
+
+    threshold : float, optional (default=None)
+        This should be within the range [0, 1]. If None, an otsu threshold
+        will be calculated for each frame.
+
+    inclusion_mask : np.array, optional (default=None)
+        Which region of the image should be included in tracking.
+
+    search_window_size : int or None, optional (default=None)
+        If given, only search a window of this size around the predicted
+        position of the mouse in each frame (see LocalSearchDetector).
+
+    pyramid_factor : int or None, optional (default=None)
+        If given, full-frame searches are first done on frames downsampled
+        by this factor (see PyramidDetector).
+
+    profile : TrackingProfile or None, optional (default=None)
+        If given, the time spent in each stage of detection is added to
+        this profile.
+
+    Returns
+    -------
+    detector : MouseDetector, PyramidDetector, or LocalSearchDetector
+    """
+    detector = MouseDetector(b_img, threshold=threshold,
+        inclusion_mask=inclusion_mask, profile=profile)
+    if pyramid_factor is not None and pyramid_factor > 1:
+        detector = PyramidDetector(detector, pyramid_factor)
+    if search_window_size is not None:
+        detector = LocalSearchDetector(detector, search_window_size)
+    return detector
+
+# dtype of the array used to hold tracking results; see
+# allocate_tracking_results().
+TRACKING_DTYPE = np.dtype([
+    ('frame', np.int64),
+    ('rr', np.float),
+    ('cc', np.float),
+    ('area', np.float),
+    ('maj', np.float),
+    ('min', np.float),
+    ('found', np.bool)
+    ])
+
+# columns of tracking data saved to disk (see tracking_results_to_df).
+TRACKING_COLUMNS = ['rr', 'cc', 'area', 'maj', 'min']
+
+def allocate_tracking_results(n_frames, start=0):
+    """Allocates an array to hold tracking results.
+
+    Parameters
+    ----------
+    n_frames : int
+        Number of frames to hold results for.
+
+    start : int, optional (default=0)
+        Index of the first frame.
+
+    Returns
+    -------
+    results : np.array of shape [n_frames], dtype=TRACKING_DTYPE
+        Frame numbers are filled in, all other values are set to np.nan,
+        and 'found' is set to False.
+    """
+    results = np.empty(n_frames, dtype=TRACKING_DTYPE)
+    results['frame'] = np.arange(start, start + n_frames)
+    for column in TRACKING_COLUMNS:
+        results[column] = np.nan
+    results['found'] = False
+    return results
+
+def set_tracking_result(results, ix, props):
+    """Stores the properties of a detected mouse in a results array.
+
+    Parameters
+    ----------
+    results : np.array, dtype=TRACKING_DTYPE
+        Array to store results in (see allocate_tracking_results).
+
+    ix : int
+        Index into results (not necessarily the frame number).
+
+    props : Blob, or -1
+        Properties of the detected mouse, or -1 if it wasn't found.
+    """
+    if props == -1:
+        results[ix] = (results['frame'][ix],
+            np.nan, np.nan, np.nan, np.nan, np.nan, False)
+    else:
+        results[ix] = (results['frame'][ix],
+            props.rr, props.cc, props.area, props.maj, props.min, True)
+
+def tracking_results_to_df(results):
+    """Converts tracking results to a DataFrame.
+
+    Parameters
+    ----------
+    results : np.array, dtype=TRACKING_DTYPE
+
+    Returns
+    -------
+    tracking_data : pd.DataFrame
+        Contains the columns in TRACKING_COLUMNS, indexed by frame number.
+        Values for frames in which the mouse wasn't found are np.nan.
+    """
+    tracking_data = pd.DataFrame(
+        dict((column, results[column]) for column in TRACKING_COLUMNS),
+        index=pd.Index(results['frame'], name='frame'),
+        columns=TRACKING_COLUMNS)
+    return tracking_data
+
+def save_tracking_data(results, filename, geometry=None):
+    """Saves tracking results to an .xlsx file.
+
+    Parameters
+    ----------
+    results : np.array, dtype=TRACKING_DTYPE
+
+    filename : string
+        Where to save results. Frames in which the mouse wasn't found are
+        saved as 'NA'.
+
+    geometry : FrameGeometry or None, optional (default=None)
+        If the tracked video was cropped or scaled when it was converted,
+        its geometry (see load_frame_geometry). Results are then saved in
+        the coordinates of the source video.
+    """
+    if geometry is not None:
+        results = geometry.results_to_source(results)
+    tracking_results_to_df(results).to_excel(
+        filename,
+        na_rep='NA',
+        index_label='frame',
+        sheet_name='RawData')
+
+def track_frames(vid, detector, results, start=0, stop=None,
+    progress_callback=None):
+    """Tracks a range of frames from a video, storing results as we go.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
+        Video to track.
+
+    detector : MouseDetector, PyramidDetector, or LocalSearchDetector
+        Detector used to find the mouse in each frame (see get_detector).
+
+    results : np.array of shape [stop - start], dtype=TRACKING_DTYPE
+        Array to store results in. Frame `ix` is stored at `ix - start`.
+
+    start : int, optional (default=0)
+        Index of first frame to track.
+
+    stop : int or None, optional (default=None)
+        Index of frame to stop tracking at (exclusive). If None, frames are
+        tracked until the end of the video.
+
+    progress_callback : function or None, optional (default=None)
+        Called with the index of each frame, after it has been tracked.
+
+    Returns
+    -------
+    results : np.array, dtype=TRACKING_DTYPE
+
+    Notes
+    -----
+    If the detector has a TrackingProfile, the time spent reading each
+    frame, and the latency of each frame, are added to it.
+    """
+    for ix, img, _ in detector.profile.time_frames(
+        FramePrefetcher(vid, start, stop)):
+        set_tracking_result(results, ix - start, detector.detect(img))
+        if progress_callback is not None:
+            progress_callback(ix)
+    return results
+
+def get_progressive_passes(n_frames, stride, start=0):
+    """Splits frames into a series of passes, from coarse to fine.
+
+    The first pass contains every `stride`-th frame. Each subsequent pass
+    halves the stride, and contains only those frames not in an earlier
+    pass. The final pass has a stride of 1, so that every frame is
+    included in exactly one pass.
+
+    Parameters
+    ----------
+    n_frames : int
+        Total number of frames.
+
+    stride : int
+        Spacing between frames in the first pass.
+
+    start : int, optional (default=0)
+        Index of the first frame to include. Earlier frames are not
+        included in any pass.
+
+    Returns
+    -------
+    passes : list of np.array
+        Frame indices (in ascending order) of each pass.
+    """
+    is_scheduled = np.zeros(n_frames, dtype=np.bool)
+    passes = []
+    stride = max(int(stride), 1)
+    while True:
+        ixs = np.arange(start, n_frames, stride)
+        ixs = ixs[~is_scheduled[ixs]]
+        if ixs.size > 0:
+            is_scheduled[ixs] = True
+            passes.append(ixs)
+        if stride == 1:
+            return passes
+        stride = max(stride // 2, 1)
+
+def interpolate_tracking_results(results, is_tracked):
+    """Fills in results for frames that have not yet been tracked by
+    linearly interpolating between frames in which the mouse was found.
+
+    Parameters
+    ----------
+    results : np.array, dtype=TRACKING_DTYPE
+        Partially-filled tracking results.
+
+    is_tracked : np.array of shape results.shape, dtype=np.bool
+        Which frames have been tracked.
+
+    Returns
+    -------
+    interpolated : np.array, dtype=TRACKING_DTYPE
+        Copy of results. Frames that have not been tracked hold interpolated
+        values (values before the first, or after the last, found frame are
+        held constant), but 'found' is left as False. If the mouse has not
+        been found in any frame, nothing is interpolated.
+    """
+    interpolated = results.copy()
+    is_known = is_tracked & results['found']
+    if not np.any(is_known):
+        return interpolated
+
+    is_unknown = ~is_tracked
+    frames = results['frame']
+    for column in TRACKING_COLUMNS:
+        interpolated[column][is_unknown] = np.interp(frames[is_unknown],
+            frames[is_known], results[column][is_known])
+    return interpolated
+
+def track_frames_progressive(vid, detector, results, start=0, stride=32,
+    pass_callback=None, progress_callback=None):
+    """Tracks a video in a series of passes, from coarse to fine (see
+    get_progressive_passes), so that a rough trajectory for the whole video
+    is available soon after tracking starts.
+
+    As each frame is tracked independently, the final results are identical
+    to tracking every frame in order.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
+        Video to track.
+
+    detector : MouseDetector or PyramidDetector
+        Detector used to find the mouse in each frame. This must not depend
+        on previously-tracked frames (so a LocalSearchDetector cannot
+        be used).
+
+    results : np.array of shape [n_frames], dtype=TRACKING_DTYPE
+        Array to store results for the whole video in. Frame `ix` is stored
+        at `ix`.
+
+    start : int, optional (default=0)
+        Index of the first frame to track. Results for earlier frames should
+        already be filled in.
+
+    stride : int, optional (default=32)
+        Spacing between frames tracked in the first pass.
+
+    pass_callback : function or None, optional (default=None)
+        Called after each pass with the results so far, with frames that
+        have not yet been tracked filled in by interpolation (see
+        interpolate_tracking_results).
+
+    progress_callback : function or None, optional (default=None)
+        Called after each frame is tracked with the number of frames tracked
+        so far (including those before `start`) minus one, so that the final
+        call is with the index of the last frame.
+
+    Returns
+    -------
+    results : np.array, dtype=TRACKING_DTYPE
+    """
+    if isinstance(detector, LocalSearchDetector):
+        raise ValueError('Progressive tracking requires a detector that does '
+            'not depend on previously-tracked frames.')
+
+    n_frames = results.shape[0]
+    is_tracked = np.zeros(n_frames, dtype=np.bool)
+    is_tracked[:start] = True
+    n_tracked = start
+    for ixs in get_progressive_passes(n_frames, stride, start):
+        for ix, img in detector.profile.time_frames(_iter_frames(vid, ixs)):
+            set_tracking_result(results, ix, detector.detect(img))
+            n_tracked += 1
+            if progress_callback is not None:
+                progress_callback(n_tracked - 1)
+        is_tracked[ixs] = True
+        if pass_callback is not None:
+            pass_callback(interpolate_tracking_results(results, is_tracked))
+    return results
+
+def track_video_batch(vid, threshold=None, background_n_frames=200,
+    inclusion_mask=None, batch_size=32, background_mode='mean'):
+    """Tracks a passed video, processing blocks of frames at a time.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie
+        Video to track.
+
+    threshold : float, optional (default=None)
+        Cutoff threshold. See track_video().
+
+    background_n_frames : int, optional (default=200)
+        How many frames to use for background sub.
+
+    inclusion_mask : np.array, optional (default=None)
+        Which region of the image should be included in tracking.
+
+    batch_size : int, optional (default=32)
+        How many frames to process in each vectorized block. Larger blocks
+        take more memory, and are no faster.
+
+    background_mode : string, optional (default='mean')
+        How to combine frames into a background image. See
+        calc_background_image().
+
+    Returns
+    -------
+    results : np.array of shape [n_frames], dtype=TRACKING_DTYPE
+        Tracking results for every frame of the video.
+    """
+    b_img = calc_background_image(vid, n_frames=background_n_frames,
+        mode=background_mode)
+    detector = MouseDetector(b_img, threshold=threshold,
+        inclusion_mask=inclusion_mask)
+
+    results = allocate_tracking_results(vid.get_n_frames())
+    frame_source = FramePrefetcher(vid, block_size=batch_size)
+    for start, imgs, _ in frame_source.iter_blocks():
+        props = detector.detect_batch(imgs)
+        block = results[start:start + imgs.shape[0]]
+        for i, column in enumerate(TRACKING_COLUMNS):
+            block[column] = props[:, i]
+        block['found'] = ~np.isnan(props[:, 0])
+
+    return results
+
+def get_tracking_threshold(vid, b_img, threshold=None, threshold_mode='frame',
+    background_n_frames=200, inclusion_mask=None):
+    """Gets the threshold to track a video with.
+
+    Parameters
+    ----------
+    vid : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
+        Video to track.
+
+    b_img : np.array
+        Background image of the video.
+
+    threshold : float or None, optional (default=None)
+        User-defined threshold. If given, this is returned as-is.
+
+    threshold_mode : string, optional (default='frame')
+        If 'frame', and threshold is None, None is returned (so that an otsu
+        threshold is calculated for each frame). If 'video', a single otsu
+        threshold is calculated for the whole video (see
+        calc_otsu_threshold).
+
+    background_n_frames : int, optional (default=200)
+        How many frames were used to calculate the background image.
+
+    inclusion_mask : np.array, optional (default=None)
+        Which region of the image should be included in tracking.
+
+    Returns
+    -------
+    threshold : float or None
+    """
+    if threshold_mode not in ['frame', 'video']:
+        raise ValueError('threshold_mode must be one of frame or video.')
+    if threshold is not None or threshold_mode == 'frame':
+        return threshold
+    return calc_otsu_threshold(vid, b_img, n_frames=background_n_frames,
+        inclusion_mask=inclusion_mask)
+
+def track_video(vid, threshold=None, background_n_frames=200,
+    background_mode='mean', search_window_size=None, threshold_mode='frame',
+    pyramid_factor=None, profile=None):
     """Tracks a passed video.
 
     Parameters
@@ -182,20 +1882,43 @@ def track_video(vid, threshold=None, background_n_frames=200):
     background_n_frames : int, optional (default=200)
         How many frames to use for background sub.
 
+    background_mode : string, optional (default='mean')
+        How to combine frames into a background image. See
+        calc_background_image().
+
+    search_window_size : int or None, optional (default=None)
+        If given, only search a window of this size around the predicted
+        position of the mouse in each frame (see LocalSearchDetector).
+
+    threshold_mode : string, optional (default='frame')
+        How to calculate a threshold if threshold is None. See
+        get_tracking_threshold().
+
+    pyramid_factor : int or None, optional (default=None)
+        If given, search downsampled frames first (see PyramidDetector).
+
+    profile : TrackingProfile or None, optional (default=None)
+        If given, the time spent in each stage of tracking is added to this
+        profile (see TrackingProfile).
+
     Returns
     -------
-    props : list of regionprops
-        Region properties (which may or may not represent) the
-        mouse, calculated for every frame of the video.
+    results : np.array of shape [n_frames], dtype=TRACKING_DTYPE
+        Properties of the blob (which may or may not represent the
+        mouse), calculated for every frame of the video.
     """
+    if profile is None:
+        profile = NULL_PROFILE
 
-    b_img = calc_background_image(vid, n_frames=background_n_frames)
-
-    props = []
-    for ix in xrange(vid.get_n_frames()):
-        img, _ = vid.get_frame(ix)
-        props.append(
-            find_mouse(img, b_img, threshold=threshold)
-            )
+    with profile.stage('background'):
+        b_img = calc_background_image(vid, n_frames=background_n_frames,
+            mode=background_mode)
+    with profile.stage('threshold_selection'):
+        threshold = get_tracking_threshold(vid, b_img, threshold,
+            threshold_mode, background_n_frames)
+    detector = get_detector(b_img, threshold=threshold,
+        search_window_size=search_window_size, pyramid_factor=pyramid_factor,
+        profile=profile)
 
-    return props
+    results = allocate_tracking_results(vid.get_n_frames())
+    return track_frames(vid, detector, results)
@@ -0,0 +1,297 @@
+# Functions to track many videos at once (without a GUI) go here.
+
+import copy
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from _frame_geometry import load_frame_geometry
+from _frame_sources import open_video
+from _tracking_algorithms import load_inclusion_mask, save_tracking_data
+from _tracking_checkpoint import get_checkpoint_filename, remove_checkpoint
+from _tracking_profile import TrackingProfile, get_profile_filename
+from _tracking_runner import track_video_with_settings
+from _tracking_settings import TrackingSettings
+
+# settings that may be given in a settings file (see load_tracking_settings).
+SETTINGS_KEYS = [
+    'threshold',
+    'threshold_mode',
+    'background_n_frames',
+    'background_mode',
+    'search_window_size',
+    'pyramid_factor',
+    'n_processes',
+    'progressive_stride'
+]
+
+# columns of the run summary (see track_videos).
+SUMMARY_COLUMNS = ['video', 'output', 'n_frames', 'n_resumed', 'n_lost',
+    'seconds', 'frames_per_second', 'error']
+
+def load_tracking_settings(filename=None):
+    """Loads tracking settings from a JSON file.
+
+    Parameters
+    ----------
+    filename : string or None, optional (default=None)
+        JSON file containing an object whose keys are in SETTINGS_KEYS. If
+        None, the default settings are returned.
+
+    Returns
+    -------
+    tracking_settings : TrackingSettings
+    """
+    if filename is None:
+        return TrackingSettings()
+
+    with open(filename, 'r') as f:
+        settings = json.load(f)
+
+    unknown_keys = sorted(set(settings) - set(SETTINGS_KEYS))
+    if len(unknown_keys) > 0:
+        raise ValueError('Unknown tracking settings in {}: {}.'.format(
+            filename, ', '.join(unknown_keys)))
+    return TrackingSettings(**dict(
+        (str(key), value) for key, value in settings.iteritems()))
+
+def get_output_filename(video_filename, output_dir=None):
+    """Gets the name of the file that tracking results for a video are
+    saved to.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to video.
+
+    output_dir : string or None, optional (default=None)
+        Directory to save results in. If None, results are saved alongside
+        the video.
+
+    Returns
+    -------
+    output_filename : string
+        The video's filename, with its extension replaced by '.xlsx'.
+    """
+    if output_dir is None:
+        output_dir = os.path.dirname(video_filename)
+    name = os.path.splitext(os.path.basename(video_filename))[0]
+    return os.path.join(output_dir, name + '.xlsx')
+
+def check_output_filenames(output_filenames):
+    """Checks that no two videos' results would be saved to the same file.
+
+    Parameters
+    ----------
+    output_filenames : list of string
+        Where the results of each video will be saved.
+
+    Raises
+    ------
+    ValueError
+        If any output filename appears more than once.
+    """
+    output_filenames = [os.path.abspath(output_filename)
+        for output_filename in output_filenames]
+    duplicates = sorted(set(output_filename for output_filename in
+        output_filenames if output_filenames.count(output_filename) > 1))
+    if len(duplicates) > 0:
+        raise ValueError('More than one video would be saved to: {}.'.format(
+            ', '.join(duplicates)))
+
+def track_video_file(video_filename, output_filename, tracking_settings,
+    use_checkpoint=True, profile=False):
+    """Tracks a single video, and saves the results.
+
+    Tracking resumes from any checkpoint left by a previous, interrupted
+    run. The checkpoint is kept alongside output_filename (so that jobs
+    tracking the same video with different settings don't share one), and
+    is removed once results have been saved.
+
+    If the video was cropped or scaled when it was converted (see
+    fmf_ucmp), the inclusion mask is taken to be in, and results are saved
+    in, the coordinates of the source video.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to video to track (see open_video).
+
+    output_filename : string
+        Where to save tracking results (see save_tracking_data).
+
+    tracking_settings : TrackingSettings
+        Settings used to track the video. If inclusion_mask_filename is set,
+        the inclusion mask is loaded from that file (see
+        load_inclusion_mask).
+
+    use_checkpoint : bool, optional (default=True)
+        Whether to checkpoint results while tracking.
+
+    profile : bool, optional (default=False)
+        Whether to profile tracking. If True, a report of the time spent in
+        each stage (see TrackingProfile) is saved alongside the results
+        (see get_profile_filename).
+
+    Returns
+    -------
+    summary : dict
+        Contains the keys in SUMMARY_COLUMNS. 'n_resumed' is the number of
+        frames restored from a checkpoint, which aren't counted towards
+        'frames_per_second' (this is None if every frame was restored). If
+        tracking failed, 'error' holds the traceback, and all other values
+        (except 'video') are None.
+    """
+    summary = dict((column, None) for column in SUMMARY_COLUMNS)
+    summary['video'] = video_filename
+    start_time = time.time()
+    tracking_profile = TrackingProfile() if profile else None
+    resumed = [0]
+    def store_resumed(n_resumed):
+        resumed[0] = n_resumed
+        if tracking_profile is not None:
+            tracking_profile.n_resumed = n_resumed
+
+    try:
+        geometry = load_frame_geometry(video_filename)
+        video = open_video(video_filename)
+        try:
+            if tracking_settings.inclusion_mask_filename is not None:
+                # the mask is loaded for this video only, so don't keep it
+                # on settings that may be shared with other videos.
+                tracking_settings = copy.copy(tracking_settings)
+                tracking_settings.inclusion_mask = load_inclusion_mask(
+                    tracking_settings.inclusion_mask_filename,
+                    (video.get_height(), video.get_width()), geometry)
+
+            checkpoint_filename = None
+            if use_checkpoint:
+                checkpoint_filename = get_checkpoint_filename(output_filename)
+            results = track_video_with_settings(video, tracking_settings,
+                checkpoint_filename=checkpoint_filename,
+                profile=tracking_profile, resume_callback=store_resumed)
+        finally:
+            video.close()
+
+        if tracking_profile is not None:
+            with tracking_profile.stage('save'):
+                save_tracking_data(results, output_filename, geometry)
+            tracking_profile.stop()
+            tracking_profile.save(get_profile_filename(output_filename))
+        else:
+            save_tracking_data(results, output_filename, geometry)
+        if checkpoint_filename is not None:
+            remove_checkpoint(checkpoint_filename)
+    except Exception:
+        summary['error'] = traceback.format_exc()
+        return summary
+
+    seconds = time.time() - start_time
+    n_tracked = results.shape[0] - resumed[0]
+    summary.update({
+        'output': output_filename,
+        'n_frames': results.shape[0],
+        'n_resumed': resumed[0],
+        'n_lost': int(np.sum(~results['found'])),
+        'seconds': seconds,
+        'frames_per_second': n_tracked / seconds if n_tracked > 0 else None,
+    })
+    return summary
+
+def _track_video_job(job):
+    """Target of each worker process in track_videos()."""
+    job_ix, args = job
+    return job_ix, track_video_file(*args)
+
+def track_videos(video_filenames, tracking_settings, output_dir=None,
+    n_processes=None, use_checkpoint=True, callback=None, profile=False):
+    """Tracks many videos, spreading them across a pool of processes.
+
+    Parameters
+    ----------
+    video_filenames : list of string
+        Paths to videos to track (see open_video).
+
+    tracking_settings : TrackingSettings
+        Settings used to track every video. When more than one process is
+        used, each video is tracked within a single process (ie.
+        tracking_settings.n_processes is ignored).
+
+    output_dir : string or None, optional (default=None)
+        Directory to save results in (see get_output_filename). Videos whose
+        results would be saved to the same file (eg. videos with the same
+        name, from different directories) can't be tracked together.
+
+    n_processes : int or None, optional (default=None)
+        How many videos to track at once. If None, the number of CPUs
+        is used.
+
+    use_checkpoint : bool, optional (default=True)
+        Whether to checkpoint results while tracking (see track_video_file).
+
+    callback : function or None, optional (default=None)
+        Called with the summary of each video, as it is completed.
+
+    profile : bool, optional (default=False)
+        Whether to save a profile of tracking alongside the results of each
+        video (see track_video_file).
+
+    Returns
+    -------
+    summary : pd.DataFrame
+        Contains the columns in SUMMARY_COLUMNS, with one row for each
+        video (in the order given).
+
+    Raises
+    ------
+    ValueError
+        If the results of more than one video would be saved to the same
+        file.
+    """
+    output_filenames = [get_output_filename(video_filename, output_dir)
+        for video_filename in video_filenames]
+    check_output_filenames(output_filenames)
+
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    n_processes = max(1, min(n_processes, len(video_filenames)))
+
+    if n_processes > 1:
+        # daemonic worker processes cannot start pools of their own.
+        tracking_settings = copy.copy(tracking_settings)
+        tracking_settings.n_processes = 1
+
+    jobs = [(job_ix, (video_filename, output_filename, tracking_settings,
+        use_checkpoint, profile)) for job_ix, (video_filename,
+        output_filename) in enumerate(zip(video_filenames, output_filenames))]
+
+    summaries = [None] * len(jobs)
+    def store_summary(job_ix, summary):
+        summaries[job_ix] = summary
+        if callback is not None:
+            callback(summary)
+
+    if n_processes == 1:
+        for job in jobs:
+            store_summary(*_track_video_job(job))
+    else:
+        pool = multiprocessing.Pool(processes=n_processes)
+        try:
+            # videos finish in any order, so that a long video doesn't hold
+            # up reporting of the others.
+            for job_ix, summary in pool.imap_unordered(
+                _track_video_job, jobs):
+                store_summary(job_ix, summary)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    return pd.DataFrame(summaries, columns=SUMMARY_COLUMNS)
@@ -0,0 +1,211 @@
+# Checkpointing of tracking results (so that tracking can be resumed).
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from _tracking_algorithms import TRACKING_DTYPE
+
+
+class CheckpointMismatchError(ValueError):
+    """Raised when trying to resume from a checkpoint that was created with
+    different tracking settings."""
+
+
+def get_settings_fingerprint(video, tracking_settings):
+    """Gets a description of everything that affects the results of
+    tracking a video.
+
+    Parameters
+    ----------
+    video : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
+        Video being tracked.
+
+    tracking_settings : TrackingSettings
+        Settings used to track the video.
+
+    Returns
+    -------
+    fingerprint : dict
+        JSON-serializable description of the video and tracking settings.
+    """
+    inclusion_mask = tracking_settings.inclusion_mask
+    if inclusion_mask is not None:
+        inclusion_mask = np.ascontiguousarray(inclusion_mask, dtype=np.bool)
+        inclusion_mask = hashlib.sha1(inclusion_mask.tostring()).hexdigest()
+
+    video_filename = getattr(video, 'filename', None)
+    if video_filename is not None:
+        video_filename = os.path.abspath(video_filename)
+
+    fingerprint = {
+        'video_filename': video_filename,
+        'n_frames': video.get_n_frames(),
+        'threshold': tracking_settings.threshold,
+        'threshold_mode': tracking_settings.threshold_mode,
+        'background_n_frames': tracking_settings.background_n_frames,
+        'background_mode': tracking_settings.background_mode,
+        'search_window_size': tracking_settings.search_window_size,
+        'pyramid_factor': tracking_settings.pyramid_factor,
+        'inclusion_mask_sha1': inclusion_mask
+    }
+    # round-trip through json, so that this compares equal to a
+    # fingerprint loaded from disk.
+    return json.loads(json.dumps(fingerprint))
+
+
+def get_checkpoint_filename(filename):
+    """Gets the name of the checkpoint file used while tracking a video.
+
+    Parameters
+    ----------
+    filename : string
+        Path to the video being tracked (as in the GUI) or, when each video
+        may be tracked more than once with different settings (see
+        track_video_file), to where its results will be saved.
+
+    Returns
+    -------
+    checkpoint_filename : string
+        The checkpoint is kept alongside `filename`.
+    """
+    return filename + '.checkpoint'
+
+
+def remove_checkpoint(filename):
+    """Deletes a checkpoint (and its metadata) from disk, if it exists.
+
+    Parameters
+    ----------
+    filename : string
+        Path to checkpoint file.
+    """
+    for checkpoint_file in [filename, filename + '.json']:
+        if os.path.isfile(checkpoint_file):
+            os.remove(checkpoint_file)
+
+
+def get_n_checkpointed_frames(filename):
+    """Gets how many frames have been saved to a checkpoint.
+
+    Parameters
+    ----------
+    filename : string
+        Path to checkpoint file.
+
+    Returns
+    -------
+    n_frames : int
+        Number of complete records in the checkpoint (0 if it doesn't
+        exist).
+    """
+    if not os.path.isfile(filename):
+        return 0
+    return os.path.getsize(filename) // TRACKING_DTYPE.itemsize
+
+
+class TrackingCheckpoint:
+    """Incrementally saves tracking results to disk, so that tracking can be
+    resumed after a crash.
+
+    Results are appended to a binary file of TRACKING_DTYPE records, in
+    frame order. The settings used to produce them are stored in a
+    separate JSON file (named the same as the checkpoint, with the addition
+    of '.json').
+
+    Parameters
+    ----------
+    filename : string
+        Path to checkpoint file.
+
+    fingerprint : dict
+        Description of the video and tracking settings (see
+        get_settings_fingerprint).
+    """
+    def __init__(self, filename, fingerprint):
+        self.filename = filename
+        self.metadata_filename = filename + '.json'
+        self.fingerprint = fingerprint
+
+    def exists(self):
+        return os.path.isfile(self.metadata_filename)
+
+    def restore(self, results):
+        """Loads previously checkpointed results.
+
+        If there is no checkpoint on disk, a new (empty) one is created.
+
+        Parameters
+        ----------
+        results : np.array, dtype=TRACKING_DTYPE
+            Array holding results for every frame of the video. Frames that
+            have already been tracked are filled in.
+
+        Returns
+        -------
+        n_completed : int
+            Number of frames (from the start of the video) that have
+            already been tracked.
+
+        Raises
+        ------
+        CheckpointMismatchError
+            If the checkpoint was made with different tracking settings.
+        """
+        if not self.exists():
+            self.remove()
+            with open(self.metadata_filename, 'w') as f:
+                json.dump(self.fingerprint, f, indent=2, sort_keys=True)
+            open(self.filename, 'wb').close()
+            return 0
+
+        with open(self.metadata_filename, 'r') as f:
+            fingerprint = json.load(f)
+        if fingerprint != self.fingerprint:
+            changed = sorted(key for key in
+                set(fingerprint) | set(self.fingerprint)
+                if fingerprint.get(key) != self.fingerprint.get(key))
+            raise CheckpointMismatchError(
+                'Checkpoint {} was made with different settings ({}).'.format(
+                    self.filename, ', '.join(changed)))
+
+        records = np.zeros(0, dtype=TRACKING_DTYPE)
+        if os.path.isfile(self.filename):
+            # ignore any partially-written record at the end of the file.
+            n_records = (
+                os.path.getsize(self.filename) // TRACKING_DTYPE.itemsize)
+            records = np.fromfile(self.filename, dtype=TRACKING_DTYPE,
+                count=n_records)
+
+        # only keep records that form a contiguous run from the first frame.
+        n_completed = min(records.shape[0], results.shape[0])
+        is_contiguous = (
+            records['frame'][:n_completed] == np.arange(n_completed))
+        if not np.all(is_contiguous):
+            n_completed = np.argmin(is_contiguous)
+
+        results[:n_completed] = records[:n_completed]
+        with open(self.filename, 'ab') as f:
+            f.truncate(n_completed * TRACKING_DTYPE.itemsize)
+        return n_completed
+
+    def append(self, results):
+        """Appends tracking results to the checkpoint, and flushes them
+        to disk.
+
+        Parameters
+        ----------
+        results : np.array, dtype=TRACKING_DTYPE
+            Results for the frames immediately following those already
+            in the checkpoint.
+        """
+        with open(self.filename, 'ab') as f:
+            f.write(results.astype(TRACKING_DTYPE).tostring())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        """Deletes the checkpoint from disk."""
+        remove_checkpoint(self.filename)
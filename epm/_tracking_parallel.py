@@ -0,0 +1,189 @@
+# Multi-process tracking functions, independent of GUI go here.
+
+import copy
+import multiprocessing
+
+from _frame_sources import FramePrefetcher, open_video
+from _tracking_algorithms import (
+    calc_background_image,
+    get_tracking_threshold,
+    allocate_tracking_results,
+    track_frames,
+    get_detector,
+    LocalSearchDetector
+)
+from _tracking_profile import NULL_PROFILE, TrackingProfile
+
+# state held by each worker process; set by _init_worker().
+_worker = {}
+
+def _init_worker(video_filename, b_img, threshold, inclusion_mask,
+    search_window_size, pyramid_factor, use_profile):
+    """Opens a worker's own handle to the video, and prepares its
+    detector (and profile, if use_profile is True)."""
+    _worker['video'] = open_video(video_filename)
+    _worker['profile'] = TrackingProfile() if use_profile else None
+    _worker['detector'] = get_detector(b_img, threshold=threshold,
+        inclusion_mask=inclusion_mask, search_window_size=search_window_size,
+        pyramid_factor=pyramid_factor, profile=_worker['profile'])
+
+def _track_chunk(frame_range):
+    """Tracks frames [start, stop) of the worker's video.
+
+    Returns the index of the first frame, the chunk's results, and the
+    chunk's profile (or None, if the worker isn't profiling).
+    """
+    start, stop = frame_range
+    video, detector = _worker['video'], _worker['detector']
+    if isinstance(detector, LocalSearchDetector):
+        detector.reset()
+
+    results = allocate_tracking_results(stop - start, start=start)
+    track_frames(video, detector, results, start, stop)
+
+    chunk_profile = None
+    profile = _worker['profile']
+    if profile is not None:
+        profile.update_peak_memory()
+        chunk_profile = copy.deepcopy(profile)
+        profile.reset()
+    return start, results, chunk_profile
+
+def get_chunks(n_frames, chunk_size, start=0):
+    """Splits a range of frames into contiguous chunks.
+
+    Parameters
+    ----------
+    n_frames : int
+        Total number of frames.
+
+    chunk_size : int
+        Maximum number of frames per chunk.
+
+    start : int, optional (default=0)
+        Index of the first frame in the range.
+
+    Returns
+    -------
+    chunks : list of tuple
+        (start, stop) frame indices of each chunk, in order.
+    """
+    return [(chunk_start, min(chunk_start + chunk_size, n_frames))
+        for chunk_start in xrange(start, n_frames, chunk_size)]
+
+def track_video_parallel(video_filename, threshold=None,
+    background_n_frames=200, background_mode='mean', inclusion_mask=None,
+    search_window_size=None, pyramid_factor=None, n_processes=None,
+    chunk_size=500, progress_callback=None, b_img=None, start=0,
+    chunk_callback=None, threshold_mode='frame', profile=None):
+    """Tracks a video, splitting its frames into chunks which are tracked
+    across a pool of processes.
+
+    The background image is calculated once, then shared with each worker
+    process, which opens its own handle to the video. Note that when
+    streaming a compressed video (see FFmpegVideo), each worker decodes
+    every frame up to the chunks it tracks, so tracking many such videos
+    at once (see track_videos) makes better use of processes.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to video to track (see open_video).
+
+    threshold : float, optional (default=None)
+        Cutoff threshold. See track_video().
+
+    background_n_frames : int, optional (default=200)
+        How many frames to use for background sub.
+
+    background_mode : string, optional (default='mean')
+        How to combine frames into a background image. See
+        calc_background_image().
+
+    inclusion_mask : np.array, optional (default=None)
+        Which region of the image should be included in tracking.
+
+    search_window_size : int or None, optional (default=None)
+        If given, use a LocalSearchDetector within each chunk.
+
+    pyramid_factor : int or None, optional (default=None)
+        If given, search downsampled frames first (see PyramidDetector).
+
+    n_processes : int or None, optional (default=None)
+        How many worker processes to use. If None, the number of CPUs
+        is used.
+
+    chunk_size : int, optional (default=500)
+        How many frames each worker tracks at a time.
+
+    progress_callback : function or None, optional (default=None)
+        Called with the index of the last tracked frame, each time a
+        chunk is completed (in frame order).
+
+    b_img : np.array or None, optional (default=None)
+        Background image. If None, this is calculated from the video.
+
+    start : int, optional (default=0)
+        Index of the first frame to track. Results for earlier frames are
+        left empty.
+
+    chunk_callback : function or None, optional (default=None)
+        Called with the results of each chunk (an array of
+        TRACKING_DTYPE), as each chunk is completed (in frame order).
+
+    threshold_mode : string, optional (default='frame')
+        How to calculate a threshold if threshold is None. See
+        get_tracking_threshold().
+
+    profile : TrackingProfile or None, optional (default=None)
+        If given, each worker profiles the chunks it tracks, and these
+        profiles are merged into this one. Stage timings are therefore
+        summed across workers, and may add up to more than the time taken.
+
+    Returns
+    -------
+    results : np.array of shape [n_frames], dtype=TRACKING_DTYPE
+        Tracking results for every frame of the video.
+    """
+    parent_profile = NULL_PROFILE if profile is None else profile
+    video = open_video(video_filename)
+    try:
+        n_frames = video.get_n_frames()
+        if b_img is None:
+            with parent_profile.stage('background'):
+                b_img = calc_background_image(video,
+                    n_frames=background_n_frames, mode=background_mode)
+        with parent_profile.stage('threshold_selection'):
+            threshold = get_tracking_threshold(video, b_img, threshold,
+                threshold_mode, background_n_frames, inclusion_mask)
+    finally:
+        video.close()
+
+    pool = multiprocessing.Pool(
+        processes=n_processes,
+        initializer=_init_worker,
+        initargs=(video_filename, b_img, threshold, inclusion_mask,
+            search_window_size, pyramid_factor, profile is not None)
+        )
+    results = allocate_tracking_results(n_frames)
+    try:
+        # imap returns chunks in order, so progress is reported in frame
+        # order.
+        for chunk_start, chunk_results, chunk_profile in pool.imap(
+            _track_chunk, get_chunks(n_frames, chunk_size, start)):
+            if chunk_profile is not None:
+                profile.merge(chunk_profile)
+            chunk_stop = chunk_start + chunk_results.shape[0]
+            results[chunk_start:chunk_stop] = chunk_results
+            if chunk_callback is not None:
+                chunk_callback(chunk_results)
+            if progress_callback is not None:
+                progress_callback(chunk_stop - 1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
@@ -0,0 +1,374 @@
+# Profiling of the tracking pipeline (per-stage timings, per-frame latency,
+# and peak memory) goes here.
+
+import json
+import os
+import sys
+import time
+from timeit import default_timer
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # not available on windows.
+    resource = None
+
+# edges (in seconds) of the per-frame latency histogram; 8 bins per decade,
+# from 10 us to 10 s.
+LATENCY_BIN_EDGES = np.logspace(-5, 1, 6 * 8 + 1)
+
+def get_peak_memory():
+    """Gets the peak resident memory of this process.
+
+    Returns
+    -------
+    peak_memory : int or None
+        Peak memory (in bytes), or None if this can't be measured on the
+        current platform.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux, but in bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def get_profile_filename(output_filename):
+    """Gets the name of the file that a tracking profile is saved to.
+
+    Parameters
+    ----------
+    output_filename : string
+        Where tracking results are saved.
+
+    Returns
+    -------
+    profile_filename : string
+        The profile is kept alongside the tracking results, with the
+        extension replaced by '-profile.json'.
+    """
+    return os.path.splitext(output_filename)[0] + '-profile.json'
+
+
+class _Stage:
+    """Context manager that adds the time spent within it to a stage of a
+    TrackingProfile."""
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.add_stage_time(
+            self.name, default_timer() - self.start_time)
+        return False
+
+
+class _NullStage:
+    """Context manager that does nothing (see NullProfile)."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfile:
+    """Stand-in for a TrackingProfile that records nothing, so that code
+    being profiled doesn't need to check whether profiling is enabled."""
+    _null_stage = _NullStage()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def add_stage_time(self, name, seconds):
+        pass
+
+    def add_frame_latency(self, seconds):
+        pass
+
+    def time_frames(self, frames):
+        return frames
+
+# shared by everything that isn't being profiled.
+NULL_PROFILE = NullProfile()
+
+
+class TrackingProfile:
+    """Collects timings of each stage of tracking a video.
+
+    Code is timed by wrapping it in a named stage, eg.
+
+        with profile.stage('erosion'):
+            ...
+
+    The stages timed while tracking are 'background' (calculating the
+    background image), 'threshold_selection' (see get_tracking_threshold),
+    'frame_io' (reading, or waiting for, each frame), 'downsample' (see
+    PyramidDetector), 'subtract_background', 'threshold', 'erosion',
+    'labeling' (finding the largest blob), 'properties' (measuring that
+    blob), and 'checkpoint'. When a threshold is given for uint8 frames,
+    background subtraction is folded into thresholding (see
+    get_threshold_cutoffs), so no time is spent in 'subtract_background'.
+
+    Attributes
+    ----------
+    stage_seconds : dict
+        Total time (in seconds) spent in each stage.
+
+    stage_calls : dict
+        How many times each stage was entered.
+
+    latency_counts : np.array of shape [len(LATENCY_BIN_EDGES) + 1]
+        Histogram of how long each frame took to read and process.
+        latency_counts[i] holds the number of frames that took between
+        LATENCY_BIN_EDGES[i - 1] and LATENCY_BIN_EDGES[i] seconds; the first
+        and last bins hold frames that fell outside of the edges.
+
+    n_frames : int
+        How many frames have been tracked.
+
+    n_resumed : int
+        How many frames were restored from a checkpoint, rather than
+        tracked (these aren't included in n_frames).
+
+    peak_memory : int or None
+        Peak resident memory (in bytes) of the process (or, if profiles
+        from several processes have been merged, the largest of them). This
+        is updated by stop().
+    """
+    def __init__(self):
+        self.stage_seconds = {}
+        self.stage_calls = {}
+        self._stages = {}
+        self.latency_counts = np.zeros(
+            LATENCY_BIN_EDGES.size + 1, dtype=np.int64)
+        self.latency_seconds = 0.
+        self.latency_min = np.inf
+        self.latency_max = 0.
+        self.n_frames = 0
+        self.n_resumed = 0
+        self.peak_memory = None
+        self.start_time = time.time()
+        self.stop_time = None
+
+    def stage(self, name):
+        """Gets a context manager that times a stage of tracking.
+
+        Parameters
+        ----------
+        name : string
+            Name of the stage.
+
+        Returns
+        -------
+        stage : context manager
+            Stages are reused, so a stage must not be entered again
+            (eg. recursively) before it has been exited.
+        """
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = _Stage(self, name)
+        return stage
+
+    def add_stage_time(self, name, seconds, calls=1):
+        """Adds time spent in a stage."""
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.) + seconds
+        self.stage_calls[name] = self.stage_calls.get(name, 0) + calls
+
+    def add_frame_latency(self, seconds):
+        """Records how long a single frame took to read and process."""
+        self.latency_counts[
+            np.searchsorted(LATENCY_BIN_EDGES, seconds, side='right')] += 1
+        self.latency_seconds += seconds
+        self.latency_min = min(self.latency_min, seconds)
+        self.latency_max = max(self.latency_max, seconds)
+        self.n_frames += 1
+
+    def time_frames(self, frames):
+        """Iterates over frames, timing how long each takes to read (as the
+        'frame_io' stage), and how long each takes to both read and process
+        (as its latency).
+
+        Parameters
+        ----------
+        frames : iterable
+            Frames to be processed.
+
+        Returns
+        -------
+        frames : generator
+            Yields each item of frames. A frame has been processed once the
+            next frame is requested.
+        """
+        frames = iter(frames)
+        while True:
+            start_time = default_timer()
+            try:
+                frame = next(frames)
+            except StopIteration:
+                return
+            self.add_stage_time('frame_io', default_timer() - start_time)
+            yield frame
+            self.add_frame_latency(default_timer() - start_time)
+
+    def update_peak_memory(self):
+        """Updates peak_memory with that of the current process."""
+        peak_memory = get_peak_memory()
+        if peak_memory is not None:
+            self.peak_memory = max(self.peak_memory, peak_memory)
+
+    def stop(self):
+        """Marks the end of profiling, and records peak memory."""
+        self.stop_time = time.time()
+        self.update_peak_memory()
+
+    def reset(self):
+        """Clears all timings, keeping any stages handed out so far."""
+        stages = self._stages
+        self.__init__()
+        self._stages = stages
+
+    def merge(self, other):
+        """Adds the timings of another profile (eg. one collected in a
+        worker process) to this one.
+
+        Parameters
+        ----------
+        other : TrackingProfile
+        """
+        for name, seconds in other.stage_seconds.iteritems():
+            self.add_stage_time(name, seconds, other.stage_calls[name])
+        self.latency_counts += other.latency_counts
+        self.latency_seconds += other.latency_seconds
+        self.latency_min = min(self.latency_min, other.latency_min)
+        self.latency_max = max(self.latency_max, other.latency_max)
+        self.n_frames += other.n_frames
+        self.n_resumed += other.n_resumed
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+
+    def get_wall_seconds(self):
+        """Gets the time elapsed between creating this profile and calling
+        stop() (or now, if stop() hasn't been called)."""
+        stop_time = self.stop_time
+        if stop_time is None:
+            stop_time = time.time()
+        return stop_time - self.start_time
+
+    def get_latency_percentile(self, q):
+        """Estimates a percentile of per-frame latency from its histogram.
+
+        Parameters
+        ----------
+        q : float
+            Percentile to estimate, within [0, 100].
+
+        Returns
+        -------
+        latency : float
+            Upper edge (in seconds) of the histogram bin containing the
+            percentile (clipped to the slowest frame), or np.nan if no
+            frames have been tracked.
+        """
+        if self.n_frames == 0:
+            return np.nan
+        cumulative_counts = np.cumsum(self.latency_counts)
+        bin_ix = np.searchsorted(cumulative_counts, q / 100. * self.n_frames)
+        if bin_ix >= LATENCY_BIN_EDGES.size:
+            return self.latency_max
+        return min(LATENCY_BIN_EDGES[bin_ix], self.latency_max)
+
+    def to_dict(self):
+        """Gets a JSON-serializable report of this profile.
+
+        Returns
+        -------
+        report : dict
+            Contains 'wall_seconds', 'n_frames', 'n_resumed',
+            'frames_per_second', 'peak_memory_mb', 'stages' (a list of
+            dicts containing the 'name', 'calls', 'seconds', and
+            'ms_per_frame' of each stage, from slowest to fastest), and
+            'latency' (a dict containing the 'min', 'mean', 'p50', 'p90',
+            'p99', and 'max' latency in milliseconds, and the
+            'bin_edges_ms' and 'counts' of the latency histogram).
+        """
+        wall_seconds = self.get_wall_seconds()
+        n_frames = max(self.n_frames, 1)
+        stages = [{
+            'name': name,
+            'calls': self.stage_calls[name],
+            'seconds': seconds,
+            'ms_per_frame': 1000. * seconds / n_frames,
+            } for name, seconds in sorted(self.stage_seconds.iteritems(),
+                key=lambda item: -item[1])]
+
+        latency = {}
+        if self.n_frames > 0:
+            latency = {
+                'min': 1000. * self.latency_min,
+                'mean': 1000. * self.latency_seconds / self.n_frames,
+                'max': 1000. * self.latency_max,
+            }
+            for q in [50, 90, 99]:
+                latency['p{}'.format(q)] = \
+                    1000. * self.get_latency_percentile(q)
+        latency['bin_edges_ms'] = (1000. * LATENCY_BIN_EDGES).tolist()
+        latency['counts'] = self.latency_counts.tolist()
+
+        peak_memory_mb = None
+        if self.peak_memory is not None:
+            peak_memory_mb = self.peak_memory / 2.**20
+
+        return {
+            'wall_seconds': wall_seconds,
+            'n_frames': self.n_frames,
+            'n_resumed': self.n_resumed,
+            'frames_per_second': self.n_frames / wall_seconds,
+            'peak_memory_mb': peak_memory_mb,
+            'stages': stages,
+            'latency': latency,
+        }
+
+    def format_report(self):
+        """Gets a human-readable summary of this profile.
+
+        Returns
+        -------
+        report : string
+        """
+        report = self.to_dict()
+        lines = ['{} frames in {:.2f} s ({:.1f} frames/sec)'.format(
+            report['n_frames'], report['wall_seconds'],
+            report['frames_per_second'])]
+        if report['n_resumed'] > 0:
+            lines.append('{} frames resumed from checkpoint'.format(
+                report['n_resumed']))
+        if report['peak_memory_mb'] is not None:
+            lines.append('peak memory: {:.1f} MB'.format(
+                report['peak_memory_mb']))
+        if report['n_frames'] > 0:
+            lines.append('latency (ms): min {min:.3f}, p50 {p50:.3f}, '
+                'p90 {p90:.3f}, p99 {p99:.3f}, max {max:.3f}'.format(
+                    **report['latency']))
+        lines.append('{:<20} {:>8} {:>10} {:>12}'.format(
+            'stage', 'calls', 'seconds', 'ms/frame'))
+        for stage in report['stages']:
+            lines.append('{name:<20} {calls:>8} {seconds:>10.3f} '
+                '{ms_per_frame:>12.4f}'.format(**stage))
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        """Saves this profile's report (see to_dict) as JSON.
+
+        Parameters
+        ----------
+        filename : string
+            Where to save the report (see get_profile_filename).
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
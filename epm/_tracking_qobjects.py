@@ -1,20 +1,28 @@
 # Tracking objects, associated with GUI go here.
 
+import traceback
+
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
-from _tracking_algorithms import (
-    calc_background_image,
-    threshold_image,
-    get_otsu_threshold,
-    convert_img_to_uint8,
-    find_mouse
+from _frame_sources import open_thread_handle
+from _tracking_algorithms import tracking_results_to_df
+from _tracking_profile import TrackingProfile
+from _tracking_runner import (
+    TrackingCancelledError,
+    TrackingControl,
+    throttle_progress,
+    track_video_with_settings
 )
 
 
 class Tracker(QObject):
     """Class used to track mouse in EPM.
 
+    Tracking can either be run synchronously (see track_video), or in a
+    worker thread (see start), in which case it can be paused, resumed, and
+    cancelled from the GUI thread, and results are delivered by signal.
+
     Parameters
     ----------
     video : motmot.FlyMovieFormat.FlyMovieFormat
@@ -23,33 +31,148 @@ class Tracker(QObject):
     tracking_settings : TrackingSettings
         Tracking settings used to track video.
 
+    progress_interval : float, optional (default=0.1)
+        Minimum time (in seconds) between progress signals.
+
+    profile : bool, optional (default=False)
+        Whether to profile tracking. If True, the profile of the most recent
+        call to track_video() is kept as tracking_profile (see
+        TrackingProfile).
+
     Signals
     -------
     progress : pyqtSignal
         Frame number currently being tracked. Emitted in call to
-        track_video().
+        track_video(), at most once every progress_interval seconds (and
+        for the last frame).
+
+    preview : pyqtSignal
+        Interpolated tracking data (pd.DataFrame) for the whole video.
+        Emitted after each pass when tracking progressively (see
+        TrackingSettings.progressive_stride).
+
+    completed : pyqtSignal
+        Tracking results (np.array, dtype=TRACKING_DTYPE). Emitted when
+        tracking started by start() finishes.
+
+    cancelled : pyqtSignal
+        Emitted when tracking started by start() is cancelled.
+
+    failed : pyqtSignal
+        The exception raised by, and formatted traceback of, tracking
+        started by start() that failed.
     """
 
     progress = pyqtSignal(int)
+    preview = pyqtSignal(object)
+    completed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(object, str)
 
-    def __init__(self, video, tracking_settings, parent=None):
+    def __init__(self, video, tracking_settings, progress_interval=0.1,
+        profile=False, parent=None):
         super(Tracker, self).__init__(parent)
         self.video = video
         self.tracking_settings = tracking_settings
+        self.progress_interval = progress_interval
+        self.profile = profile
+        self.tracking_profile = None
+        self.control = TrackingControl()
+        self.checkpoint_filename = None
+        self._thread = None
+
+    def track_video(self, checkpoint_filename=None):
+        """Tracks the video, emitting progress as frames are tracked.
+
+        Parameters
+        ----------
+        checkpoint_filename : string or None, optional (default=None)
+            If given, results are periodically saved to (and, if possible,
+            resumed from) this file. See track_video_with_settings().
+
+        Returns
+        -------
+        results : np.array of shape [n_frames], dtype=TRACKING_DTYPE
+
+        Raises
+        ------
+        TrackingCancelledError
+            If tracking was cancelled (see cancel).
+        """
+        self.tracking_profile = TrackingProfile() if self.profile else None
+        video, opened = open_thread_handle(self.video)
+        try:
+            return track_video_with_settings(
+                video, self.tracking_settings,
+                progress_callback=throttle_progress(self.progress.emit,
+                    self.progress_interval, video.get_n_frames() - 1),
+                checkpoint_filename=checkpoint_filename,
+                preview_callback=lambda results: self.preview.emit(
+                    tracking_results_to_df(results)),
+                profile=self.tracking_profile,
+                control=self.control)
+        finally:
+            if opened:
+                video.close()
+
+    def start(self, checkpoint_filename=None):
+        """Starts tracking the video in a worker thread.
+
+        One of completed, cancelled, or failed is emitted when tracking
+        stops. Note that the Tracker is moved to the worker thread, so
+        should not have a parent.
+
+        Parameters
+        ----------
+        checkpoint_filename : string or None, optional (default=None)
+            See track_video().
+        """
+        if self.is_running():
+            raise RuntimeError('Tracking is already running.')
+        if self._thread is None:
+            self._thread = QThread()
+            self.moveToThread(self._thread)
+            self._thread.started.connect(self.run)
+
+        self.checkpoint_filename = checkpoint_filename
+        self.control = TrackingControl()
+        self._thread.start()
+
+    @pyqtSlot()
+    def run(self):
+        """Tracks the video within the worker thread (see start)."""
+        try:
+            results = self.track_video(self.checkpoint_filename)
+        except TrackingCancelledError:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(e, traceback.format_exc())
+        else:
+            self.completed.emit(results)
+        finally:
+            self._thread.quit()
+
+    def pause(self):
+        """Pauses tracking (the next time progress is reported)."""
+        self.control.pause()
+
+    def resume(self):
+        """Resumes paused tracking."""
+        self.control.resume()
+
+    def cancel(self):
+        """Cancels tracking. Results checkpointed so far are kept, so that
+        tracking can be resumed later."""
+        self.control.cancel()
+
+    def is_paused(self):
+        return self.control.is_paused()
+
+    def is_running(self):
+        """Checks whether the worker thread is running."""
+        return self._thread is not None and self._thread.isRunning()
 
-    def track_video(self):
-        b_img = calc_background_image(
-            self.video,
-            n_frames=self.tracking_settings.background_n_frames)
-
-        props = []
-        for ix in xrange(self.video.get_n_frames()):
-            img, _ = self.video.get_frame(ix)
-            props.append(
-                find_mouse(img, b_img,
-                    threshold=self.tracking_settings.threshold,
-                    inclusion_mask=self.tracking_settings.inclusion_mask)
-                )
-            self.progress.emit(ix)
-
-        return props
+    def wait(self):
+        """Blocks until the worker thread (if any) has finished."""
+        if self._thread is not None:
+            self._thread.wait()
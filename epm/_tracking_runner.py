@@ -0,0 +1,271 @@
+# Functions to track a whole video from a set of TrackingSettings,
+# independent of GUI, go here.
+
+import threading
+from timeit import default_timer
+
+from _tracking_algorithms import (
+    calc_background_image,
+    get_tracking_threshold,
+    allocate_tracking_results,
+    track_frames,
+    track_frames_progressive,
+    get_detector
+)
+from _tracking_checkpoint import (
+    TrackingCheckpoint,
+    get_settings_fingerprint
+)
+from _tracking_parallel import (
+    get_chunks,
+    track_video_parallel
+)
+from _tracking_profile import NULL_PROFILE
+
+
+class TrackingCancelledError(Exception):
+    """Raised by track_video_with_settings() when tracking is cancelled
+    (see TrackingControl)."""
+
+
+class TrackingControl:
+    """Lets tracking be paused, resumed, or cancelled from another thread.
+
+    Tracking checks its control between the stages of tracking, and each
+    time it reports progress (after every frame, or after every chunk when
+    tracking with more than one process). All methods are thread-safe.
+    """
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    def pause(self):
+        """Pauses tracking the next time the control is checked."""
+        self._running.clear()
+
+    def resume(self):
+        """Resumes paused tracking."""
+        self._running.set()
+
+    def cancel(self):
+        """Cancels tracking (even if it is paused)."""
+        self._cancelled.set()
+        self._running.set()
+
+    def is_paused(self):
+        return not self._running.is_set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        """Blocks while tracking is paused.
+
+        Raises
+        ------
+        TrackingCancelledError
+            If tracking has been cancelled.
+        """
+        if not self._running.is_set():
+            self._running.wait()
+        if self._cancelled.is_set():
+            raise TrackingCancelledError('Tracking was cancelled.')
+
+
+def throttle_progress(progress_callback, min_interval=0.1, final_ix=None):
+    """Limits how often progress is reported.
+
+    Parameters
+    ----------
+    progress_callback : function
+        Called with the index of the most recently tracked frame.
+
+    min_interval : float, optional (default=0.1)
+        Minimum time (in seconds) between calls to progress_callback.
+
+    final_ix : int or None, optional (default=None)
+        Index of the last frame to be tracked. Progress for this frame is
+        always reported.
+
+    Returns
+    -------
+    throttled_callback : function
+        Calls progress_callback at most once every min_interval seconds
+        (and for final_ix), dropping calls in between.
+    """
+    last_call = [-float('inf')]
+
+    def throttled_callback(ix):
+        now = default_timer()
+        if now - last_call[0] >= min_interval or ix == final_ix:
+            last_call[0] = now
+            progress_callback(ix)
+
+    return throttled_callback
+
+def track_video_with_settings(video, tracking_settings,
+    progress_callback=None, checkpoint_filename=None, checkpoint_every=1000,
+    preview_callback=None, profile=None, control=None, resume_callback=None):
+    """Tracks a video.
+
+    Parameters
+    ----------
+    video : motmot.FlyMovieFormat.FlyMovie or MemmapFlyMovie
+        Video to track.
+
+    tracking_settings : TrackingSettings
+        Settings used to track the video.
+
+    progress_callback : function or None, optional (default=None)
+        Called with the index of the most recently tracked frame.
+
+    checkpoint_filename : string or None, optional (default=None)
+        If given, tracking results are flushed to this file every
+        `checkpoint_every` frames. If this file already exists (and was
+        created with the same tracking settings), tracking resumes from the
+        last checkpointed frame. See TrackingCheckpoint.
+
+    checkpoint_every : int, optional (default=1000)
+        How many frames to track between each checkpoint. When tracking
+        progressively, results are only checkpointed once every pass
+        is complete.
+
+    preview_callback : function or None, optional (default=None)
+        When tracking progressively (see
+        TrackingSettings.progressive_stride), this is called after each
+        pass with the results so far (see track_frames_progressive).
+
+    profile : TrackingProfile or None, optional (default=None)
+        If given, the time spent in each stage of tracking (including
+        checkpointing) is added to this profile.
+
+    control : TrackingControl or None, optional (default=None)
+        If given, tracking can be paused, resumed, or cancelled through
+        this control. As results are checkpointed as tracking goes,
+        cancelled tracking can later be resumed from its checkpoint.
+
+    resume_callback : function or None, optional (default=None)
+        Called with the number of frames restored from the checkpoint (ie.
+        that won't be tracked again), before tracking starts.
+
+    Returns
+    -------
+    results : np.array of shape [n_frames], dtype=TRACKING_DTYPE
+        Tracking results for every frame of the video.
+
+    Raises
+    ------
+    CheckpointMismatchError
+        If the checkpoint was made with different tracking settings.
+
+    TrackingCancelledError
+        If tracking was cancelled through control.
+    """
+    progressive_stride = tracking_settings.progressive_stride
+    if progressive_stride is not None and (
+        tracking_settings.search_window_size is not None or
+        tracking_settings.n_processes > 1):
+        raise ValueError('Progressive tracking cannot be used with a search '
+            'window, or with more than one process.')
+
+    n_frames = video.get_n_frames()
+    results = allocate_tracking_results(n_frames)
+    if profile is None:
+        profile = NULL_PROFILE
+    if control is not None:
+        progress_callback = _get_controlled_callback(
+            progress_callback, control)
+
+    start = 0
+    checkpoint = None
+    if checkpoint_filename is not None:
+        with profile.stage('checkpoint'):
+            checkpoint = TrackingCheckpoint(checkpoint_filename,
+                get_settings_fingerprint(video, tracking_settings))
+            start = checkpoint.restore(results)
+        if resume_callback is not None:
+            resume_callback(start)
+        if start > 0 and progress_callback is not None:
+            progress_callback(start - 1)
+    if start == n_frames:
+        return results
+
+    with profile.stage('background'):
+        b_img = calc_background_image(video,
+            n_frames=tracking_settings.background_n_frames,
+            mode=tracking_settings.background_mode)
+    if control is not None:
+        control.check()
+    with profile.stage('threshold_selection'):
+        threshold = get_tracking_threshold(video, b_img,
+            threshold=tracking_settings.threshold,
+            threshold_mode=tracking_settings.threshold_mode,
+            background_n_frames=tracking_settings.background_n_frames,
+            inclusion_mask=tracking_settings.inclusion_mask)
+    if control is not None:
+        control.check()
+
+    if tracking_settings.n_processes > 1:
+        track_video_parallel(
+            video.filename,
+            threshold=threshold,
+            inclusion_mask=tracking_settings.inclusion_mask,
+            search_window_size=tracking_settings.search_window_size,
+            pyramid_factor=tracking_settings.pyramid_factor,
+            n_processes=tracking_settings.n_processes,
+            chunk_size=checkpoint_every,
+            progress_callback=progress_callback,
+            b_img=b_img,
+            start=start,
+            chunk_callback=lambda chunk_results: _store_chunk(
+                results, chunk_results, checkpoint, profile),
+            profile=None if profile is NULL_PROFILE else profile)
+        return results
+
+    detector = get_detector(b_img,
+        threshold=threshold,
+        inclusion_mask=tracking_settings.inclusion_mask,
+        search_window_size=tracking_settings.search_window_size,
+        pyramid_factor=tracking_settings.pyramid_factor,
+        profile=profile)
+
+    if progressive_stride is not None:
+        track_frames_progressive(video, detector, results, start,
+            stride=progressive_stride,
+            pass_callback=preview_callback,
+            progress_callback=progress_callback)
+        if checkpoint is not None:
+            with profile.stage('checkpoint'):
+                checkpoint.append(results[start:])
+        return results
+
+    for chunk_start, chunk_stop in get_chunks(
+        n_frames, checkpoint_every, start):
+        chunk_results = results[chunk_start:chunk_stop]
+        track_frames(video, detector, chunk_results, chunk_start, chunk_stop,
+            progress_callback=progress_callback)
+        if checkpoint is not None:
+            with profile.stage('checkpoint'):
+                checkpoint.append(chunk_results)
+
+    return results
+
+def _get_controlled_callback(progress_callback, control):
+    """Wraps a progress callback so that control is checked every time
+    progress is reported."""
+    def controlled_callback(ix):
+        control.check()
+        if progress_callback is not None:
+            progress_callback(ix)
+    return controlled_callback
+
+def _store_chunk(results, chunk_results, checkpoint=None,
+    profile=NULL_PROFILE):
+    """Copies the results of a chunk of frames into the results for the
+    whole video, and appends them to a checkpoint (if given)."""
+    chunk_start = chunk_results['frame'][0]
+    results[chunk_start:chunk_start + chunk_results.shape[0]] = chunk_results
+    if checkpoint is not None:
+        with profile.stage('checkpoint'):
+            checkpoint.append(chunk_results)
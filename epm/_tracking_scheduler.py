@@ -0,0 +1,394 @@
+# Scheduling of large numbers of tracking jobs (without a GUI) goes here.
+
+import copy
+import json
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+
+from _frame_sources import open_video, probe_video
+from _frame_store import FRAME_STORE_EXTENSION
+from _tracking_algorithms import TRACKING_DTYPE
+from _tracking_batch import (
+    SETTINGS_KEYS,
+    check_output_filenames,
+    get_output_filename,
+    track_video_file
+)
+from _tracking_checkpoint import get_checkpoint_filename, remove_checkpoint
+
+# states that a job may be in.
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+# bytes per pixel of a frame used to hold the background while tracking (see
+# estimate_job_memory): about three float64 images (the background as it is
+# accumulated, as it is used for subtraction, and the background-subtracted
+# frame), plus a few uint8/bool images (eg. the binary and eroded frames).
+BACKGROUND_BYTES_PER_PIXEL = 3 * 8 + 8
+
+def read_manifest(filename, tracking_settings):
+    """Reads a manifest of tracking jobs.
+
+    Parameters
+    ----------
+    filename : string
+        CSV file with one row per job. The 'video' column is required.
+        The 'mask' (see load_inclusion_mask) and 'output' (defaults to
+        alongside the video, see get_output_filename) columns are optional.
+        Any other column must be named after a key in SETTINGS_KEYS (eg.
+        'threshold'), and overrides that setting for its row. Empty cells
+        are ignored. Relative paths are relative to the manifest. Rows may
+        share a video (eg. to track it at several thresholds), but not an
+        output.
+
+    tracking_settings : TrackingSettings
+        Default settings for every job.
+
+    Returns
+    -------
+    jobs : list of TrackingJob
+
+    Raises
+    ------
+    ValueError
+        If the manifest has no video column, has unknown columns, or more
+        than one row would be saved to the same output.
+    """
+    manifest = pd.read_csv(filename)
+    if 'video' not in manifest.columns:
+        raise ValueError('Manifest {} has no video column.'.format(filename))
+    unknown_columns = sorted(set(manifest.columns) -
+        set(['video', 'mask', 'output']) - set(SETTINGS_KEYS))
+    if len(unknown_columns) > 0:
+        raise ValueError('Unknown columns in manifest {}: {}.'.format(
+            filename, ', '.join(unknown_columns)))
+
+    manifest_dir = os.path.dirname(os.path.abspath(filename))
+    def get_path(path):
+        return os.path.normpath(os.path.join(manifest_dir, path))
+
+    jobs = []
+    for _, row in manifest.iterrows():
+        row = row[row.notnull()]
+        settings = copy.deepcopy(tracking_settings)
+        for key in SETTINGS_KEYS:
+            if key in row:
+                value = row[key]
+                # pandas reads whole-number columns as floats (if any of
+                # their cells are empty).
+                if isinstance(value, float) and key != 'threshold' and \
+                    value.is_integer():
+                    value = int(value)
+                setattr(settings, key, value)
+        if 'mask' in row:
+            settings.inclusion_mask_filename = get_path(row['mask'])
+
+        video_filename = get_path(row['video'])
+        if 'output' in row:
+            output_filename = get_path(row['output'])
+        else:
+            output_filename = get_output_filename(video_filename)
+        jobs.append(TrackingJob(video_filename, output_filename, settings))
+
+    check_output_filenames([job.output_filename for job in jobs])
+    return jobs
+
+def estimate_job_memory(video_filename, block_size=64, max_blocks=4):
+    """Estimates the peak memory (in bytes) used to track a video.
+
+    Only the video's header is read, so this is cheap even for long,
+    compressed videos. The frames of videos decoded by ffmpeg aren't
+    counted (see probe_video), so their length may be approximate.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to video.
+
+    block_size, max_blocks : int, optional (default=64, 4)
+        Size of the blocks of frames read by the FramePrefetcher that feeds
+        the tracker, and how many of these may be queued.
+
+    Returns
+    -------
+    n_bytes : int
+        Memory used to hold results, the background (and its derived
+        images, see BACKGROUND_BYTES_PER_PIXEL), and the blocks of MONO8
+        frames held by the FramePrefetcher (those queued, the block being
+        read, and the block being tracked).
+    """
+    extension = os.path.splitext(video_filename)[1].lower()
+    if extension in ['.fmf', FRAME_STORE_EXTENSION]:
+        video = open_video(video_filename, memmap=False)
+        try:
+            n_frames = video.get_n_frames()
+            frame_bytes = video.get_height() * video.get_width()
+        finally:
+            video.close()
+    else:
+        info = probe_video(video_filename, count_frames=False)
+        n_frames = info['n_frames']
+        frame_bytes = info['height'] * info['width']
+
+    background_bytes = frame_bytes * BACKGROUND_BYTES_PER_PIXEL
+    prefetch_bytes = frame_bytes * block_size * (max_blocks + 2)
+    return (n_frames * TRACKING_DTYPE.itemsize + background_bytes +
+        prefetch_bytes)
+
+
+class TrackingJob:
+    """A single video to track.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to video to track.
+
+    output_filename : string
+        Where to save tracking results.
+
+    tracking_settings : TrackingSettings
+        Settings used to track the video.
+    """
+    def __init__(self, video_filename, output_filename, tracking_settings):
+        self.video_filename = video_filename
+        self.output_filename = output_filename
+        self.tracking_settings = tracking_settings
+
+    def get_fingerprint(self):
+        """Gets a description of everything that affects this job's output.
+
+        Returns
+        -------
+        fingerprint : dict
+            JSON-serializable. Contains the video, mask, and output
+            filenames, and the values of SETTINGS_KEYS (other than
+            n_processes).
+        """
+        fingerprint = dict((key, getattr(self.tracking_settings, key))
+            for key in SETTINGS_KEYS if key != 'n_processes')
+        fingerprint.update({
+            'video': self.video_filename,
+            'mask': self.tracking_settings.inclusion_mask_filename,
+            'output': self.output_filename
+        })
+        return json.loads(json.dumps(fingerprint))
+
+    def is_output_current(self):
+        """Checks whether this job's output exists, and is newer than its
+        inputs (the video and mask)."""
+        if not os.path.isfile(self.output_filename):
+            return False
+        output_time = os.path.getmtime(self.output_filename)
+        for input_filename in [self.video_filename,
+            self.tracking_settings.inclusion_mask_filename]:
+            if input_filename is not None and \
+                os.path.getmtime(input_filename) > output_time:
+                return False
+        return True
+
+
+class JobStateFile:
+    """Keeps track of the state of each job in a JSON file on disk.
+
+    The file maps each job's output filename to a record containing the
+    keys 'state' (one of PENDING, RUNNING, DONE, or FAILED), 'attempts',
+    'error', 'finished' (time, in seconds since the epoch), and
+    'fingerprint' (see TrackingJob.get_fingerprint). The file is rewritten
+    atomically after every change, so it can be inspected at any time.
+
+    Parameters
+    ----------
+    filename : string
+        Path to state file. If this exists, previous states are loaded.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.records = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                self.records = json.load(f)
+
+    def get(self, job):
+        """Gets the record of a job, or None if it has never been run."""
+        return self.records.get(job.output_filename)
+
+    def set(self, job, state, **kwargs):
+        """Updates the record of a job, and saves the state file.
+
+        Parameters
+        ----------
+        job : TrackingJob
+
+        state : string
+            One of PENDING, RUNNING, DONE, or FAILED.
+
+        **kwargs
+            Other values to store in the job's record.
+        """
+        record = self.records.setdefault(job.output_filename, {
+            'attempts': 0, 'error': None, 'finished': None})
+        record['state'] = state
+        record['fingerprint'] = job.get_fingerprint()
+        record.update(kwargs)
+        self.save()
+
+    def save(self):
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump(self.records, f, indent=2, sort_keys=True)
+        os.rename(temp_filename, self.filename)
+
+    def is_current(self, job):
+        """Checks whether a job has finished with its current settings, and
+        its output is still up-to-date."""
+        record = self.get(job)
+        return (record is not None and record['state'] == DONE and
+            record['fingerprint'] == job.get_fingerprint() and
+            job.is_output_current())
+
+
+def _run_job(job):
+    """Target of each worker process in run_jobs()."""
+    return track_video_file(job.video_filename, job.output_filename,
+        job.tracking_settings)
+
+def run_jobs(jobs, state_filename, n_processes=None, memory_budget=None,
+    max_retries=2, callback=None, poll_interval=0.5):
+    """Runs tracking jobs, skipping those whose outputs are up-to-date.
+
+    Each job is tracked in its own worker process, and resumes from any
+    checkpoint left by an earlier run of the same job (see
+    track_video_file). Jobs left 'running' by a scheduler that was killed
+    are re-run.
+
+    Parameters
+    ----------
+    jobs : list of TrackingJob
+        Jobs to run.
+
+    state_filename : string
+        Where to keep the state of each job (see JobStateFile).
+
+    n_processes : int or None, optional (default=None)
+        Maximum number of jobs to run at once. If None, the number of CPUs
+        is used.
+
+    memory_budget : int or None, optional (default=None)
+        Maximum estimated memory (in bytes) used by all running jobs (see
+        estimate_job_memory). A job that will not fit within the budget by
+        itself is still run, but only when no other jobs are running. If
+        None, memory is not limited (and isn't estimated).
+
+    max_retries : int, optional (default=2)
+        How many times to retry a failed job.
+
+    callback : function or None, optional (default=None)
+        Called with (job, record) each time a job changes state.
+
+    poll_interval : float, optional (default=0.5)
+        How often (in seconds) to check on running jobs.
+
+    Returns
+    -------
+    state_file : JobStateFile
+        Final state of every job.
+
+    Raises
+    ------
+    ValueError
+        If more than one job would be saved to the same output.
+    """
+    check_output_filenames([job.output_filename for job in jobs])
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    state_file = JobStateFile(state_filename)
+
+    def set_state(job, state, **kwargs):
+        state_file.set(job, state, **kwargs)
+        if callback is not None:
+            callback(job, state_file.get(job))
+
+    pending = []
+    for job in jobs:
+        # workers can't start pools of their own.
+        job.tracking_settings.n_processes = 1
+        if state_file.is_current(job):
+            continue
+        record = state_file.get(job)
+        if record is None or record['fingerprint'] != job.get_fingerprint():
+            # this job hasn't been run with its current settings, so any
+            # checkpoint was left by something else (eg. epm track), and may
+            # have been made with other settings.
+            remove_checkpoint(get_checkpoint_filename(job.output_filename))
+        if record is not None and \
+            record['fingerprint'] != job.get_fingerprint():
+            # settings have changed, so start over.
+            state_file.records.pop(job.output_filename)
+        set_state(job, PENDING, attempts=0, error=None)
+        pending.append(job)
+
+    if len(pending) == 0:
+        return state_file
+
+    # estimating memory opens every video, so only do so if it's limited.
+    job_memory = dict((job.output_filename, 0) for job in pending)
+    if memory_budget is not None:
+        for job in pending:
+            try:
+                job_memory[job.output_filename] = estimate_job_memory(
+                    job.video_filename)
+            except Exception:
+                # the video can't be read, so let the job fail (and record
+                # why) when it's run.
+                pass
+
+    pool = multiprocessing.Pool(processes=min(n_processes, len(pending)))
+    running = {}
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            # start as many pending jobs as we can.
+            used_memory = sum(job_memory[job.output_filename]
+                for job in running)
+            for job in list(pending):
+                if len(running) >= n_processes:
+                    break
+                required_memory = job_memory[job.output_filename]
+                if memory_budget is not None and len(running) > 0 and \
+                    used_memory + required_memory > memory_budget:
+                    continue
+                pending.remove(job)
+                running[job] = pool.apply_async(_run_job, (job,))
+                used_memory += required_memory
+                set_state(job, RUNNING,
+                    attempts=state_file.get(job)['attempts'] + 1)
+
+            time.sleep(poll_interval)
+
+            for job, async_result in running.items():
+                if not async_result.ready():
+                    continue
+                del running[job]
+                summary = async_result.get()
+                if summary['error'] is None:
+                    set_state(job, DONE, error=None, finished=time.time(),
+                        n_frames=summary['n_frames'],
+                        n_lost=summary['n_lost'],
+                        frames_per_second=summary['frames_per_second'])
+                elif state_file.get(job)['attempts'] <= max_retries:
+                    set_state(job, PENDING, error=summary['error'])
+                    pending.append(job)
+                else:
+                    set_state(job, FAILED, error=summary['error'])
+        pool.close()
+    except:
+        pool.terminate()
+        for job in running:
+            set_state(job, PENDING)
+        raise
+    finally:
+        pool.join()
+
+    return state_file
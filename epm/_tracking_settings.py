@@ -8,9 +8,41 @@ class TrackingSettings:
     threshold : int, optional (default=None)
         Threshold for detecting mouse after background subtraction.
 
+    threshold_mode : string, optional (default='frame')
+        How to calculate a threshold if threshold is None. If 'frame', an
+        otsu threshold is calculated for each frame. If 'video', a single
+        otsu threshold is calculated for the whole video (see
+        calc_otsu_threshold).
+
     background_n_frames : int, optional (default=200)
         How many frames to use to calculate background image.
 
+    background_mode : string, optional (default='mean')
+        How to combine frames into a background image. One of 'mean',
+        'median', or 'percentile' (see calc_background_image).
+
+    search_window_size : int, optional (default=None)
+        If given, each frame is only searched within a window of this size
+        (in pixels) around the mouse's predicted position, falling back to
+        a full-frame search if the mouse is lost (see LocalSearchDetector).
+
+    n_processes : int, optional (default=1)
+        How many processes to track the video with. If greater than 1, the
+        video is split into chunks that are tracked in parallel (see
+        track_video_parallel).
+
+    pyramid_factor : int, optional (default=None)
+        If given, the mouse is first found in frames downsampled by this
+        factor (typically 2 or 4), then refined at full resolution (see
+        PyramidDetector).
+
+    progressive_stride : int, optional (default=None)
+        If given, the video is tracked in a series of passes, starting with
+        every `progressive_stride`-th frame, and then filling in skipped
+        frames (see track_frames_progressive). The final results are the
+        same, but a rough trajectory is available much sooner. This cannot
+        be used with search_window_size or n_processes.
+
     inclusion_mask : np.array, optional (default=None)
         Which region of the image should be included in tracking.
 
@@ -22,9 +54,17 @@ class TrackingSettings:
     """
 
     def __init__(self, threshold=None, background_n_frames=200,
-        inclusion_mask=None, inclusion_mask_filename=None, save_filename=None):
+        inclusion_mask=None, inclusion_mask_filename=None, save_filename=None,
+        background_mode='mean', search_window_size=None, n_processes=1,
+        threshold_mode='frame', progressive_stride=None, pyramid_factor=None):
         self.threshold = threshold
+        self.threshold_mode = threshold_mode
         self.background_n_frames = background_n_frames
+        self.background_mode = background_mode
+        self.search_window_size = search_window_size
+        self.n_processes = n_processes
+        self.progressive_stride = progressive_stride
+        self.pyramid_factor = pyramid_factor
         self.inclusion_mask = inclusion_mask
         self.inclusion_mask_filename = inclusion_mask_filename
         self.save_filename = save_filename
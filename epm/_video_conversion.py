@@ -1,26 +1,117 @@
+# Conversion of videos (of any format ffmpeg can read) to FlyMovieFormat
+# goes here.
 
+import hashlib
+import json
+import multiprocessing
 import os
-import sys
-import shutil
 import subprocess
-import sys
-
-from PyQt4.QtCore import *
-from PyQt4.QtGui import *
+import tempfile
+import time
+import traceback
 
 import motmot.FlyMovieFormat.FlyMovieFormat as FMF
 import numpy as np
+import pandas as pd
+
+from _frame_geometry import (
+    FrameGeometry,
+    get_arena_bounds,
+    get_geometry_filename,
+    load_frame_geometry
+)
+from _frame_sources import (
+    get_decode_command,
+    open_video,
+    probe_video,
+    read_frame_block
+)
+from _frame_store import ChunkedFrameStoreSaver, FRAME_STORE_EXTENSION
+from _tracking_algorithms import calc_background_image
+from _tracking_checkpoint import get_checkpoint_filename
+
+# columns of the conversion summary (see convert_videos).
+CONVERSION_COLUMNS = ['video', 'output', 'n_frames', 'seconds', 'error']
+
+# where converted videos are cached by default (see ConversionCache).
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.epm', 'conversion-cache')
+
+def get_fmf_filename(video_filename):
+    """Gets the name of the .fmf file a video is converted to.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to video.
+
+    Returns
+    -------
+    fmf_filename : string
+        The video's filename, with its extension replaced by '.fmf'.
+    """
+    return os.path.splitext(video_filename)[0] + '.fmf'
 
+def get_frame_store_filename(video_filename):
+    """Gets the name of the chunked frame store a video is compressed to.
+
+    Parameters
+    ----------
+    video_filename : string
+        Path to video.
+
+    Returns
+    -------
+    store_filename : string
+        The video's filename, with its extension replaced by
+        FRAME_STORE_EXTENSION.
+    """
+    return os.path.splitext(video_filename)[0] + FRAME_STORE_EXTENSION
+
+def get_output_size(info, width=None, height=None):
+    """Gets the size of converted frames.
+
+    Parameters
+    ----------
+    info : dict
+        Output of probe_video() for the video being converted.
+
+    width, height : int or None, optional (default=None)
+        Requested size of each frame. If only one of these is given, the
+        other is chosen to keep the video's aspect ratio. If neither is
+        given, the video's own size is used.
+
+    Returns
+    -------
+    width, height : int
+    """
+    if width is None and height is None:
+        return info['width'], info['height']
+    if width is None:
+        width = int(round(height * info['width'] / float(info['height'])))
+    if height is None:
+        height = int(round(width * info['height'] / float(info['width'])))
+    return width, height
 
 def fmf_ucmp(
     video_in,
     video_out,
-    timestamps_in='None',
+    timestamps_in=None,
     fps=None,
     width=320,
-    height=240):
+    height=240,
+    arena=None,
+    chunk_size=256):
     """Converts any file format to FlyMovieFormat.
 
+    Frames are decoded (and cropped and scaled) by ffmpeg, read from its
+    pipe in chunks of `chunk_size` frames into a preallocated buffer, and
+    each chunk is written to the .fmf file with a single write.
+
+    If frames are cropped or scaled, the crop offset and scale factor are
+    saved to a sidecar file (see FrameGeometry), so that tracking results
+    can be mapped back to the source video's coordinates.
+
     Parameters
     ----------
     video_in : string
@@ -30,49 +121,522 @@ def fmf_ucmp(
         Path to save uncompressed, .fmf video.
 
     timestamps_in : string or None (default = None)
-        Path to .gz file containing timestamps for video.
+        Path to file (eg. .gz) containing timestamps for video, as read by
+        np.loadtxt. If None (or the file doesn't exist), each frame's
+        timestamp is its index divided by the frame rate.
+
+    fps : float or None (default = None)
+        Frame rate to save uncompressed video. If given, frames are
+        duplicated or dropped to give this rate. If None, every frame is
+        kept, at the video's own frame rate.
+
+    width : int or None (optional, default=320)
+        Width of video, in pixels. See get_output_size.
+
+    height : int or None (optional, default=240)
+        Height of video, in pixels. See get_output_size.
 
-    fps : int or None (default = None)
-        Frame rate to save uncompressed video.
+    arena : string, tuple, np.array, or None (optional, default=None)
+        If given, frames are cropped to the bounding box of this arena (see
+        get_arena_bounds) before being scaled to width x height. The
+        output's aspect ratio is that of the bounding box if only one of
+        width or height is given.
 
-    width : int (optional, default=640)
-        Width of video, in pixels.
+    chunk_size : int (optional, default=256)
+        How many frames to read from ffmpeg (and write to disk) at a time.
 
-    height : int (optional, default=480)
-        Height of video, in pixels.
+    Returns
+    -------
+    n_frames : int
+        Number of frames written. A partial frame at the end of the
+        stream (eg. from a truncated file) is dropped.
+
+    Raises
+    ------
+    IOError
+        If ffmpeg fails to decode the video. The partially-written .fmf is
+        removed.
+
+    ValueError
+        If timestamps_in holds fewer timestamps than there are frames.
     """
-    ts_file_given = os.path.isfile(timestamps_in)
-    if ts_file_given:
-        timestamps = np.loadtxt(timestamps_in)
-
-    command = [
-        'ffmpeg',
-        '-i', video_in,
-        '-f', 'image2pipe',
-        '-pix_fmt', 'gray8',
-        '-vf', 'scale=320:240',
-        '-an',
-        '-vcodec', 'rawvideo',
-        '-'
-    ]
-
-    pipe = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=10**8)
-
-    vid = FMF.FlyMovieSaver(video_out)
+    info = probe_video(video_in)
+    source_shape = (info['height'], info['width'])
+    crop = None
+    if arena is not None:
+        crop = get_arena_bounds(arena, source_shape)
+        if crop == (0, 0) + source_shape:
+            crop = None
+    crop_height, crop_width = source_shape if crop is None else crop[2:]
+
+    width, height = get_output_size(
+        dict(info, width=crop_width, height=crop_height), width, height)
+    if (width, height) == (crop_width, crop_height):
+        command = get_decode_command(video_in, fps=fps, crop=crop)
+    else:
+        command = get_decode_command(video_in, width, height, fps=fps,
+            crop=crop)
+    geometry = FrameGeometry(
+        (0, 0) if crop is None else crop[:2],
+        (crop_height / float(height), crop_width / float(width)),
+        source_shape)
+
+    timestamps = None
+    if timestamps_in is not None and os.path.isfile(timestamps_in):
+        timestamps = np.atleast_1d(np.loadtxt(timestamps_in))
+    frame_rate = info['fps'] if fps is None else fps
+
+    frames = np.empty((chunk_size, height, width), dtype=np.uint8)
+    chunks = np.empty(chunk_size, dtype=[
+        ('timestamp', '<f8'),
+        ('frame', np.uint8, (height, width))
+        ])
+
+    # errors are written to a file rather than a pipe, so that a chatty
+    # decoder can't fill the pipe and block.
+    stderr = tempfile.TemporaryFile()
+    try:
+        pipe = subprocess.Popen(command, stdout=subprocess.PIPE,
+            stderr=stderr, bufsize=-1)
+    except OSError:
+        stderr.close()
+        raise IOError('ffmpeg must be installed to convert {}.'.format(
+            video_in))
+
+    saver = FMF.FlyMovieSaver(video_out, version=3, format='MONO8')
+    n_frames = 0
+    is_complete = False
     try:
-        count = 0
         while True:
-            raw_img = pipe.stdout.read(width*height)
-            img = np.fromstring(raw_img, dtype=np.uint8)
-            img = img.reshape((height, width))
-            if ts_file_given:
-                vid.add_frame(img, timestamps[count])
-            else:
-                vid.add_frame(img)
-            count += 1
-    except:
+            n_bytes = pipe.stdout.readinto(frames)
+            n_read = n_bytes // (width * height)
+            if n_read > 0:
+                block = chunks[:n_read]
+                block['frame'] = frames[:n_read]
+                if timestamps is not None:
+                    if timestamps.size < n_frames + n_read:
+                        raise ValueError('{} has fewer timestamps than {} '
+                            'has frames.'.format(timestamps_in, video_in))
+                    block['timestamp'] = timestamps[
+                        n_frames:n_frames + n_read]
+                elif frame_rate is not None:
+                    block['timestamp'] = np.arange(
+                        n_frames, n_frames + n_read) / float(frame_rate)
+                else:
+                    block['timestamp'] = np.arange(n_frames, n_frames + n_read)
+
+                if saver.n_frames == 0:
+                    # let the saver write the header along with the
+                    # first frame.
+                    saver.add_frame(block['frame'][0], block['timestamp'][0])
+                    block = block[1:]
+                block.tofile(saver.file)
+                saver.n_frames += block.shape[0]
+                n_frames += n_read
+
+            # a short read means that the stream has ended.
+            if n_bytes < frames.nbytes:
+                break
+        is_complete = True
+    finally:
         pipe.stdout.close()
-        pipe.wait()
-        del pipe
+        if not is_complete and pipe.poll() is None:
+            pipe.kill()
+        returncode = pipe.wait()
+        saver.close()
+
+        if is_complete and returncode != 0:
+            is_complete = False
+            stderr.seek(0)
+            message = stderr.read().strip()
+        stderr.close()
+        if not is_complete and os.path.isfile(video_out):
+            os.remove(video_out)
+
+    if returncode != 0:
+        raise IOError('ffmpeg could not convert {}: {}'.format(
+            video_in, message))
+
+    geometry_filename = get_geometry_filename(video_out)
+    if not geometry.is_identity():
+        geometry.save(video_out)
+    elif os.path.isfile(geometry_filename):
+        # left by an earlier conversion to the same file.
+        os.remove(geometry_filename)
+    return n_frames
+
+def compress_video(video_in, video_out, chunk_size=16, level=1, delta=True,
+    background_n_frames=200, block_size=256):
+    """Compresses a video into a chunked frame store (see ChunkedFrameStore).
+
+    Parameters
+    ----------
+    video_in : string
+        Path to video (see open_video). If this video was cropped or scaled
+        when it was converted, its geometry sidecar is copied along with it.
+
+    video_out : string
+        Where to save the store.
+
+    chunk_size : int (optional, default=16)
+        How many frames to compress together.
+
+    level : int (optional, default=1)
+        zlib compression level.
+
+    delta : bool (optional, default=True)
+        Whether to store each frame as its difference from the video's
+        median background (see calc_background_image).
+
+    background_n_frames : int (optional, default=200)
+        How many frames to calculate the background from, if delta is True.
+
+    block_size : int (optional, default=256)
+        How many frames to read from video_in at a time.
+
+    Returns
+    -------
+    n_frames : int
+        Number of frames written.
+    """
+    video = open_video(video_in)
+    try:
+        n_frames = video.get_n_frames()
+        background = None
+        if delta:
+            background = calc_background_image(video,
+                n_frames=background_n_frames, mode='median')
+
+        saver = ChunkedFrameStoreSaver(video_out, video.get_height(),
+            video.get_width(), chunk_size=chunk_size, level=level,
+            background=background)
+        try:
+            for start in xrange(0, n_frames, block_size):
+                stop = min(start + block_size, n_frames)
+                saver.add_frames(*read_frame_block(video, start, stop))
+        except:
+            saver.close()
+            os.remove(video_out)
+            raise
+        saver.close()
+        # videos decoded by ffmpeg may end before the frames counted when
+        # they were opened (see FFmpegVideo).
+        n_frames = saver.n_frames
+    finally:
+        video.close()
+
+    geometry = load_frame_geometry(video_in)
+    geometry_filename = get_geometry_filename(video_out)
+    if geometry is not None:
+        geometry.save(video_out)
+    elif os.path.isfile(geometry_filename):
+        # left by an earlier conversion to the same file.
+        os.remove(geometry_filename)
+    return n_frames
+
+def _convert_video_job(job):
+    """Target of each worker process in convert_videos()."""
+    job_ix, (video_in, video_out, kwargs) = job
+    summary = dict((column, None) for column in CONVERSION_COLUMNS)
+    summary['video'] = video_in
+    start_time = time.time()
+    try:
+        n_frames = fmf_ucmp(video_in, video_out, **kwargs)
+    except Exception:
+        summary['error'] = traceback.format_exc()
+        return job_ix, summary
+
+    summary.update({
+        'output': video_out,
+        'n_frames': n_frames,
+        'seconds': time.time() - start_time
+    })
+    return job_ix, summary
+
+def convert_videos(video_filenames, output_filenames=None, n_processes=None,
+    callback=None, **kwargs):
+    """Converts many videos to FlyMovieFormat, spreading them across a pool
+    of processes.
+
+    Parameters
+    ----------
+    video_filenames : list of string
+        Paths to videos to convert.
+
+    output_filenames : list of string or None, optional (default=None)
+        Where to save each converted video. If None, videos are saved
+        alongside the originals (see get_fmf_filename).
+
+    n_processes : int or None, optional (default=None)
+        How many videos to convert at once. If None, the number of CPUs
+        is used.
+
+    callback : function or None, optional (default=None)
+        Called with the summary of each video, as it is completed.
+
+    **kwargs
+        Passed on to fmf_ucmp().
+
+    Returns
+    -------
+    summary : pd.DataFrame
+        Contains the columns in CONVERSION_COLUMNS, with one row for each
+        video (in the order given). If a conversion failed, 'error' holds
+        its traceback.
+    """
+    if output_filenames is None:
+        output_filenames = [get_fmf_filename(video_filename)
+            for video_filename in video_filenames]
+    if len(output_filenames) != len(video_filenames):
+        raise ValueError('Got {} output filenames for {} videos.'.format(
+            len(output_filenames), len(video_filenames)))
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    n_processes = max(1, min(n_processes, len(video_filenames)))
+
+    jobs = list(enumerate(zip(video_filenames, output_filenames,
+        [kwargs] * len(video_filenames))))
+
+    summaries = [None] * len(jobs)
+    def store_summary(job_ix, summary):
+        summaries[job_ix] = summary
+        if callback is not None:
+            callback(summary)
+
+    if n_processes == 1:
+        for job in jobs:
+            store_summary(*_convert_video_job(job))
+    else:
+        pool = multiprocessing.Pool(processes=n_processes)
+        try:
+            for job_ix, summary in pool.imap_unordered(
+                _convert_video_job, jobs):
+                store_summary(job_ix, summary)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    return pd.DataFrame(summaries, columns=CONVERSION_COLUMNS)
+
+def _get_conversion_files(fmf_filename):
+    """Gets the files kept alongside a converted video: its sidecar, and
+    the checkpoint (and its metadata) left by tracking it (see
+    get_checkpoint_filename). These may not exist."""
+    checkpoint_filename = get_checkpoint_filename(fmf_filename)
+    return [get_geometry_filename(fmf_filename), checkpoint_filename,
+        checkpoint_filename + '.json']
+
+def _remove_conversion(fmf_filename):
+    """Removes a converted video, along with its sidecar and any tracking
+    checkpoint."""
+    os.remove(fmf_filename)
+    for filename in _get_conversion_files(fmf_filename):
+        if os.path.isfile(filename):
+            os.remove(filename)
+
+
+class ConversionCache:
+    """Size-bounded cache of videos converted to FlyMovieFormat, so that
+    reopening a video doesn't convert it again.
+
+    Each conversion is stored under a key derived from the source video's
+    absolute path, size, and modification time, along with the conversion
+    parameters (see get_key), so editing or replacing a video invalidates
+    its cached conversion. When the cache grows beyond max_bytes, the least
+    recently used conversions are evicted. Use is tracked by touching each
+    cached file's modification time, so several processes can share a
+    cache directory.
+
+    Parameters
+    ----------
+    cache_dir : string, optional (default=DEFAULT_CACHE_DIR)
+        Directory to keep converted videos in. This is created if it
+        doesn't exist.
+
+    max_bytes : int, optional (default=20 GB)
+        Maximum total size of converted videos to keep (including their
+        sidecars, and checkpoints left by tracking them).
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=20 * 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_key(self, video_in, **kwargs):
+        """Gets the cache key of a conversion.
+
+        Parameters
+        ----------
+        video_in : string
+            Path to video.
+
+        **kwargs
+            Parameters passed to fmf_ucmp(). For parameters which name a
+            file (eg. timestamps_in, or arena), the size and modification
+            time of that file are also included.
+
+        Returns
+        -------
+        key : string
+            SHA-1 hex digest.
+        """
+        def describe_file(filename):
+            stat = os.stat(filename)
+            return [os.path.abspath(filename), stat.st_size, stat.st_mtime]
+
+        params = dict(kwargs)
+        for name, value in params.items():
+            if isinstance(value, basestring) and os.path.isfile(value):
+                params[name] = describe_file(value)
+            elif isinstance(value, np.ndarray):
+                params[name] = hashlib.sha1(
+                    np.ascontiguousarray(value)).hexdigest()
+        description = json.dumps({
+            'video': describe_file(video_in),
+            'params': params
+        }, sort_keys=True)
+        return hashlib.sha1(description).hexdigest()
+
+    def get_filename(self, key):
+        """Gets the path of the cached conversion with the given key."""
+        return os.path.join(self.cache_dir, key + '.fmf')
+
+    def get(self, video_in, **kwargs):
+        """Gets a cached conversion, if it exists.
+
+        Parameters
+        ----------
+        video_in : string
+            Path to video.
+
+        **kwargs
+            Parameters passed to fmf_ucmp().
+
+        Returns
+        -------
+        fmf_filename : string or None
+            Path to the cached .fmf, or None if the video hasn't been
+            converted with these parameters.
+        """
+        fmf_filename = self.get_filename(self.get_key(video_in, **kwargs))
+        if not os.path.isfile(fmf_filename):
+            return None
+        # mark as recently used.
+        os.utime(fmf_filename, None)
+        return fmf_filename
+
+    def get_or_convert(self, video_in, **kwargs):
+        """Gets a cached conversion, converting the video if needed.
+
+        Parameters
+        ----------
+        video_in : string
+            Path to video.
+
+        **kwargs
+            Parameters passed to fmf_ucmp().
+
+        Returns
+        -------
+        fmf_filename : string
+            Path to the cached .fmf.
+        """
+        fmf_filename = self.get(video_in, **kwargs)
+        if fmf_filename is not None:
+            return fmf_filename
+
+        fmf_filename = self.get_filename(self.get_key(video_in, **kwargs))
+        # convert to a temporary file, so that an interrupted conversion is
+        # never mistaken for a complete one.
+        temp_filename = '{}.{}.tmp'.format(fmf_filename, os.getpid())
+        temp_geometry_filename = get_geometry_filename(temp_filename)
+        try:
+            fmf_ucmp(video_in, temp_filename, **kwargs)
+            if os.path.isfile(fmf_filename):
+                # converted by another process in the meantime.
+                _remove_conversion(fmf_filename)
+            # the sidecar goes first, so that it's in place by the time
+            # the video can be found.
+            if os.path.isfile(temp_geometry_filename):
+                os.rename(temp_geometry_filename,
+                    get_geometry_filename(fmf_filename))
+            os.rename(temp_filename, fmf_filename)
+        finally:
+            for filename in [temp_filename, temp_geometry_filename]:
+                if os.path.isfile(filename):
+                    os.remove(filename)
+
+        self.evict(keep=[fmf_filename])
+        return fmf_filename
+
+    def get_entries(self):
+        """Gets the cached conversions.
+
+        Returns
+        -------
+        entries : list of tuple
+            (last used time, size in bytes, path) of each cached .fmf,
+            from least to most recently used. Sizes include the files kept
+            alongside each .fmf (eg. checkpoints left by tracking it).
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.fmf'):
+                continue
+            filename = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                # evicted by another process.
+                continue
+            size = stat.st_size
+            for other_filename in _get_conversion_files(filename):
+                try:
+                    size += os.path.getsize(other_filename)
+                except OSError:
+                    continue
+            entries.append((stat.st_mtime, size, filename))
+        return sorted(entries)
+
+    def evict(self, keep=()):
+        """Removes the least recently used conversions until the cache fits
+        within max_bytes.
+
+        Parameters
+        ----------
+        keep : list of string, optional (default=())
+            Paths of conversions that must not be removed.
+
+        Returns
+        -------
+        removed : list of string
+            Paths of removed conversions.
+        """
+        entries = self.get_entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, filename in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if filename in keep:
+                continue
+            try:
+                _remove_conversion(filename)
+            except OSError:
+                # still open (on windows), or already removed.
+                continue
+            total_bytes -= size
+            removed.append(filename)
+        return removed
 
-    vid.close()
+    def clear(self):
+        """Removes every cached conversion."""
+        for _, _, filename in self.get_entries():
+            try:
+                _remove_conversion(filename)
+            except OSError:
+                continue
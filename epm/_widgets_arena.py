@@ -7,14 +7,15 @@ from time import gmtime, strftime
 
 import numpy as np
 import pandas as pd
-from skimage.draw import polygon
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
 from _tracking_algorithms import (
-    convert_img_to_uint8
+    convert_img_to_uint8,
+    get_polygon_mask
 )
+from _frame_geometry import load_frame_geometry
 from _utils import get_q_image
 
 
@@ -216,7 +217,9 @@ class MaskWidget(QWidget):
         through the GUI. (2) The second file (named the same as the first
         with the addition of '-pixel-coords'), contains the 'true' positions
         of the mask points in pixel coordinates. This is for use in analyzing
-        the positions of the tracking data (in analysis.py).
+        the positions of the tracking data (in analysis.py). If the video
+        was cropped or scaled when it was converted, these are in the
+        coordinates of the source video, as are saved tracking results.
         """
         file_dialog = QFileDialog(self)
         mask_savefile = str(file_dialog.getSaveFileName(
@@ -241,6 +244,11 @@ class MaskWidget(QWidget):
         # also save a file containing the global positions of the
         # arena mask coordinates -- for analysis of tracking data.
         central_point, global_point_pos = self._get_global_point_locations()
+        video_filename = getattr(self.video, 'filename', None)
+        if video_filename is not None:
+            geometry = load_frame_geometry(video_filename)
+            if geometry is not None:
+                global_point_pos = geometry.to_source(global_point_pos)
         df = pd.DataFrame()
         df['rr'] = global_point_pos[:, 0]
         df['cc'] = global_point_pos[:, 1]
@@ -252,22 +260,7 @@ class MaskWidget(QWidget):
         # get the center of mass of all mask points, and all of the individual
         # mask point locations in pixel coordinates.
         central_point, global_point_pos = self._get_global_point_locations()
-
-        # get coordinates such that they are all relative to the central point
-        relative_point_pos = global_point_pos - central_point
-        # sort the mask_points based on angle made with center of image.
-        angles = np.arctan2(relative_point_pos[:, 0], relative_point_pos[:, 1])
-        sorted_polygon_points = relative_point_pos[np.argsort(angles)]
-
-        # place coordinates back into global positions for mask drawing.
-        sorted_polygon_points += central_point
-        # add first point onto end of points list to form closed polygon
-        sorted_polygon_points = np.vstack((sorted_polygon_points,
-            sorted_polygon_points[-1, :]))
-        mask = np.zeros_like(self.arena_image)
-        rr, cc = polygon(sorted_polygon_points[:, 0],
-            sorted_polygon_points[:, 1], shape=self.arena_image.shape)
-        mask[rr, cc] = 1
+        mask = get_polygon_mask(global_point_pos, self.arena_image.shape)
         # set this mask as the inclusion mask in our tracking_settings dict.
         self.tracking_settings.inclusion_mask = mask
 
@@ -56,7 +56,8 @@ class ThresholdWidget(QWidget):
 
         self.raw_image, _ = self.video.get_frame(0)
         self.background_image = calc_background_image(
-            self.video, self.tracking_settings.background_n_frames)
+            self.video, self.tracking_settings.background_n_frames,
+            mode=self.tracking_settings.background_mode)
         self.thresholded_image = convert_img_to_uint8(
             threshold_image(self.raw_image,
                 self.background_image, self.tracking_settings.threshold)
@@ -90,10 +91,13 @@ class ThresholdWidget(QWidget):
         background_n_frames_label = QLabel(
             'N of frames to calculate background: ')
         save_filename_label = QLabel('Save filename (.xlsx): ')
+        progressive_stride_label = QLabel(
+            'Preview every Nth frame first (0 = off): ')
 
         layout.addWidget(threshold_name_label, 0, 0, 1, 1)
         layout.addWidget(background_n_frames_label, 1, 0, 1, 1)
         layout.addWidget(save_filename_label, 2, 0, 1, 1)
+        layout.addWidget(progressive_stride_label, 3, 0, 1, 1)
 
         self.threshold_spin_box = QSpinBox()
         self.threshold_spin_box.setMinimum(0)
@@ -115,6 +119,19 @@ class ThresholdWidget(QWidget):
         self.background_frames_spinbox.valueChanged.connect(
             self.update_background_image)
 
+        # tracking a sparse pass first gives a rough trajectory (shown in
+        # the main window) long before tracking finishes.
+        self.progressive_stride_spinbox = QSpinBox()
+        self.progressive_stride_spinbox.setMinimum(0)
+        self.progressive_stride_spinbox.setMaximum(
+            self.video.get_n_frames()
+        )
+        self.progressive_stride_spinbox.setValue(
+            self.tracking_settings.progressive_stride or 0
+        )
+        self.progressive_stride_spinbox.valueChanged.connect(
+            self.update_progressive_stride)
+
         self.save_filename_lineedit = QLineEdit()
         self.save_filename_lineedit.setText('Save name (.xlsx)')
         self.save_filename_lineedit.setReadOnly(True)
@@ -125,6 +142,7 @@ class ThresholdWidget(QWidget):
         layout.addWidget(self.background_frames_spinbox, 1, 1, 1, 1)
         layout.addWidget(self.save_filename_lineedit, 2, 1, 1, 2)
         layout.addWidget(self.save_filename_browse_button, 2, 3, 1, 1)
+        layout.addWidget(self.progressive_stride_spinbox, 3, 1, 1, 1)
 
         self.input_groupbox.setLayout(layout)
 
@@ -192,11 +210,19 @@ class ThresholdWidget(QWidget):
     def update_background_image(self, n_frames):
         self.tracking_settings.background_n_frames = n_frames
         self.background_image = calc_background_image(
-            self.video, self.tracking_settings.background_n_frames)
+            self.video, self.tracking_settings.background_n_frames,
+            mode=self.tracking_settings.background_mode)
         background_image_pixmap = QPixmap.fromImage(
             get_q_image(self.background_image))
         self.background_image_label.setPixmap(background_image_pixmap)
 
+    @pyqtSlot(int)
+    def update_progressive_stride(self, stride):
+        if stride > 1:
+            self.tracking_settings.progressive_stride = stride
+        else:
+            self.tracking_settings.progressive_stride = None
+
     @pyqtSlot(int)
     def update_threshold_image(self, threshold):
         self.tracking_settings.threshold = threshold / 100.
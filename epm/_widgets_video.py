@@ -17,6 +17,7 @@ from skimage.util import (
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+from _frame_sources import open_video
 from _utils import get_q_image
 
 class VideoWidget(QWidget):
@@ -27,7 +28,7 @@ class VideoWidget(QWidget):
 
     Attributes
     ----------
-    video : motmot.FlyMovieFormat.FlyMovie
+    video : MemmapFlyMovie or motmot.FlyMovieFormat.FlyMovie
         Video to display in widget.
 
     is_playing : bool (default = False)
@@ -102,7 +103,7 @@ class VideoWidget(QWidget):
 
     def set_video(self, video_filename):
         self.video_filename = video_filename
-        self.video = FMF.FlyMovie(video_filename)
+        self.video = open_video(video_filename)
         self.update_frame_label(0)
 
     def previous_frame(self):
@@ -144,13 +145,16 @@ class VideoWidget(QWidget):
 
         # annotate the image if we have tracking_data available.
         if self.tracking_data is not None:
-            img = img_as_float(img)
-            img = gray2rgb(img)
             centroid_rr = self.tracking_data['rr'][self.current_frame_ix]
             centroid_cc = self.tracking_data['cc'][self.current_frame_ix]
-            rr, cc = circle(centroid_rr, centroid_cc, 3)
-            img[rr, cc, :] = [1., 0, 0]
-            img = img_as_ubyte(img)
+            # the mouse may not have been found in this frame.
+            if not (np.isnan(centroid_rr) or np.isnan(centroid_cc)):
+                img = img_as_float(img)
+                img = gray2rgb(img)
+                rr, cc = circle(centroid_rr, centroid_cc, 3,
+                    shape=img.shape[:2])
+                img[rr, cc, :] = [1., 0, 0]
+                img = img_as_ubyte(img)
 
         pixmap = QPixmap.fromImage(get_q_image(img))
         self.frame_label.setPixmap(pixmap)
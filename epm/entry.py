@@ -1,10 +1,241 @@
 # entry points for command line calls via click.
 
 import os
+import time
+
 import click
+import numpy as np
 
-import main
 
 @click.command()
 def launch_gui():
+    import main
+    main.main()
+
+@click.group()
+def cli():
+    """Track and analyze Elevated Plus Maze (EPM) videos."""
+
+@cli.command()
+def gui():
+    """Launch the tracking GUI."""
+    import main
     main.main()
+
+@cli.command()
+@click.argument('videos', nargs=-1, required=True,
+    type=click.Path(exists=True, dir_okay=False))
+@click.option('--mask', type=click.Path(exists=True, dir_okay=False),
+    help='Inclusion mask: a -pixel-coords.xlsx file saved from the GUI, '
+    'or a .npy array.')
+@click.option('--settings', type=click.Path(exists=True, dir_okay=False),
+    help='JSON file of tracking settings.')
+@click.option('--output-dir', type=click.Path(file_okay=False),
+    help='Where to save results (defaults to alongside each video).')
+@click.option('--processes', '-j', type=int, default=None,
+    help='How many videos to track at once (defaults to the number of CPUs).')
+@click.option('--summary', type=click.Path(dir_okay=False), default=None,
+    help='Where to save the run summary (.csv; defaults to '
+    'tracking-summary.csv in the output directory).')
+@click.option('--restart', is_flag=True,
+    help='Discard checkpoints left by previous runs, rather than resuming.')
+@click.option('--profile', is_flag=True,
+    help='Save a report of the time spent in each stage of tracking '
+    '(-profile.json) alongside the results of each video.')
+def track(videos, mask, settings, output_dir, processes, summary, restart,
+    profile):
+    """Track one or more VIDEOS without the GUI.
+
+    Videos that aren't .fmf files are decoded by ffmpeg as they are
+    tracked, without being converted to .fmf first.
+    """
+    from _tracking_batch import (
+        get_output_filename,
+        load_tracking_settings,
+        track_videos
+    )
+    from _tracking_checkpoint import get_checkpoint_filename, remove_checkpoint
+
+    try:
+        tracking_settings = load_tracking_settings(settings)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--settings')
+    tracking_settings.inclusion_mask_filename = mask
+
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if summary is None:
+        summary = os.path.join(output_dir or os.getcwd(),
+            'tracking-summary.csv')
+
+    if restart:
+        for video in videos:
+            remove_checkpoint(get_checkpoint_filename(
+                get_output_filename(video, output_dir)))
+
+    def report(video_summary):
+        if video_summary['error'] is not None:
+            click.echo('FAILED {}:\n{}'.format(
+                video_summary['video'], video_summary['error']), err=True)
+        elif video_summary['frames_per_second'] is None:
+            click.echo('{video}: {n_frames} frames, {n_lost} lost '
+                '(resumed from checkpoint)'.format(**video_summary))
+        else:
+            click.echo('{video}: {n_frames} frames, {n_lost} lost, '
+                '{frames_per_second:.1f} frames/sec'.format(**video_summary))
+
+    start_time = time.time()
+    try:
+        run_summary = track_videos(list(videos), tracking_settings,
+            output_dir=output_dir, n_processes=processes, callback=report,
+            profile=profile)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    run_summary.to_csv(summary, index=False)
+
+    is_failed = run_summary['error'].notnull()
+    n_frames = run_summary['n_frames'][~is_failed].sum()
+    # frames restored from checkpoints weren't tracked by this run.
+    n_tracked = n_frames - run_summary['n_resumed'][~is_failed].sum()
+    seconds = time.time() - start_time
+    click.echo('Tracked {} of {} videos ({} frames, {} lost) in {:.1f} s '
+        '({:.1f} frames/sec). Summary saved to {}.'.format(
+            np.sum(~is_failed), len(videos), int(n_frames),
+            int(run_summary['n_lost'][~is_failed].sum()), seconds,
+            n_tracked / seconds, summary))
+    if np.any(is_failed):
+        raise click.ClickException(
+            '{} videos failed to track.'.format(np.sum(is_failed)))
+
+@cli.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--settings', type=click.Path(exists=True, dir_okay=False),
+    help='JSON file of default tracking settings.')
+@click.option('--state', type=click.Path(dir_okay=False), default=None,
+    help='Where to keep the state of each job (defaults to the manifest '
+    'name, plus .state.json).')
+@click.option('--processes', '-j', type=int, default=None,
+    help='How many jobs to run at once (defaults to the number of CPUs).')
+@click.option('--memory-budget', type=float, default=None,
+    help='Maximum estimated memory (in MB) used by running jobs.')
+@click.option('--retries', type=int, default=2, show_default=True,
+    help='How many times to retry a failed job.')
+def schedule(manifest, settings, state, processes, memory_budget, retries):
+    """Run the tracking jobs listed in a MANIFEST (.csv), skipping those
+    whose outputs are up-to-date.
+
+    The manifest needs a video column, and may have mask, output, and
+    threshold (or any other tracking setting) columns.
+    """
+    from _tracking_batch import load_tracking_settings
+    from _tracking_scheduler import FAILED, read_manifest, run_jobs
+
+    try:
+        jobs = read_manifest(manifest, load_tracking_settings(settings))
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    if state is None:
+        state = manifest + '.state.json'
+    if memory_budget is not None:
+        memory_budget = int(memory_budget * 2**20)
+
+    def report(job, record):
+        click.echo('[{}] {} (attempt {})'.format(
+            record['state'], job.video_filename, record['attempts']))
+        if record['state'] == FAILED:
+            click.echo(record['error'], err=True)
+
+    state_file = run_jobs(jobs, state, n_processes=processes,
+        memory_budget=memory_budget, max_retries=retries, callback=report)
+
+    states = [state_file.get(job)['state'] for job in jobs]
+    click.echo('{} jobs: {}. State saved to {}.'.format(len(jobs), ', '.join(
+        '{} {}'.format(states.count(s), s) for s in sorted(set(states))),
+        state))
+    if FAILED in states:
+        raise click.ClickException(
+            '{} jobs failed.'.format(states.count(FAILED)))
+
+@cli.command()
+@click.argument('videos', nargs=-1, required=True,
+    type=click.Path(exists=True, dir_okay=False))
+@click.option('--arena', type=click.Path(exists=True, dir_okay=False),
+    help='Crop frames to the bounding box of this arena: a '
+    '-pixel-coords.xlsx file saved from the GUI, or a .npy mask.')
+@click.option('--width', type=int, default=None,
+    help='Width of converted frames, in pixels.')
+@click.option('--height', type=int, default=None,
+    help='Height of converted frames, in pixels.')
+@click.option('--fps', type=float, default=None,
+    help='Frame rate of converted videos (defaults to that of each video).')
+@click.option('--output-dir', type=click.Path(file_okay=False),
+    help='Where to save converted videos (defaults to alongside each '
+    'video).')
+@click.option('--processes', '-j', type=int, default=None,
+    help='How many videos to convert at once (defaults to the number of '
+    'CPUs).')
+def convert(videos, arena, width, height, fps, output_dir, processes):
+    """Convert VIDEOS to .fmf files.
+
+    If only one of --width or --height is given, the other keeps the
+    aspect ratio of the (cropped) frames. If neither is given, frames are
+    not scaled. Tracking results are mapped back to the coordinates of
+    the original video.
+    """
+    from _tracking_batch import check_output_filenames
+    from _video_conversion import convert_videos, get_fmf_filename
+
+    output_filenames = [get_fmf_filename(video) for video in videos]
+    if output_dir is not None:
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        output_filenames = [os.path.join(output_dir,
+            os.path.basename(output_filename))
+            for output_filename in output_filenames]
+    try:
+        check_output_filenames(output_filenames)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    def report(video_summary):
+        if video_summary['error'] is not None:
+            click.echo('FAILED {}:\n{}'.format(
+                video_summary['video'], video_summary['error']), err=True)
+        else:
+            click.echo('{output}: {n_frames} frames in {seconds:.1f} '
+                's.'.format(**video_summary))
+
+    run_summary = convert_videos(list(videos), output_filenames,
+        n_processes=processes, callback=report, width=width, height=height,
+        fps=fps, arena=arena)
+    n_failed = run_summary['error'].notnull().sum()
+    if n_failed > 0:
+        raise click.ClickException(
+            '{} videos failed to convert.'.format(n_failed))
+
+@cli.command()
+@click.argument('videos', nargs=-1, required=True,
+    type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', type=int, default=16, show_default=True,
+    help='How many frames to compress together.')
+@click.option('--level', type=click.IntRange(1, 9), default=1,
+    show_default=True, help='zlib compression level.')
+@click.option('--no-delta', is_flag=True,
+    help="Don't store frames as differences from the background.")
+def compress(videos, chunk_size, level, no_delta):
+    """Compress VIDEOS into chunked frame stores (.cfs), saved alongside
+    each video.
+
+    Frame stores are read and tracked like .fmf videos, but take up a
+    fraction of the space.
+    """
+    from _video_conversion import compress_video, get_frame_store_filename
+
+    for video in videos:
+        store = get_frame_store_filename(video)
+        start_time = time.time()
+        n_frames = compress_video(video, store, chunk_size=chunk_size,
+            level=level, delta=not no_delta)
+        click.echo('{}: {} frames in {:.1f} s, {:.1f}% of {}.'.format(
+            store, n_frames, time.time() - start_time,
+            100. * os.path.getsize(store) / os.path.getsize(video), video))
@@ -11,7 +11,8 @@ import qdarkstyle
 
 from widgets import VideoWidget
 from dialogs import TrackingDialog
-from _video_conversion import fmf_ucmp
+from _frame_geometry import load_frame_geometry
+from _video_conversion import ConversionCache
 
 DIR = os.path.dirname(__file__)
 DEBUG = False
@@ -20,6 +21,7 @@ class MainWindow(QMainWindow):
     def __init__(self, parent = None):
         super(MainWindow, self).__init__(parent)
         self.root_folder = os.path.expanduser("~")
+        self.conversion_cache = ConversionCache()
 
         self.video_widget = VideoWidget()
         self.setCentralWidget(self.video_widget)
@@ -192,24 +194,23 @@ class MainWindow(QMainWindow):
             file_dialog = QFileDialog(self)
             video_filename = str(file_dialog.getOpenFileName(
                 caption='Open Video File',
-                filter='Video Files (*.fmf *.wmv *.avi *.mp4 *.mov)',
+                filter='Video Files (*.fmf *.cfs *.wmv *.avi *.mp4 *.mov)',
                 directory=self.root_folder
                 ))
 
         if not os.path.isfile(video_filename):
             return
 
-        if video_filename.split('.')[-1] != 'fmf':
-            savefile = video_filename.split('.')[0] + '.fmf'
-            fmf_ucmp(
-                str(video_filename), str(savefile),
-                width=320, height=240)
-            video_filename = str(savefile)
+        source_filename = video_filename
+        if video_filename.split('.')[-1] not in ['fmf', 'cfs']:
+            # reuse an earlier conversion of this video, if there is one.
+            video_filename = self.conversion_cache.get_or_convert(
+                str(video_filename), width=320, height=240)
 
         self.video_widget.set_video(video_filename)
         self.video_info_label.setText(
             'Current Video: {}'.format(
-                os.path.basename(video_filename)
+                os.path.basename(source_filename)
             ))
         self.frame_info_label.setText(
             'Frame: 0 (00:00:00) | FPS: -1'
@@ -256,8 +257,14 @@ class MainWindow(QMainWindow):
     def track_video(self):
         dialog = TrackingDialog(self.video_widget.video)
         dialog.tracking_complete.connect(self.load_tracking_data)
+        dialog.tracking_preview.connect(self.show_tracking_preview)
         dialog.exec_()
 
+    @pyqtSlot(object)
+    def show_tracking_preview(self, tracking_data):
+        self.video_widget.tracking_data = tracking_data
+        self.video_widget.update_frame_label()
+
     @pyqtSlot(bool, str)
     def load_tracking_data(self, is_complete, tracking_data_filename):
         if not is_complete:
@@ -266,6 +273,14 @@ class MainWindow(QMainWindow):
         tracking_data_filename = str(tracking_data_filename)
         try:
             tracking_data = pd.read_excel(tracking_data_filename, index='frame')
+            # results are saved in the coordinates of the source video, so
+            # map them back onto the (converted) video being shown.
+            geometry = load_frame_geometry(self.video_widget.video_filename)
+            if geometry is not None:
+                points = geometry.from_source(
+                    tracking_data[['rr', 'cc']].values)
+                tracking_data['rr'] = points[:, 0]
+                tracking_data['cc'] = points[:, 1]
             self.video_widget.tracking_data = tracking_data
             self.video_widget.update_frame_label()
         except:
@@ -58,5 +58,6 @@ if __name__ == '__main__':
         entry_points="""
             [console_scripts]
             epm-tracker=epm.entry:launch_gui
+            epm=epm.entry:cli
         """
     )
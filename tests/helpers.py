@@ -0,0 +1,42 @@
+# Helpers shared by the tests go here.
+
+import motmot.FlyMovieFormat.FlyMovieFormat as FMF
+import numpy as np
+
+from epm._tracking_algorithms import tracking_results_to_df
+
+def write_video(filename, n_frames=40, height=60, width=80, noise=0):
+    """Writes a small .fmf video of a dark square crossing a bright
+    background.
+
+    If noise is given, a (reproducible) random number of grey levels, up to
+    noise, is added to each pixel.
+
+    Returns
+    -------
+    centroids : np.array of shape [n_frames, 2]
+        (rr, cc) position of the square in each frame.
+    """
+    saver = FMF.FlyMovieSaver(filename, version=3, format='MONO8',
+        bits_per_pixel=8)
+    centroids = np.zeros((n_frames, 2))
+    random_state = np.random.RandomState(0)
+    for frame_ix in xrange(n_frames):
+        frame = np.full((height, width), 200, dtype=np.uint8)
+        rr, cc = height // 2, 10 + frame_ix * (width - 20) // n_frames
+        frame[rr - 4:rr + 5, cc - 4:cc + 5] = 20
+        if noise > 0:
+            frame += random_state.randint(0, noise + 1,
+                size=frame.shape).astype(np.uint8)
+        centroids[frame_ix] = rr, cc
+        saver.add_frame(frame, float(frame_ix))
+    saver.close()
+    return centroids
+
+def save_tracking_data_as_csv(results, filename, geometry=None):
+    """Stands in for save_tracking_data (which needs openpyxl to write
+    .xlsx files), saving results as CSV instead."""
+    if geometry is not None:
+        results = geometry.results_to_source(results)
+    tracking_results_to_df(results).to_csv(filename, na_rep='NA',
+        index_label='frame')
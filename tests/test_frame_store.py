@@ -0,0 +1,86 @@
+# Tests of chunked frame stores (see epm._frame_store).
+#
+# Usage: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from epm._frame_sources import open_video
+from epm._frame_store import ChunkedFrameStore, ChunkedFrameStoreSaver
+from epm._video_conversion import compress_video
+from helpers import write_video
+
+
+class FrameStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.store_filename = os.path.join(self.workdir, 'video.cfs')
+        random_state = np.random.RandomState(0)
+        # the last chunk is only partly filled.
+        self.frames = random_state.randint(0, 256,
+            size=(10, 12, 16)).astype(np.uint8)
+        self.timestamps = np.cumsum(random_state.rand(10))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def assertStoreEqual(self, store, frames, timestamps):
+        self.assertEqual(store.get_n_frames(), frames.shape[0])
+        self.assertEqual((store.get_height(), store.get_width()),
+            frames.shape[1:])
+        np.testing.assert_array_equal(store.get_all_timestamps(), timestamps)
+        for ix in xrange(frames.shape[0]):
+            frame, timestamp = store.get_frame(ix)
+            np.testing.assert_array_equal(frame, frames[ix])
+            self.assertEqual(timestamp, timestamps[ix])
+        # blocks within a chunk, across chunks, and past the last frame.
+        for start, stop in [(1, 3), (2, 9), (0, 10), (7, 20)]:
+            block, block_timestamps = store.get_frames(start, stop)
+            np.testing.assert_array_equal(block, frames[start:stop])
+            np.testing.assert_array_equal(block_timestamps,
+                timestamps[start:stop])
+
+    def test_round_trip(self):
+        for background in [None, self.frames[0]]:
+            saver = ChunkedFrameStoreSaver(self.store_filename, 12, 16,
+                chunk_size=4, background=background)
+            saver.add_frames(self.frames, self.timestamps)
+            saver.close()
+
+            store = ChunkedFrameStore(self.store_filename)
+            try:
+                self.assertStoreEqual(store, self.frames, self.timestamps)
+            finally:
+                store.close()
+
+    def test_compress_video(self):
+        video_filename = os.path.join(self.workdir, 'video.fmf')
+        write_video(video_filename)
+        video = open_video(video_filename)
+        try:
+            frames, timestamps = video.get_frames(0, video.get_n_frames())
+        finally:
+            video.close()
+
+        for delta in [False, True]:
+            n_frames = compress_video(video_filename, self.store_filename,
+                chunk_size=8, delta=delta, background_n_frames=10)
+            self.assertEqual(n_frames, frames.shape[0])
+            store = open_video(self.store_filename)
+            try:
+                self.assertIsInstance(store, ChunkedFrameStore)
+                self.assertStoreEqual(store, frames, timestamps)
+            finally:
+                store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# Tests of the tracking algorithms (see epm._tracking_algorithms).
+#
+# Usage: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from skimage.filters import threshold_otsu
+from skimage.morphology import binary_erosion
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from epm._frame_sources import open_video
+from epm._tracking_algorithms import (
+    MouseDetector,
+    _erode_batch,
+    allocate_tracking_results,
+    calc_background_image,
+    calc_otsu_threshold,
+    convert_img_to_float,
+    get_background_frame_indices,
+    get_tracking_threshold,
+    track_frames,
+    track_frames_progressive,
+    track_video,
+    track_video_batch
+)
+from helpers import write_video
+
+
+class VideoTestCase(unittest.TestCase):
+    """Tests run on a small synthetic video (see write_video)."""
+    noise = 0
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.video_filename = os.path.join(self.workdir, 'video.fmf')
+        self.centroids = write_video(self.video_filename, noise=self.noise)
+        self.video = open_video(self.video_filename)
+
+    def tearDown(self):
+        self.video.close()
+        shutil.rmtree(self.workdir)
+
+    def assertResultsEqual(self, results, expected):
+        for column in expected.dtype.names:
+            np.testing.assert_allclose(results[column], expected[column],
+                err_msg=column)
+
+
+class TrackVideoBatchTest(VideoTestCase):
+    def test_threshold(self):
+        expected = track_video(self.video, threshold=0.2,
+            background_n_frames=10)
+        results = track_video_batch(self.video, threshold=0.2,
+            background_n_frames=10, batch_size=16)
+        self.assertResultsEqual(results, expected)
+        np.testing.assert_allclose(results['rr'], self.centroids[:, 0])
+        np.testing.assert_allclose(results['cc'], self.centroids[:, 1])
+
+    def test_otsu_threshold(self):
+        expected = track_video(self.video, threshold=None,
+            background_n_frames=10)
+        results = track_video_batch(self.video, threshold=None,
+            background_n_frames=10, batch_size=16)
+        self.assertResultsEqual(results, expected)
+
+    def test_inclusion_mask(self):
+        # the square is only partly included in some frames, and excluded
+        # from others.
+        inclusion_mask = np.zeros((60, 80), dtype=np.bool)
+        inclusion_mask[20:50, 5:50] = True
+        b_img = calc_background_image(self.video, n_frames=10)
+        for threshold in [0.2, None]:
+            detector = MouseDetector(b_img, threshold=threshold,
+                inclusion_mask=inclusion_mask)
+            expected = allocate_tracking_results(self.video.get_n_frames())
+            track_frames(self.video, detector, expected)
+            results = track_video_batch(self.video, threshold=threshold,
+                background_n_frames=10, inclusion_mask=inclusion_mask,
+                batch_size=16)
+            self.assertResultsEqual(results, expected)
+            self.assertFalse(results['found'].all())
+            self.assertTrue(results['found'].any())
+
+    def test_erode_batch(self):
+        masks = np.random.RandomState(0).rand(4, 20, 30) < 0.8
+        eroded = _erode_batch(masks, np.empty_like(masks))
+        for mask, eroded_mask in zip(masks, eroded):
+            np.testing.assert_array_equal(eroded_mask, binary_erosion(mask))
+
+
+class CalcOtsuThresholdTest(VideoTestCase):
+    noise = 40
+
+    def get_expected_threshold(self, b_img, n_frames, crop):
+        # otsu threshold of all of the sampled background-subtracted frames
+        # at once (see get_otsu_threshold).
+        b_img_as_float = convert_img_to_float(b_img)
+        sub_images = [(b_img_as_float - convert_img_to_float(
+            self.video.get_frame(ix)[0]))[crop] for ix in
+            get_background_frame_indices(self.video.get_n_frames(), n_frames)]
+        return threshold_otsu(np.concatenate(sub_images))
+
+    def test_threshold(self):
+        b_img = calc_background_image(self.video, n_frames=10)
+        expected = self.get_expected_threshold(b_img, 10,
+            (slice(None), slice(None)))
+        self.assertAlmostEqual(
+            calc_otsu_threshold(self.video, b_img, n_frames=10), expected)
+        self.assertAlmostEqual(get_tracking_threshold(self.video, b_img,
+            threshold_mode='video', background_n_frames=10), expected)
+
+    def test_inclusion_mask(self):
+        inclusion_mask = np.zeros((60, 80), dtype=np.bool)
+        inclusion_mask[20:50, 5:50] = True
+        b_img = calc_background_image(self.video, n_frames=10)
+        expected = self.get_expected_threshold(b_img, 10,
+            (slice(20, 50), slice(5, 50)))
+        self.assertAlmostEqual(calc_otsu_threshold(self.video, b_img,
+            n_frames=10, inclusion_mask=inclusion_mask), expected)
+
+
+class TrackFramesProgressiveTest(VideoTestCase):
+    noise = 40
+
+    def test_progressive(self):
+        b_img = calc_background_image(self.video, n_frames=10)
+        for threshold in [0.2, None]:
+            detector = MouseDetector(b_img, threshold=threshold)
+            expected = allocate_tracking_results(self.video.get_n_frames())
+            track_frames(self.video, detector, expected)
+            for start in [0, 5]:
+                results = allocate_tracking_results(
+                    self.video.get_n_frames())
+                results[:start] = expected[:start]
+                passes = []
+                track_frames_progressive(self.video, detector, results,
+                    start=start, stride=8, pass_callback=passes.append)
+                self.assertResultsEqual(results, expected)
+                self.assertEqual(len(passes), 4)
+                self.assertResultsEqual(passes[-1], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
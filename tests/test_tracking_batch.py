@@ -0,0 +1,95 @@
+# Tests of tracking many videos at once (see epm._tracking_batch).
+#
+# Usage: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from epm import _tracking_batch
+from epm._frame_sources import open_video
+from epm._tracking_batch import get_output_filename, track_videos
+from epm._tracking_checkpoint import get_checkpoint_filename
+from epm._tracking_runner import track_video_with_settings
+from epm._tracking_settings import TrackingSettings
+from helpers import save_tracking_data_as_csv, write_video
+
+
+class TrackVideosTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.video_filename = os.path.join(self.workdir, 'video.fmf')
+        self.centroids = write_video(self.video_filename)
+        self.tracking_settings = TrackingSettings(threshold=0.2,
+            background_n_frames=10, n_processes=2)
+        # worker processes are forked, so they save results as CSV too.
+        self._save_tracking_data = _tracking_batch.save_tracking_data
+        _tracking_batch.save_tracking_data = save_tracking_data_as_csv
+
+    def tearDown(self):
+        _tracking_batch.save_tracking_data = self._save_tracking_data
+        shutil.rmtree(self.workdir)
+
+    def test_track_videos(self):
+        summary = track_videos([self.video_filename], self.tracking_settings,
+            n_processes=1)
+        self.assertEqual(summary.shape[0], 1)
+        video_summary = summary.iloc[0]
+        self.assertIsNone(video_summary['error'])
+        self.assertEqual(video_summary['n_frames'], self.centroids.shape[0])
+        self.assertEqual(video_summary['n_resumed'], 0)
+        self.assertEqual(video_summary['n_lost'], 0)
+        self.assertGreater(video_summary['frames_per_second'], 0)
+        self.assertTrue(os.path.isfile(video_summary['output']))
+        self.assertFalse(os.path.isfile(
+            get_checkpoint_filename(video_summary['output'])))
+
+    def test_resume_from_complete_checkpoint(self):
+        video = open_video(self.video_filename)
+        try:
+            track_video_with_settings(video, self.tracking_settings,
+                checkpoint_filename=get_checkpoint_filename(
+                    get_output_filename(self.video_filename)))
+        finally:
+            video.close()
+
+        summary = track_videos([self.video_filename], self.tracking_settings,
+            n_processes=1)
+        video_summary = summary.iloc[0]
+        self.assertIsNone(video_summary['error'])
+        self.assertEqual(video_summary['n_resumed'], self.centroids.shape[0])
+        self.assertTrue(pd.isnull(video_summary['frames_per_second']))
+
+    def test_settings_are_not_changed(self):
+        other_filename = os.path.join(self.workdir, 'other.fmf')
+        write_video(other_filename)
+        mask_filename = os.path.join(self.workdir, 'mask.npy')
+        np.save(mask_filename, np.ones((60, 80), dtype=np.bool))
+        self.tracking_settings.inclusion_mask_filename = mask_filename
+        for n_processes in [1, 2]:
+            track_videos([self.video_filename, other_filename],
+                self.tracking_settings, output_dir=self.workdir,
+                n_processes=n_processes)
+            self.assertEqual(self.tracking_settings.n_processes, 2)
+            self.assertIsNone(self.tracking_settings.inclusion_mask)
+
+    def test_output_collision(self):
+        other_dir = os.path.join(self.workdir, 'other')
+        os.mkdir(other_dir)
+        other_filename = os.path.join(other_dir, 'video.fmf')
+        write_video(other_filename)
+        with self.assertRaises(ValueError):
+            track_videos([self.video_filename, other_filename],
+                self.tracking_settings, output_dir=self.workdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
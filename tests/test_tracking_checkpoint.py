@@ -0,0 +1,122 @@
+# Tests of checkpointing tracking results (see epm._tracking_checkpoint).
+#
+# Usage: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from epm._frame_sources import open_video
+from epm._tracking_checkpoint import (
+    CheckpointMismatchError,
+    get_checkpoint_filename,
+    get_n_checkpointed_frames
+)
+from epm._tracking_runner import (
+    TrackingCancelledError,
+    TrackingControl,
+    track_video_with_settings
+)
+from epm._tracking_settings import TrackingSettings
+from helpers import write_video
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.video_filename = os.path.join(self.workdir, 'video.fmf')
+        self.centroids = write_video(self.video_filename, noise=40)
+        self.video = open_video(self.video_filename)
+        self.checkpoint_filename = get_checkpoint_filename(
+            self.video_filename)
+
+    def tearDown(self):
+        self.video.close()
+        shutil.rmtree(self.workdir)
+
+    def track_until_cancelled(self, tracking_settings, n_frames):
+        """Tracks the video with a checkpoint, cancelling once n_frames
+        frames have been tracked."""
+        control = TrackingControl()
+
+        def progress_callback(ix):
+            if ix + 1 >= n_frames:
+                control.cancel()
+
+        with self.assertRaises(TrackingCancelledError):
+            track_video_with_settings(self.video, tracking_settings,
+                progress_callback=progress_callback,
+                checkpoint_filename=self.checkpoint_filename,
+                checkpoint_every=10, control=control)
+
+    def test_resume(self):
+        for n_processes in [1, 2]:
+            tracking_settings = TrackingSettings(threshold=0.2,
+                background_n_frames=10, n_processes=n_processes)
+            expected = track_video_with_settings(self.video,
+                tracking_settings)
+            # when tracking with more than one process, cancellation is
+            # only noticed once the next chunk is complete.
+            self.track_until_cancelled(tracking_settings, n_frames=15)
+            n_checkpointed = get_n_checkpointed_frames(
+                self.checkpoint_filename)
+            self.assertTrue(0 < n_checkpointed < self.video.get_n_frames())
+
+            n_resumed = []
+            results = track_video_with_settings(self.video,
+                tracking_settings,
+                checkpoint_filename=self.checkpoint_filename,
+                checkpoint_every=10, resume_callback=n_resumed.append)
+            self.assertEqual(n_resumed, [n_checkpointed])
+            for column in expected.dtype.names:
+                np.testing.assert_allclose(results[column], expected[column],
+                    err_msg=column)
+
+            # resuming from a complete checkpoint doesn't track any frames.
+            results = track_video_with_settings(self.video,
+                tracking_settings,
+                checkpoint_filename=self.checkpoint_filename,
+                resume_callback=n_resumed.append)
+            self.assertEqual(n_resumed[1], self.video.get_n_frames())
+            np.testing.assert_array_equal(results, expected)
+            os.remove(self.checkpoint_filename)
+            os.remove(self.checkpoint_filename + '.json')
+
+    def test_settings_mismatch(self):
+        tracking_settings = TrackingSettings(threshold=0.2,
+            background_n_frames=10)
+        self.track_until_cancelled(tracking_settings, n_frames=25)
+        tracking_settings.threshold = 0.3
+        with self.assertRaises(CheckpointMismatchError):
+            track_video_with_settings(self.video, tracking_settings,
+                checkpoint_filename=self.checkpoint_filename)
+        # the checkpoint is left as it was.
+        self.assertEqual(get_n_checkpointed_frames(self.checkpoint_filename),
+            20)
+
+    def test_n_checkpointed_frames(self):
+        self.assertEqual(
+            get_n_checkpointed_frames(self.checkpoint_filename), 0)
+        self.track_until_cancelled(TrackingSettings(threshold=0.2,
+            background_n_frames=10), n_frames=25)
+        self.assertEqual(get_n_checkpointed_frames(self.checkpoint_filename),
+            20)
+
+    def test_cancelled_progressive_tracking(self):
+        # progressive results are only checkpointed once every pass is
+        # complete.
+        self.track_until_cancelled(TrackingSettings(threshold=0.2,
+            background_n_frames=10, progressive_stride=8), n_frames=25)
+        self.assertEqual(get_n_checkpointed_frames(self.checkpoint_filename),
+            0)
+
+
+if __name__ == '__main__':
+    unittest.main()
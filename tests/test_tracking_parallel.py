@@ -0,0 +1,66 @@
+# Tests of tracking a video across many processes (see
+# epm._tracking_parallel).
+#
+# Usage: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from epm._frame_sources import open_video
+from epm._tracking_algorithms import track_video
+from epm._tracking_parallel import track_video_parallel
+from epm._tracking_runner import track_video_with_settings
+from epm._tracking_settings import TrackingSettings
+from helpers import write_video
+
+
+class TrackVideoParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.video_filename = os.path.join(self.workdir, 'video.fmf')
+        self.centroids = write_video(self.video_filename, noise=40)
+        self.video = open_video(self.video_filename)
+
+    def tearDown(self):
+        self.video.close()
+        shutil.rmtree(self.workdir)
+
+    def assertResultsEqual(self, results, expected):
+        for column in expected.dtype.names:
+            np.testing.assert_allclose(results[column], expected[column],
+                err_msg=column)
+
+    def test_parallel(self):
+        for threshold in [0.2, None]:
+            expected = track_video(self.video, threshold=threshold,
+                background_n_frames=10)
+            # chunks don't evenly divide the video.
+            results = track_video_parallel(self.video_filename,
+                threshold=threshold, background_n_frames=10, n_processes=2,
+                chunk_size=7)
+            self.assertResultsEqual(results, expected)
+
+    def test_track_video_with_settings(self):
+        results = []
+        for n_processes in [1, 2]:
+            tracking_settings = TrackingSettings(threshold=0.2,
+                background_n_frames=10, n_processes=n_processes)
+            results.append(track_video_with_settings(self.video,
+                tracking_settings, checkpoint_every=7))
+        self.assertResultsEqual(results[1], results[0])
+        np.testing.assert_allclose(results[1]['rr'], self.centroids[:, 0],
+            atol=0.5)
+        np.testing.assert_allclose(results[1]['cc'], self.centroids[:, 1],
+            atol=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
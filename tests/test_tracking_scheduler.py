@@ -0,0 +1,84 @@
+# Tests of scheduling tracking jobs (see epm._tracking_scheduler).
+#
+# Usage: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from epm import _tracking_batch
+from epm._frame_sources import open_video
+from epm._tracking_checkpoint import get_checkpoint_filename
+from epm._tracking_runner import track_video_with_settings
+from epm._tracking_scheduler import (
+    DONE,
+    TrackingJob,
+    read_manifest,
+    run_jobs
+)
+from epm._tracking_settings import TrackingSettings
+from helpers import save_tracking_data_as_csv, write_video
+
+
+class RunJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.video_filename = os.path.join(self.workdir, 'video.fmf')
+        write_video(self.video_filename)
+        self.state_filename = os.path.join(self.workdir, 'state.json')
+        # worker processes are forked, so they save results as CSV too.
+        self._save_tracking_data = _tracking_batch.save_tracking_data
+        _tracking_batch.save_tracking_data = save_tracking_data_as_csv
+
+    def tearDown(self):
+        _tracking_batch.save_tracking_data = self._save_tracking_data
+        shutil.rmtree(self.workdir)
+
+    def get_job(self, threshold, name):
+        return TrackingJob(self.video_filename,
+            os.path.join(self.workdir, name),
+            TrackingSettings(threshold=threshold, background_n_frames=10))
+
+    def test_jobs_sharing_a_video(self):
+        jobs = [self.get_job(0.2, 'low.csv'), self.get_job(0.25, 'high.csv')]
+        # leave a checkpoint, made with other settings, for the first job.
+        video = open_video(self.video_filename)
+        try:
+            track_video_with_settings(video, TrackingSettings(threshold=0.3,
+                background_n_frames=10), checkpoint_filename=(
+                    get_checkpoint_filename(jobs[0].output_filename)))
+        finally:
+            video.close()
+
+        state_file = run_jobs(jobs, self.state_filename, n_processes=2,
+            max_retries=0, poll_interval=0.05)
+        for job in jobs:
+            record = state_file.get(job)
+            self.assertEqual(record['state'], DONE, record['error'])
+            self.assertEqual(record['attempts'], 1)
+            self.assertTrue(os.path.isfile(job.output_filename))
+            self.assertFalse(os.path.isfile(
+                get_checkpoint_filename(job.output_filename)))
+
+    def test_duplicate_outputs(self):
+        jobs = [self.get_job(0.2, 'out.csv'), self.get_job(0.25, 'out.csv')]
+        with self.assertRaises(ValueError):
+            run_jobs(jobs, self.state_filename, n_processes=1)
+
+        manifest_filename = os.path.join(self.workdir, 'manifest.csv')
+        manifest = pd.DataFrame({'video': ['video.fmf', 'video.fmf'],
+            'threshold': [0.2, 0.25], 'output': ['out.csv', 'out.csv']})
+        manifest.to_csv(manifest_filename, index=False)
+        with self.assertRaises(ValueError):
+            read_manifest(manifest_filename, TrackingSettings())
+
+
+if __name__ == '__main__':
+    unittest.main()